@@ -1,6 +1,9 @@
 import logging
 import re
 from db_utils import get_db_connection
+import roster_index
+import student_keys
+import badges
 
 logger = logging.getLogger(__name__)
 
@@ -45,23 +48,17 @@ def add_new_student(data):
     try:
         cur = conn.cursor()
 
-        # 2. Check Duplicates (SQL way)
-        # We look for matches on Email OR Phone OR Exact Name
+        # 2. Check Duplicates (indexed match keys: accent/spelling-insensitive name, phone, email)
         full_name = data['full_name'].strip()
         email = data.get('email', '').strip()
         phone = data.get('phone', '').strip()
 
-        # Construct query dynamically to handle empty email/phone
-        cur.execute("""
-            SELECT id, full_name FROM students 
-            WHERE (LOWER(full_name) = LOWER(%s))
-            OR (LENGTH(%s) > 0 AND email = %s)
-            OR (LENGTH(%s) > 0 AND phone = %s)
-        """, (full_name, email, email, phone, phone))
-        
-        duplicates = cur.fetchall()
+        duplicates = [
+            m for m in student_keys.find_matches(cur, full_name, phone, email)
+            if m['score'] >= student_keys.BLOCK_THRESHOLD or 'phone' in m['reasons'] or 'email' in m['reasons']
+        ]
         if duplicates:
-            logger.warning(f"Duplicate blocked: {duplicates}")
+            logger.warning(f"Duplicate blocked: {[(d['id'], d['full_name'], d['reasons']) for d in duplicates]}")
             return False, f"Potential duplicate found: {duplicates[0]['full_name']}"
 
         # 3. Insert
@@ -83,7 +80,10 @@ def add_new_student(data):
         
         # We just need the ID to ensure it worked, though we don't return it currently
         new_id = cur.fetchone()['id']
+        student_keys.save_keys(cur, new_id, full_name, phone, email)
+        badges.assign_missing(cur, [new_id])
         conn.commit()
+        roster_index.mark_stale()
         
         # Note: We do NOT log to audit_log here anymore. 
         # The main app.py handles logging to prevent schema mismatches.
@@ -0,0 +1,209 @@
+"""
+alert_coalescer.py - Time-windowed digests for High Point alerts
+Each channel (email, sms, gateway, whatsapp) has its own coalescing window.
+Awards inside the window are accumulated and sent as ONE digest when the
+window closes; a window of 0 sends immediately (the original behaviour).
+Urgent awards (>= POINT_ALERT_URGENT_THRESHOLD) bypass the window.
+
+Windows are read from system_settings (seconds):
+    HIGH_POINT_WINDOW_EMAIL, HIGH_POINT_WINDOW_SMS,
+    HIGH_POINT_WINDOW_GATEWAY, HIGH_POINT_WINDOW_WHATSAPP
+Every window defaults to 0, so coalescing is opt-in.
+
+Windows are per process: pending digests live in this worker's memory, so
+each gunicorn worker sends its own digest. Pending events are flushed at
+interpreter exit (a graceful restart/deploy); a process that is killed
+outright loses whatever was still waiting.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime
+import alerts
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('email', 'sms', 'gateway', 'whatsapp')
+
+WINDOW_SETTING_KEYS = {
+    'email': 'HIGH_POINT_WINDOW_EMAIL',
+    'sms': 'HIGH_POINT_WINDOW_SMS',
+    'gateway': 'HIGH_POINT_WINDOW_GATEWAY',
+    'whatsapp': 'HIGH_POINT_WINDOW_WHATSAPP',
+}
+
+# Used when a window setting is missing: send immediately (the original behaviour)
+DEFAULT_WINDOWS = {'email': 0, 'sms': 0, 'gateway': 0, 'whatsapp': 0}
+
+DIGEST_MAX_LINES = 15
+
+_lock = threading.Lock()
+_pending = {}      # channel -> list of events
+_recipients = {}   # channel -> latest recipient list
+_timers = {}       # window seconds -> threading.Timer (channels with equal windows flush together)
+_channel_window = {}  # channel -> window it was last queued with, so a timer only flushes its own channels
+
+
+def parse_windows(settings):
+    """Builds {channel: seconds} from a system_settings dict, falling back to DEFAULT_WINDOWS."""
+    windows = {}
+    for channel, key in WINDOW_SETTING_KEYS.items():
+        try:
+            windows[channel] = max(0, int(settings.get(key) or DEFAULT_WINDOWS[channel]))
+        except (TypeError, ValueError):
+            windows[channel] = DEFAULT_WINDOWS[channel]
+    return windows
+
+
+def submit(event, recipients, windows, urgent=False):
+    """
+    event: dict with student, points, activity, staff
+    recipients: {channel: [addresses]} (empty/None channels are skipped)
+    windows: {channel: seconds}
+    Returns the list of channels that were queued (the rest were sent immediately).
+    """
+    event = dict(event, at=event.get('at') or datetime.now())
+    immediate = {}
+    queued = []
+
+    with _lock:
+        for channel in CHANNELS:
+            targets = recipients.get(channel)
+            if not targets:
+                continue
+            window = windows.get(channel, 0)
+            if urgent or window <= 0:
+                immediate[channel] = ([event], targets)
+                continue
+
+            _pending.setdefault(channel, []).append(event)
+            _recipients[channel] = targets
+            _channel_window[channel] = window
+            queued.append(channel)
+            if window not in _timers:
+                timer = threading.Timer(window, _flush_window, args=(window,))
+                timer.daemon = True
+                _timers[window] = timer
+                timer.start()
+
+    if immediate:
+        _dispatch(immediate)
+    return queued
+
+
+def _flush_window(window):
+    """Timer callback: sends every channel whose window matches."""
+    with _lock:
+        _timers.pop(window, None)
+    flush(window)
+
+
+def flush(window=None):
+    """Sends pending digests now (all channels, or only those using `window`)."""
+    batch = {}
+    with _lock:
+        for channel in list(_pending.keys()):
+            if window is not None and _channel_window.get(channel) != window:
+                continue
+            events = _pending.pop(channel)
+            if events:
+                batch[channel] = (events, _recipients.get(channel))
+    if batch:
+        _dispatch(batch)
+
+
+@atexit.register
+def _flush_at_exit():
+    """Sends what is still waiting when the worker shuts down, instead of dropping it."""
+    try:
+        flush()
+    except Exception:
+        logger.exception("Failed to flush pending High Point digests at exit")
+
+
+def _dispatch(batch):
+    """batch: {channel: (events, recipients)}. Email and gateway share one Resend batch call."""
+    email_batch = []
+
+    if 'email' in batch:
+        events, targets = batch['email']
+        email_to = alerts.resolve_email_recipients(targets)
+        if email_to:
+            subject, html = format_email(events)
+            email_batch.append({"subject": subject, "to": email_to, "html": html, "label": "EMAIL"})
+
+    if 'gateway' in batch:
+        events, targets = batch['gateway']
+        try:
+            if alerts.is_email_sms_enabled():
+                email_batch.extend(alerts.gateway_messages(format_gateway(events), targets))
+        except Exception:
+            logger.exception("Failed to prepare Gateway SMS digest")
+
+    if email_batch:
+        try:
+            alerts.send_email_batch(email_batch)
+        except Exception:
+            logger.exception("Failed to trigger Email/Gateway Alert")
+
+    if 'sms' in batch:
+        events, targets = batch['sms']
+        try:
+            alerts.send_sms(format_sms(events), targets)
+        except Exception:
+            logger.exception("Failed to trigger Twilio SMS")
+
+    if 'whatsapp' in batch:
+        events, targets = batch['whatsapp']
+        try:
+            alerts.send_whatsapp(format_whatsapp(events), targets)
+        except Exception:
+            logger.exception("Failed to trigger WhatsApp Alert")
+
+
+# --- Message Formatting (single events keep the original wording) ---
+
+def _total(events):
+    return sum(e['points'] for e in events)
+
+
+def format_email(events):
+    if len(events) == 1:
+        e = events[0]
+        return (f"High Point Alert: {e['points']} pts",
+                f"Student <b>{e['student']}</b> was awarded <b>{e['points']} points</b>.<br>Reason: {e['activity']}<br>Staff: {e['staff']}")
+
+    rows = "".join(
+        f"<tr><td>{e['at'].strftime('%H:%M')}</td><td>{e['student']}</td><td>{e['points']}</td><td>{e['activity']}</td><td>{e['staff']}</td></tr>"
+        for e in events
+    )
+    html = (
+        f"<h3>{len(events)} high point awards ({_total(events)} pts total)</h3>"
+        f"<table border='1' cellpadding='4'><tr><th>Time</th><th>Student</th><th>Points</th><th>Reason</th><th>Staff</th></tr>{rows}</table>"
+    )
+    return f"High Point Digest: {len(events)} awards", html
+
+
+def format_sms(events):
+    if len(events) == 1:
+        e = events[0]
+        return f"High Point Alert: {e['points']} pts awarded to {e['student']}. Check email for details."
+    return f"High Point Digest: {len(events)} awards ({_total(events)} pts total). Check email for details."
+
+
+def format_gateway(events):
+    if len(events) == 1:
+        e = events[0]
+        return f"High Point: {e['points']} pts for {e['student']}."
+    return f"High Point: {len(events)} awards, {_total(events)} pts total."
+
+
+def format_whatsapp(events):
+    if len(events) == 1:
+        e = events[0]
+        return f"🏆 High Point Alert: {e['student']} was awarded {e['points']} points for {e['activity']}. Staff: {e['staff']}"
+
+    lines = [f"• {e['student']}: {e['points']} pts ({e['activity']})" for e in events[:DIGEST_MAX_LINES]]
+    if len(events) > DIGEST_MAX_LINES:
+        lines.append(f"…and {len(events) - DIGEST_MAX_LINES} more")
+    return f"🏆 High Point Digest: {len(events)} awards, {_total(events)} pts total\n" + "\n".join(lines)
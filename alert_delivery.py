@@ -0,0 +1,187 @@
+"""
+alert_delivery.py - Per-message alert delivery records
+Every alert send attempt sequence ends in ONE alert_delivery row:
+channel, provider, recipient, final status, attempt count and latency.
+This replaces grepping audit_log for EMAIL_SENT / SMS_FAILED_INDIVIDUAL /
+WHATSAPP_TIMEOUT strings when asking "how healthy are our alerts?".
+
+Statuses:
+    sent     - delivered (possibly after retries)
+    failed   - terminal failure after all attempts (the dead-letter list)
+    skipped  - provider not configured; nothing was attempted
+"""
+import os
+import time
+import logging
+from psycopg2.extras import execute_values
+from db_utils import get_db_connection
+from alert_providers import ProviderConfigError, ProviderThrottled, ProviderTimeout
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv('ALERT_MAX_ATTEMPTS', '3'))
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 10.0
+
+BUCKETS = ('minute', 'hour', 'day')
+
+
+def attempt(send_fn, max_attempts=MAX_ATTEMPTS):
+    """
+    Calls send_fn() until it succeeds, retrying only throttling and timeouts
+    (other errors are not going to fix themselves).
+    Returns a dict: status, attempts, latency_ms, error, result, exception.
+    latency_ms covers every attempt including backoff sleeps.
+    """
+    started = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        exc = None
+        try:
+            result = send_fn()
+            status, error = 'sent', None
+        except ProviderConfigError as e:
+            exc = e
+            result, status, error = None, 'skipped', str(e)
+        except (ProviderThrottled, ProviderTimeout) as e:
+            if attempts < max_attempts:
+                retry_after = getattr(e, 'retry_after', None)
+                try:
+                    delay = float(retry_after) if retry_after else RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                except (TypeError, ValueError):
+                    delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                time.sleep(min(delay, RETRY_MAX_SECONDS))
+                continue
+            exc = e
+            result, status, error = None, 'failed', str(e)
+        except Exception as e:
+            exc = e
+            result, status, error = None, 'failed', str(e)
+
+        return {
+            'status': status,
+            'attempts': attempts,
+            'latency_ms': int((time.perf_counter() - started) * 1000),
+            'error': error,
+            'result': result,
+            'exception': exc,
+        }
+
+
+def delivery_row(channel, provider_name, recipient, outcome, subject=None, message_id=None):
+    """Builds a row for record() from an attempt() outcome."""
+    return (channel, provider_name, str(recipient)[:255], (subject or '')[:255] or None,
+            outcome['status'], outcome['attempts'], outcome['latency_ms'],
+            outcome['error'], message_id)
+
+
+def record(rows):
+    """Inserts delivery rows (see delivery_row) in one round trip. Never raises."""
+    if not rows: return
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        cur = conn.cursor()
+        execute_values(cur, """
+            INSERT INTO alert_delivery
+                (channel, provider, recipient, subject, status, attempts, latency_ms, error, provider_message_id)
+            VALUES %s
+        """, rows)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not record alert deliveries: {e}")
+    finally:
+        conn.close()
+
+
+def summary(hours=24, bucket='hour', provider=None):
+    """
+    Success rate and latency percentiles per provider/channel.
+    Returns {'totals': [...], 'series': [...]} where series is bucketed by `bucket`.
+    Skipped rows are excluded from the success rate (nothing was attempted).
+    Only raw rows are read: anything older than the scheduler's
+    ALERT_DELIVERY_RETENTION_DAYS lives in alert_delivery_daily instead.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {BUCKETS}")
+
+    where = "created_at >= CURRENT_TIMESTAMP - (%s * INTERVAL '1 hour') AND status <> 'skipped'"
+    params = [hours]
+    if provider:
+        where += " AND provider = %s"
+        params.append(provider)
+
+    aggregates = """
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE status = 'sent') AS sent,
+        COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+        ROUND(100.0 * COUNT(*) FILTER (WHERE status = 'sent') / COUNT(*), 1) AS success_rate,
+        ROUND(AVG(attempts), 2) AS avg_attempts,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS p50_ms,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_ms
+    """
+
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT provider, channel, {aggregates}
+            FROM alert_delivery WHERE {where}
+            GROUP BY provider, channel
+            ORDER BY provider, channel
+        """, params)
+        totals = [_normalize(row) for row in cur.fetchall()]
+
+        cur.execute(f"""
+            SELECT date_trunc('{bucket}', created_at) AS bucket, provider, channel, {aggregates}
+            FROM alert_delivery WHERE {where}
+            GROUP BY 1, provider, channel
+            ORDER BY 1, provider, channel
+        """, params)
+        series = [_normalize(row) for row in cur.fetchall()]
+        return {'totals': totals, 'series': series}
+    finally:
+        conn.close()
+
+
+def dead_letters(limit=100, hours=None, channel=None):
+    """Most recent terminal failures, newest first."""
+    where = "status = 'failed'"
+    params = []
+    if hours:
+        where += " AND created_at >= CURRENT_TIMESTAMP - (%s * INTERVAL '1 hour')"
+        params.append(hours)
+    if channel:
+        where += " AND channel = %s"
+        params.append(channel)
+    params.append(limit)
+
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, created_at, channel, provider, recipient, subject, attempts, latency_ms, error
+            FROM alert_delivery WHERE {where}
+            ORDER BY created_at DESC LIMIT %s
+        """, params)
+        return [_normalize(row) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def _normalize(row):
+    """RealDictRow -> JSON-friendly dict (Decimal -> float, timestamps -> ISO)."""
+    out = {}
+    for key, val in dict(row).items():
+        if hasattr(val, 'isoformat'):
+            val = val.isoformat()
+        elif val is not None and not isinstance(val, (int, float, str, bool)):
+            val = float(val)
+        out[key] = val
+    return out
@@ -0,0 +1,319 @@
+"""
+alert_providers.py - Delivery backends for the alert system
+alerts.py decides WHAT to send and logs the outcome; a provider only
+performs the delivery. Three kinds exist:
+    email    - Resend (single + batch)
+    sms      - Twilio
+    whatsapp - node send_message.js
+
+Backend selection (env ALERT_PROVIDER_BACKEND):
+    live (default) - the real services above
+    fake           - in-process FakeProvider for offline benchmarking.
+                     Tuned with FAKE_PROVIDER_LATENCY_MS, FAKE_PROVIDER_JITTER_MS,
+                     FAKE_PROVIDER_FAILURE_RATE and FAKE_PROVIDER_THROTTLE_RATE.
+
+Providers report problems by raising the ProviderError family, so alerts.py
+can map them onto its audit labels (_FAILED, _CONFIG_ERROR, _TIMEOUT, ...).
+"""
+import os
+import time
+import uuid
+import random
+import logging
+import threading
+import subprocess
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_KINDS = ('email', 'sms', 'whatsapp')
+
+WHATSAPP_SERVICE_DIR = os.path.join(os.path.dirname(__file__), 'whatsapp_service')
+RESEND_API_URL = 'https://api.resend.com'
+
+
+# --- ERRORS ---
+
+class ProviderError(Exception):
+    """Delivery failed."""
+
+
+class ProviderConfigError(ProviderError):
+    """Credentials or local install missing; retrying will not help."""
+
+
+class ProviderThrottled(ProviderError):
+    """The service rate-limited us (HTTP 429). retry_after is in seconds, if known."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProviderTimeout(ProviderError):
+    """The service did not answer in time."""
+
+
+class ProviderSessionError(ProviderError):
+    """WhatsApp session missing (code 2) or expired (code 3)."""
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+# --- LIVE PROVIDERS ---
+
+class ResendProvider:
+    """
+    Resend over one keep-alive requests.Session.
+    The SDK opens a new connection per call; a pooled session keeps TLS alive.
+    """
+    name = 'resend'
+
+    def __init__(self):
+        self._session = None
+        self._session_key = None
+        self._lock = threading.Lock()
+
+    def _get_session(self, api_key):
+        with self._lock:
+            if self._session is None or self._session_key != api_key:
+                session = requests.Session()
+                session.headers.update({
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                })
+                session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=2))
+                self._session = session
+                self._session_key = api_key
+            return self._session
+
+    def _post(self, path, payload):
+        api_key = os.getenv('RESEND_API_KEY')
+        if not api_key:
+            raise ProviderConfigError("Missing RESEND_API_KEY.")
+        try:
+            response = self._get_session(api_key).post(f"{RESEND_API_URL}{path}", json=payload, timeout=15)
+        except requests.Timeout as e:
+            raise ProviderTimeout(str(e))
+        if response.status_code == 429:
+            raise ProviderThrottled(f"HTTP 429: {response.text}", response.headers.get('Retry-After'))
+        if response.status_code >= 400:
+            raise ProviderError(f"HTTP {response.status_code}: {response.text}")
+        return response.json()
+
+    def send(self, params):
+        """params: Resend email dict (without 'from'/'reply_to'). Returns the message id."""
+        response = self._post("/emails", self._with_sender(params))
+        if not response or 'id' not in response:
+            raise ProviderError(f"Unexpected response: {response}")
+        return response['id']
+
+    def send_batch(self, params_list):
+        """Sends up to 100 emails in one call. Returns ids in order (None where missing)."""
+        response = self._post("/emails/batch", [self._with_sender(p) for p in params_list])
+        ids = [item.get('id') for item in (response or {}).get('data', [])]
+        return ids + [None] * (len(params_list) - len(ids))
+
+    @staticmethod
+    def _with_sender(params):
+        return {"from": os.getenv('MAIL_USERNAME'), "reply_to": os.getenv('ADMIN_EMAIL'), **params}
+
+
+class TwilioProvider:
+    """
+    Twilio with one shared client. TwilioHttpClient keeps a pooled
+    requests.Session, so TLS connections are reused across alerts.
+    The client is rebuilt only if the credentials change.
+    """
+    name = 'twilio'
+
+    def __init__(self):
+        self._client = None
+        self._client_key = None
+        self._lock = threading.Lock()
+
+    def _get_client(self, account_sid, auth_token):
+        from twilio.rest import Client as TwilioClient
+        from twilio.http.http_client import TwilioHttpClient
+        with self._lock:
+            if self._client is None or self._client_key != (account_sid, auth_token):
+                http_client = TwilioHttpClient(pool_connections=True, max_retries=2)
+                self._client = TwilioClient(account_sid, auth_token, http_client=http_client)
+                self._client_key = (account_sid, auth_token)
+            return self._client
+
+    def send(self, to_number, body):
+        """Returns the message SID."""
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+        from_number = os.getenv('TWILIO_PHONE_NUMBER')
+        if not all([account_sid, auth_token, from_number]):
+            raise ProviderConfigError("Missing Twilio credentials")
+
+        from twilio.base.exceptions import TwilioRestException
+        try:
+            message = self._get_client(account_sid, auth_token).messages.create(body=body, from_=from_number, to=to_number)
+        except TwilioRestException as e:
+            if e.status == 429:
+                raise ProviderThrottled(str(e))
+            raise ProviderError(str(e))
+        return message.sid
+
+
+class WhatsAppNodeProvider:
+    """Runs whatsapp_service/send_message.js once per recipient."""
+    name = 'whatsapp_node'
+
+    def send(self, to_number, body):
+        send_script = os.path.join(WHATSAPP_SERVICE_DIR, 'send_message.js')
+        if not os.path.exists(send_script):
+            raise ProviderConfigError("WhatsApp service not installed")
+
+        try:
+            result = subprocess.run(
+                ['node', send_script, to_number, body],
+                capture_output=True,
+                text=True,
+                timeout=90,
+                cwd=WHATSAPP_SERVICE_DIR,
+                env={**os.environ, 'DATABASE_URL': os.getenv('DATABASE_URL', '')}
+            )
+        except subprocess.TimeoutExpired:
+            raise ProviderTimeout(f"send_message.js timed out for {to_number}")
+
+        if result.returncode in (2, 3):
+            raise ProviderSessionError(f"Exit code {result.returncode}: {result.stderr}", result.returncode)
+        if result.returncode != 0:
+            raise ProviderError(f"Exit: {result.returncode} Err: {result.stderr}")
+        return None
+
+
+# --- FAKE PROVIDER ---
+
+class FakeProvider:
+    """
+    In-process stand-in for any provider. Sleeps for a simulated latency, then
+    succeeds, fails or throttles at the configured rates. Keeps counters
+    (including peak concurrency) so a benchmark can see backpressure.
+    """
+
+    def __init__(self, name, latency_ms=50.0, jitter_ms=0.0, failure_rate=0.0, throttle_rate=0.0, seed=None):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'calls': 0, 'messages': 0, 'sent': 0, 'failed': 0, 'throttled': 0,
+                       'max_in_flight': 0, 'busy_ms': 0.0}
+
+    def _roll(self):
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+            outcome = self._random.random()
+        return delay, outcome
+
+    def _deliver(self, message_count):
+        delay_ms, outcome = self._roll()
+        with self._lock:
+            self._in_flight += 1
+            self._stats['calls'] += 1
+            self._stats['messages'] += message_count
+            self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._in_flight)
+        try:
+            time.sleep(delay_ms / 1000.0)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._stats['busy_ms'] += delay_ms
+
+        if outcome < self.throttle_rate:
+            with self._lock:
+                self._stats['throttled'] += message_count
+            raise ProviderThrottled(f"{self.name}: simulated 429", retry_after=1)
+        if outcome < self.throttle_rate + self.failure_rate:
+            with self._lock:
+                self._stats['failed'] += message_count
+            raise ProviderError(f"{self.name}: simulated failure")
+        with self._lock:
+            self._stats['sent'] += message_count
+
+    def send(self, *args, **kwargs):
+        self._deliver(1)
+        return f"fake-{uuid.uuid4().hex[:12]}"
+
+    def send_batch(self, params_list):
+        self._deliver(len(params_list))
+        return [f"fake-{uuid.uuid4().hex[:12]}" for _ in params_list]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=self._in_flight)
+
+
+# --- REGISTRY ---
+
+LIVE_PROVIDERS = {'email': ResendProvider, 'sms': TwilioProvider, 'whatsapp': WhatsAppNodeProvider}
+
+_providers = {}
+_backend = None
+_fake_options = {}
+_registry_lock = threading.Lock()
+
+
+def _env_float(key, default):
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return float(default)
+
+
+def _fake_options_from_env():
+    return {
+        'latency_ms': _env_float('FAKE_PROVIDER_LATENCY_MS', '50'),
+        'jitter_ms': _env_float('FAKE_PROVIDER_JITTER_MS', '0'),
+        'failure_rate': _env_float('FAKE_PROVIDER_FAILURE_RATE', '0'),
+        'throttle_rate': _env_float('FAKE_PROVIDER_THROTTLE_RATE', '0'),
+    }
+
+
+def configure(backend, **fake_options):
+    """
+    Switches every provider kind to 'live' or 'fake' (drops existing instances).
+    fake_options override the FAKE_PROVIDER_* env values.
+    """
+    global _backend, _fake_options
+    if backend not in ('live', 'fake'):
+        raise ValueError(f"Unknown alert provider backend: {backend}")
+    with _registry_lock:
+        _backend = backend
+        _fake_options = dict(_fake_options_from_env(), **fake_options)
+        _providers.clear()
+
+
+def get_backend():
+    return _backend or os.getenv('ALERT_PROVIDER_BACKEND', 'live').lower()
+
+
+def get_provider(kind):
+    """Returns the shared provider instance for 'email', 'sms' or 'whatsapp'."""
+    if kind not in PROVIDER_KINDS:
+        raise ValueError(f"Unknown provider kind: {kind}")
+    with _registry_lock:
+        provider = _providers.get(kind)
+        if provider is None:
+            if get_backend() == 'fake':
+                provider = FakeProvider(f"fake_{kind}", **(_fake_options or _fake_options_from_env()))
+            else:
+                provider = LIVE_PROVIDERS[kind]()
+            _providers[kind] = provider
+        return provider
+
+
+def stats():
+    """{kind: counters} for providers that keep them (fakes only)."""
+    with _registry_lock:
+        return {kind: p.stats() for kind, p in _providers.items() if hasattr(p, 'stats')}
@@ -0,0 +1,161 @@
+"""
+alert_throttle.py - Rate limiting for error alert emails
+Keeps a DB blip from turning into a thread explosion and an email storm:
+  - ERROR records go into a bounded queue drained by ONE worker thread
+  - Records are fingerprinted by traceback site (file:line + exception type)
+  - Each fingerprint gets its own token bucket (dropped once idle long enough to be full again)
+  - Suppressed/dropped counts are summarized in a periodic digest email
+Only uses the standard library so app.py can import it at startup.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Config (overridable via environment)
+QUEUE_SIZE = int(os.getenv('ERROR_ALERT_QUEUE_SIZE', '100'))
+BUCKET_CAPACITY = float(os.getenv('ERROR_ALERT_BURST', '3'))
+BUCKET_REFILL_SECONDS = float(os.getenv('ERROR_ALERT_REFILL_SECONDS', '300'))
+DIGEST_INTERVAL_SECONDS = float(os.getenv('ERROR_ALERT_DIGEST_SECONDS', '900'))
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` burst, one token every `refill_seconds`."""
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.refill_rate = 1.0 / refill_seconds if refill_seconds > 0 else float('inf')
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def fingerprint_record(record):
+    """
+    Identifies the code site an error came from.
+    Uses the innermost traceback frame when an exception is attached,
+    otherwise the logging call site.
+    """
+    if record.exc_info and record.exc_info[2] is not None:
+        exc_type = record.exc_info[0].__name__ if record.exc_info[0] else 'Exception'
+        frames = traceback.extract_tb(record.exc_info[2])
+        if frames:
+            last = frames[-1]
+            return f"{os.path.basename(last.filename)}:{last.lineno}:{exc_type}"
+        return f"{os.path.basename(record.pathname)}:{record.lineno}:{exc_type}"
+    return f"{os.path.basename(record.pathname)}:{record.lineno}"
+
+
+class ErrorAlertQueue:
+    """
+    Bounded queue + single sender thread with per-fingerprint token buckets.
+    `send_fn(subject, message)` does the actual delivery.
+    """
+
+    def __init__(self, send_fn, maxsize=QUEUE_SIZE, capacity=BUCKET_CAPACITY,
+                 refill_seconds=BUCKET_REFILL_SECONDS, digest_seconds=DIGEST_INTERVAL_SECONDS):
+        self.send_fn = send_fn
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.digest_seconds = digest_seconds
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._buckets = {}
+        self._suppressed = {}   # fingerprint -> {'count': n, 'subject': first subject seen}
+        self._dropped = 0       # records lost because the queue was full
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_digest = time.monotonic()
+
+    def submit(self, fingerprint, subject, message):
+        """Non-blocking. Returns False if the queue is full (counted for the digest)."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((fingerprint, subject, message))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="error-alert-sender", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=min(self.digest_seconds, 60))
+            except queue.Empty:
+                item = None
+
+            if item:
+                self._handle(*item)
+
+            if time.monotonic() - self._last_digest >= self.digest_seconds:
+                self._send_digest()
+
+    def _handle(self, fingerprint, subject, message):
+        bucket = self._buckets.get(fingerprint)
+        if bucket is None:
+            bucket = self._buckets[fingerprint] = TokenBucket(self.capacity, self.refill_seconds)
+
+        if not bucket.consume():
+            with self._lock:
+                entry = self._suppressed.setdefault(fingerprint, {'count': 0, 'subject': subject})
+                entry['count'] += 1
+            return
+
+        try:
+            self.send_fn(subject, message)
+        except Exception as e:
+            # WARNING (not ERROR) so a failing sender cannot feed itself
+            logger.warning(f"Error alert delivery failed: {e}")
+
+    def _evict_idle(self, now):
+        """Drops buckets that have refilled completely: a new bucket would behave the same."""
+        window = self.capacity * self.refill_seconds
+        for fingerprint in [fp for fp, b in self._buckets.items() if now - b.updated >= window]:
+            del self._buckets[fingerprint]
+
+    def _send_digest(self):
+        self._last_digest = time.monotonic()
+        self._evict_idle(self._last_digest)
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, {}
+            dropped, self._dropped = self._dropped, 0
+
+        if not suppressed and not dropped:
+            return
+
+        total = sum(v['count'] for v in suppressed.values()) + dropped
+        rows = "".join(
+            f"<tr><td>{fp}</td><td>{v['count']}</td><td>{v['subject']}</td></tr>"
+            for fp, v in sorted(suppressed.items(), key=lambda kv: -kv[1]['count'])
+        )
+        message = (
+            f"<h3>{total} error alerts were suppressed in the last {int(self.digest_seconds / 60)} minutes</h3>"
+            f"<table border='1' cellpadding='4'><tr><th>Site</th><th>Suppressed</th><th>First Subject</th></tr>{rows}</table>"
+        )
+        if dropped:
+            message += f"<p>{dropped} additional records were dropped because the alert queue was full.</p>"
+
+        try:
+            self.send_fn(f"System Error Digest: {total} suppressed", message)
+        except Exception as e:
+            logger.warning(f"Error digest delivery failed: {e}")
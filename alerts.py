@@ -3,6 +3,7 @@ alerts.py - Leer México Alert System
 Updated: Switched from SendGrid to Resend for Email/SMS Gateway
 Supports Resend, Twilio SMS, and WhatsApp Automation
 Includes Subject-Aware Audit Logging
+Delivery itself goes through alert_providers (live services or fakes)
 """
 import os
 import json
@@ -11,10 +12,15 @@ import threading
 import subprocess
 import time
 import base64
-import resend  # Updated: Using Resend SDK
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from psycopg2.extras import execute_values
 from db_utils import get_db_connection
-from twilio.rest import Client as TwilioClient
+import whatsapp_status
+import alert_providers
+import alert_delivery
+from alert_providers import ProviderConfigError, ProviderTimeout, ProviderSessionError
 
 logger = logging.getLogger(__name__)
 
@@ -22,11 +28,20 @@ logger = logging.getLogger(__name__)
 COOLDOWN_SECONDS = 5
 _last_alert_time = 0
 
+# Twilio: bounded sender pool (the provider keeps one pooled client)
+TWILIO_MAX_WORKERS = int(os.getenv('TWILIO_MAX_WORKERS', '8'))
+_twilio_pool = ThreadPoolExecutor(max_workers=TWILIO_MAX_WORKERS, thread_name_prefix='twilio-send')
+
 # Path to WhatsApp service scripts
 WHATSAPP_SERVICE_DIR = os.path.join(os.path.dirname(__file__), 'whatsapp_service')
 
-# Initialize Resend
-resend.api_key = os.getenv('RESEND_API_KEY')
+# Resend: batch endpoint for multi-message sends
+RESEND_BATCH_LIMIT = 100  # Max messages per /emails/batch call
+
+# Base64 attachments cached by content hash (the daily CSV is encoded once)
+ATTACHMENT_CACHE_SIZE = 4
+_attachment_cache = {}
+_attachment_lock = threading.Lock()
 
 def _log_to_db(action_type, details):
     """Helper to write directly to audit_log."""
@@ -43,6 +58,23 @@ def _log_to_db(action_type, details):
     except Exception as e:
         print(f"[{datetime.now()}] Failed to write to audit log: {e}")
 
+def _log_batch_to_db(entries):
+    """Writes many (action_type, details) rows to audit_log in one round trip."""
+    if not entries: return
+    try:
+        conn = get_db_connection()
+        if conn:
+            cur = conn.cursor()
+            now = datetime.now()
+            execute_values(cur, """
+                INSERT INTO audit_log (action_type, details, recorded_by, event_time)
+                VALUES %s
+            """, [(action, details, "system_alerts", now) for action, details in entries])
+            conn.commit()
+            conn.close()
+    except Exception as e:
+        print(f"[{datetime.now()}] Failed to write batch to audit log: {e}")
+
 # --- CONFIG CHECKS ---
 def _check_sms_enabled():
     """Returns True if Twilio SMS is enabled."""
@@ -96,31 +128,54 @@ def _check_whatsapp_enabled():
         return False
 
 # --- SENDING LOGIC ---
+# Each send goes through alert_delivery.attempt (retries on throttling/timeouts)
+# and leaves one alert_delivery row per recipient, next to the audit_log entry.
 
-def _send_via_twilio(body, to_numbers):
-    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-    from_number = os.getenv('TWILIO_PHONE_NUMBER')
+def _email_channel(log_label):
+    return 'gateway' if log_label == 'SMS_GATEWAY' else 'email'
 
-    if not all([account_sid, auth_token, from_number]):
-        _log_to_db("SMS_SKIPPED", "Missing Twilio credentials")
-        return
+def _send_via_twilio(body, to_numbers):
+    numbers = [n.strip() for n in to_numbers if n and n.strip()]
+    if not numbers: return
 
     try:
-        client = TwilioClient(account_sid, auth_token)
-        for number in to_numbers:
-            clean_number = number.strip()
-            if not clean_number: continue
-            try:
-                message = client.messages.create(body=body, from_=from_number, to=clean_number)
-                _log_to_db("SMS_SENT", f"SID: {message.sid} To: {clean_number}")
-            except Exception as inner_e:
-                logger.error(f"Failed to send to {clean_number}: {inner_e}")
-                _log_to_db("SMS_FAILED_INDIVIDUAL", f"To: {clean_number} Error: {str(inner_e)}")
+        provider = alert_providers.get_provider('sms')
+
+        def _send_one(clean_number):
+            outcome = alert_delivery.attempt(lambda: provider.send(clean_number, body))
+            if outcome['status'] == 'sent':
+                audit = ("SMS_SENT", f"SID: {outcome['result']} To: {clean_number}")
+            elif outcome['status'] == 'skipped':
+                audit = ("SMS_SKIPPED", outcome['error'])
+            else:
+                logger.error(f"Failed to send to {clean_number}: {outcome['error']}")
+                audit = ("SMS_FAILED_INDIVIDUAL", f"To: {clean_number} Error: {outcome['error']}")
+            row = alert_delivery.delivery_row('sms', provider.name, clean_number, outcome, message_id=outcome['result'])
+            return audit, row
+
+        # Fan out concurrently (bounded by TWILIO_MAX_WORKERS), then log all results at once
+        results = list(_twilio_pool.map(_send_one, numbers))
+        _log_batch_to_db([audit for audit, _ in results])
+        alert_delivery.record([row for _, row in results])
     except Exception as e:
         logger.error(f"Twilio Client Error: {e}")
         _log_to_db("SMS_FAILED_GLOBAL", str(e))
 
+def _encode_attachment(attachment_data):
+    """Base64-encodes attachment bytes once and reuses the result for identical content."""
+    digest = hashlib.sha256(attachment_data).hexdigest()
+    with _attachment_lock:
+        cached = _attachment_cache.get(digest)
+        if cached is not None:
+            return cached
+
+    encoded = base64.b64encode(attachment_data).decode('utf-8')
+    with _attachment_lock:
+        if len(_attachment_cache) >= ATTACHMENT_CACHE_SIZE:
+            _attachment_cache.pop(next(iter(_attachment_cache)))
+        _attachment_cache[digest] = encoded
+    return encoded
+
 def _send_via_resend(subject, message, to_emails, attachment_name, attachment_data, log_label="EMAIL"):
     """
     Sends email via Resend API.
@@ -128,87 +183,132 @@ def _send_via_resend(subject, message, to_emails, attachment_name, attachment_da
     Routes replies to a personal Gmail address.
     Includes comprehensive subject-aware logging.
     """
-    api_key = os.getenv('RESEND_API_KEY')
-    sender_email = os.getenv('MAIL_USERNAME') 
-    reply_to_email = os.getenv('ADMIN_EMAIL') 
-    
     # NEW: Formatted string for comprehensive audit logs
     log_details = f"Subject: '{subject}' | To: {to_emails}"
-    
-    if not api_key:
-        _log_to_db(f"{log_label}_CONFIG_ERROR", f"Missing RESEND_API_KEY. {log_details}")
-        return
 
     # Prep Attachments
     resend_attachments = []
     if attachment_name and attachment_data:
-        encoded_data = base64.b64encode(attachment_data).decode('utf-8')
         resend_attachments.append({
-            "content": encoded_data,
+            "content": _encode_attachment(attachment_data),
             "filename": attachment_name
         })
 
-    try:
-        email_params = {
-            "from": sender_email,
-            "to": to_emails,
-            "subject": subject,
-            "reply_to": reply_to_email,
-            "attachments": resend_attachments
-        }
-
-        # Format content based on target
-        if log_label == "SMS_GATEWAY":
-            email_params["text"] = message
-        else:
-            email_params["html"] = message
-
-        response = resend.Emails.send(email_params)
-        
-        if response and 'id' in response:
-            _log_to_db(f"{log_label}_SENT", f"ID: {response['id']} | {log_details}")
-        else:
-            _log_to_db(f"{log_label}_FAILED", f"Unexpected response: {response} | {log_details}")
+    email_params = {
+        "to": to_emails,
+        "subject": subject,
+        "attachments": resend_attachments
+    }
+
+    # Format content based on target
+    if log_label == "SMS_GATEWAY":
+        email_params["text"] = message
+    else:
+        email_params["html"] = message
+
+    provider = alert_providers.get_provider('email')
+    outcome = alert_delivery.attempt(lambda: provider.send(email_params))
+
+    if outcome['status'] == 'sent':
+        _log_to_db(f"{log_label}_SENT", f"ID: {outcome['result']} | {log_details}")
+    elif outcome['status'] == 'skipped':
+        _log_to_db(f"{log_label}_CONFIG_ERROR", f"{outcome['error']} {log_details}")
+    else:
+        logger.error(f"Resend API Error: {outcome['error']}")
+        _log_to_db(f"{log_label}_FAILED", f"API Error: {outcome['error']} | {log_details}")
+
+    alert_delivery.record([
+        alert_delivery.delivery_row(_email_channel(log_label), provider.name, addr, outcome, subject, outcome['result'])
+        for addr in to_emails
+    ])
+
+def _send_batch_via_resend(messages):
+    """
+    Sends several emails through Resend's batch endpoint (up to 100 per call).
+    Each message is a dict with 'subject', 'to' (list), 'html' or 'text',
+    and an optional 'label' used for the audit log (default EMAIL).
+    The batch endpoint does not accept attachments; use _send_via_resend for those.
+    """
+    if not messages: return
+    provider = alert_providers.get_provider('email')
+
+    for start in range(0, len(messages), RESEND_BATCH_LIMIT):
+        chunk = messages[start:start + RESEND_BATCH_LIMIT]
+        payload = []
+        for m in chunk:
+            params = {"to": m['to'], "subject": m['subject']}
+            if 'text' in m:
+                params["text"] = m['text']
+            else:
+                params["html"] = m['html']
+            payload.append(params)
+
+        results = []
+        deliveries = []
+        outcome = alert_delivery.attempt(lambda: provider.send_batch(payload))
+        if outcome['status'] == 'failed':
+            logger.error(f"Resend Batch API Error: {outcome['error']}")
+        ids = outcome['result'] or [None] * len(chunk)
+
+        for m, message_id in zip(chunk, ids):
+            label = m.get('label', 'EMAIL')
+            log_details = f"Subject: '{m['subject']}' | To: {m['to']}"
+            message_outcome = outcome
+            if outcome['status'] == 'skipped':
+                results.append((f"{label}_CONFIG_ERROR", f"{outcome['error']} {log_details}"))
+            elif outcome['status'] == 'failed':
+                results.append((f"{label}_FAILED", f"API Error: {outcome['error']} | {log_details}"))
+            elif message_id:
+                results.append((f"{label}_SENT", f"ID: {message_id} | {log_details}"))
+            else:
+                message_outcome = dict(outcome, status='failed', error='Missing ID in batch response')
+                results.append((f"{label}_FAILED", f"Missing ID in batch response | {log_details}"))
+            for addr in m['to']:
+                deliveries.append(alert_delivery.delivery_row(
+                    _email_channel(label), provider.name, addr, message_outcome, m['subject'], message_id
+                ))
 
-    except Exception as e:
-        logger.error(f"Resend API Error: {e}")
-        _log_to_db(f"{log_label}_FAILED", f"API Error: {str(e)} | {log_details}")
+        _log_batch_to_db(results)
+        alert_delivery.record(deliveries)
 
 def _send_via_whatsapp(body, to_numbers):
-    send_script = os.path.join(WHATSAPP_SERVICE_DIR, 'send_message.js')
-
-    if not os.path.exists(send_script):
-        _log_to_db("WHATSAPP_SKIPPED", "WhatsApp service not installed")
-        logger.error(f"WhatsApp send script not found: {send_script}")
-        return
+    provider = alert_providers.get_provider('whatsapp')
+    session_status = None  # Piggyback on sends to keep the cached session status fresh
+    deliveries = []
 
     for number in to_numbers:
         clean_number = number.strip()
         if not clean_number: continue
 
-        try:
-            result = subprocess.run(
-                ['node', send_script, clean_number, body],
-                capture_output=True,
-                text=True,
-                timeout=90,
-                cwd=WHATSAPP_SERVICE_DIR,
-                env={**os.environ, 'DATABASE_URL': os.getenv('DATABASE_URL', '')}
-            )
-
-            if result.returncode == 0:
-                _log_to_db("WHATSAPP_SENT", f"To: {clean_number}")
-            elif result.returncode in (2, 3):
-                _log_to_db("WHATSAPP_SESSION_ERROR", f"Exit code {result.returncode}: {result.stderr}")
-                _send_whatsapp_session_alert(result.returncode)
-                break 
-            else:
-                _log_to_db("WHATSAPP_FAILED", f"To: {clean_number} Exit: {result.returncode} Err: {result.stderr}")
-
-        except subprocess.TimeoutExpired:
+        # Each attempt boots Chromium for up to 90s, so no automatic retries here
+        outcome = alert_delivery.attempt(lambda: provider.send(clean_number, body), max_attempts=1)
+        deliveries.append(alert_delivery.delivery_row('whatsapp', provider.name, clean_number, outcome))
+        error = outcome['exception']
+
+        if outcome['status'] == 'sent':
+            _log_to_db("WHATSAPP_SENT", f"To: {clean_number}")
+            session_status = {'status': 'valid', 'message': 'WhatsApp session is valid and connected.', 'needsSetup': False}
+        elif isinstance(error, ProviderConfigError):
+            _log_to_db("WHATSAPP_SKIPPED", str(error))
+            logger.error(f"WhatsApp provider unavailable: {error}")
+            break
+        elif isinstance(error, ProviderSessionError):
+            _log_to_db("WHATSAPP_SESSION_ERROR", str(error))
+            _send_whatsapp_session_alert(error.code)
+            session_status = {
+                'status': 'no_session' if error.code == 2 else 'expired',
+                'message': 'Session not found. Please scan QR code.' if error.code == 2 else 'Session expired. Please scan QR code again.',
+                'needsSetup': True
+            }
+            break
+        elif isinstance(error, ProviderTimeout):
             _log_to_db("WHATSAPP_TIMEOUT", f"To: {clean_number}")
-        except Exception as e:
-            _log_to_db("WHATSAPP_ERROR", f"To: {clean_number} Error: {str(e)}")
+        else:
+            _log_to_db("WHATSAPP_FAILED", f"To: {clean_number} {error}")
+
+    alert_delivery.record(deliveries)
+    if session_status:
+        whatsapp_status.record_status(session_status)
 
 
 def _send_whatsapp_session_alert(exit_code):
@@ -249,28 +349,58 @@ def send_sms(message_body, to_numbers=None):
     threading.Thread(target=_send_via_twilio, args=(message_body, to_numbers), daemon=True).start()
     return True
 
+def gateway_messages(message_body, recipient_gateways):
+    """One plain-text batch message per carrier address (recipients never see each other)."""
+    return [
+        {"subject": "Alert", "to": [addr.strip()], "text": message_body, "label": "SMS_GATEWAY"}
+        for addr in recipient_gateways if addr and addr.strip()
+    ]
+
 def send_email_sms(message_body, recipient_gateways=None):
     if not _check_email_sms_enabled(): return False
     if not recipient_gateways: return False
-    
-    threading.Thread(
-        target=_send_via_resend, 
-        args=("Alert", message_body, recipient_gateways, None, None, "SMS_GATEWAY"),
-        daemon=True
-    ).start()
+
+    messages = gateway_messages(message_body, recipient_gateways)
+    if not messages: return False
+
+    threading.Thread(target=_send_batch_via_resend, args=(messages,), daemon=True).start()
     return True
 
-def send_alert(subject, message, error_obj=None, to_emails=None, attachment_name=None, attachment_data=None):
-    global _last_alert_time
-    if not attachment_name:
-        if (time.time() - _last_alert_time) < COOLDOWN_SECONDS: return False
-        _last_alert_time = time.time()
-        
+def send_email_batch(messages):
+    """
+    Queues several attachment-free emails as ONE Resend batch call.
+    See _send_batch_via_resend for the message format.
+    """
+    if not messages: return False
+    threading.Thread(target=_send_batch_via_resend, args=(list(messages),), daemon=True).start()
+    return True
+
+def is_email_sms_enabled():
+    """Public wrapper so callers can build gateway messages into a shared batch."""
+    return _check_email_sms_enabled()
+
+def resolve_email_recipients(to_emails=None):
+    """Cleans the given list, falling back to ADMIN_EMAIL when empty."""
     recipients = []
     if to_emails: recipients = [e.strip() for e in to_emails if e.strip()]
     if not recipients:
         default = os.getenv('ADMIN_EMAIL')
         if default: recipients = [default]
+    return recipients
+
+def send_alert(subject, message, error_obj=None, to_emails=None, attachment_name=None, attachment_data=None, throttle=True):
+    """
+    throttle=False skips the global cooldown; used by callers that already
+    rate-limit (e.g. the EmailAlertHandler queue in app.py).
+    """
+    global _last_alert_time
+    if throttle and not attachment_name:
+        if (time.time() - _last_alert_time) < COOLDOWN_SECONDS:
+            logger.warning(f"Alert suppressed by {COOLDOWN_SECONDS}s cooldown: '{subject}'")
+            return False
+        _last_alert_time = time.time()
+        
+    recipients = resolve_email_recipients(to_emails)
     if not recipients: return False
 
     threading.Thread(
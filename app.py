@@ -27,6 +27,7 @@ import requests
 
 import importlib
 import threading  
+from alert_throttle import ErrorAlertQueue, fingerprint_record
 
 class LazyModule:
     def __init__(self, module_name):
@@ -43,6 +44,19 @@ add_student = LazyModule('add_student')
 student_search = LazyModule('student_search')
 transaction_manager = LazyModule('transaction_manager')
 alerts = LazyModule('alerts')
+whatsapp_status = LazyModule('whatsapp_status')
+whatsapp_link = LazyModule('whatsapp_link')
+alert_delivery = LazyModule('alert_delivery')
+scheduler = LazyModule('scheduler')
+job_queue = LazyModule('job_queue')
+job_handlers = LazyModule('job_handlers')
+roster_index = LazyModule('roster_index')
+student_keys = LazyModule('student_keys')
+duplicate_audit = LazyModule('duplicate_audit')
+student_merge = LazyModule('student_merge')
+badges = LazyModule('badges')
+roster_sync = LazyModule('roster_sync')
+idempotency = LazyModule('idempotency')
 
 # Define wrappers for function imports
 def get_db_connection():
@@ -169,32 +183,81 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function    
 
+
+def idempotent(scope):
+    """
+    Honors an Idempotency-Key header (see idempotency.py): the first request
+    with a key runs and its response is stored; retries with the same key get
+    that response back (with Idempotent-Replayed: true) instead of running again.
+    Requests without the header are unaffected.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key', '').strip()
+            if not key:
+                return f(*args, **kwargs)
+            if len(key) > idempotency.MAX_KEY_LENGTH:
+                return jsonify({"success": False, "message": "Idempotency-Key is too long."}), 400
+
+            actor = session.get('username', 'system')
+            try:
+                state, stored = idempotency.claim(scope, actor, key, idempotency.request_hash(request.get_data()))
+            except Exception as e:
+                logger.error(f"Idempotency check failed for {scope}: {e}")
+                return jsonify({"success": False, "message": "Database connection failed"}), 500
+
+            if state == 'replay':
+                response = app.response_class(stored[1], status=stored[0], mimetype='application/json')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if state == 'in_progress':
+                return jsonify({"success": False, "message": "This request is still being processed."}), 409
+            if state == 'mismatch':
+                return jsonify({"success": False,
+                                "message": "Idempotency-Key was already used for a different request."}), 422
+
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except Exception:
+                # Release the key (as for a 5xx) so the client's retry runs instead of waiting out the claim
+                idempotency.finish(scope, actor, key, 500, None)
+                raise
+            idempotency.finish(scope, actor, key, response.status_code, response.get_data(as_text=True))
+            return response
+        return decorated_function
+    return decorator
+
     
 
 # ---- 4. Logging Setup ----
 
 class EmailAlertHandler(logging.Handler):
+    """
+    Forwards ERROR records to email without blocking the request.
+    Records are fingerprinted by traceback site and pushed onto a bounded
+    queue; a single worker applies per-fingerprint token buckets and sends a
+    periodic digest of whatever was suppressed (see alert_throttle.py).
+    """
+    def __init__(self):
+        super().__init__()
+        self.alert_queue = ErrorAlertQueue(send_fn=self._send)
+
+    @staticmethod
+    def _send(subject, message):
+        # The queue already rate-limits, so skip send_alert's global cooldown
+        alerts.send_alert(subject=subject, message=message, throttle=False)
+
     def emit(self, record):
         if record.levelno >= logging.ERROR:
             try:
                 # self.format(record) includes the traceback if logged via logger.exception()
                 msg = self.format(record)
-                
-                # Define a wrapper function to send email without blocking
-                def send_async():
-                    try:
-                        # Attempt to send the alert
-                        alerts.send_alert(
-                            subject=f"System Error: {record.levelname}", 
-                            message=msg
-                        )
-                    except Exception as e:
-                        logger.exception("Background Email Failed")
-                        
-                # Start the email task in a separate thread
-                thread = threading.Thread(target=send_async)
-                thread.start()
-
+                self.alert_queue.submit(
+                    fingerprint_record(record),
+                    f"System Error: {record.levelname}",
+                    msg
+                )
             except Exception:
                 self.handleError(record)
 
@@ -220,8 +283,26 @@ root_logger.addHandler(EmailAlertHandler())
 logger = logging.getLogger(__name__)
 
 
+# ---- 5. Background Monitors ----
+# The scheduler (daily report, WhatsApp probe, rollups, archival) runs in every
+# worker, but only the DB lease holder executes jobs.
+# In inline mode the job worker starts at boot too, so jobs left queued (or
+# stale) by a restart are picked up without waiting for the next enqueue.
+# Started off the import path so heavy modules stay lazily loaded.
+def _start_background_monitors():
+    scheduler.start()
+    if job_queue.JOB_WORKER_MODE == 'inline':
+        job_queue.start_inline_worker()
+
+
+if os.getenv('ENABLE_BACKGROUND_MONITORS', '1') == '1':
+    threading.Thread(target=_start_background_monitors, name="scheduler-bootstrap", daemon=True).start()
+
+
 
 # --- HELPER: Enable Cron Job via API ---
+WAKE_JOB_DEBOUNCE_SECONDS = 600
+
 def enable_wake_job():
     """
     Calls cron-job.org API to ENABLE the wake-up job.
@@ -232,6 +313,7 @@ def enable_wake_job():
     
     if not api_key or not job_id:
         logger.warning("Cron Job API keys missing. Skipping auto-enable.")
+        scheduler.finish('enable_wake_job', 'ok', "Cron Job API keys missing")
         return
 
     url = f"https://api.cron-job.org/jobs/{job_id}"
@@ -250,10 +332,13 @@ def enable_wake_job():
         response = requests.patch(url, json=payload, headers=headers, timeout=5)
         if response.status_code == 200:
             logger.info(f"Successfully ENABLED Cron Job {job_id}")
+            scheduler.finish('enable_wake_job', 'ok')
         else:
             logger.error(f"Failed to enable Cron Job: {response.text}")
+            scheduler.finish('enable_wake_job', 'failed', f"HTTP {response.status_code}")
     except Exception as e:
         logger.error(f"Cron Job API Error: {e}")
+        scheduler.finish('enable_wake_job', 'failed', str(e))
 
 
 
@@ -360,122 +445,16 @@ def cron_wake():
     
 @app.route('/api/cron/daily_report', methods=['GET'])
 def cron_daily_report():
+    """
+    Legacy external trigger. The in-app scheduler now sends the report; this
+    starts it early only if it has not run today, and returns at once.
+    """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # 1. Fetch Students (Same as before)
-        cur.execute("""
-            SELECT 
-                s.full_name, s.grade, s.classroom, s.total_points,
-                COALESCE(SUM(CASE WHEN al.timestamp >= NOW() - INTERVAL '24 HOURS' AND al.points > 0 THEN al.points ELSE 0 END), 0) as points_added_24h,
-                COALESCE(SUM(CASE WHEN al.timestamp >= NOW() - INTERVAL '24 HOURS' AND al.points < 0 THEN ABS(al.points) ELSE 0 END), 0) as points_redeemed_24h
-            FROM students s
-            LEFT JOIN activity_log al ON s.id = al.student_id
-            WHERE s.active = TRUE 
-            GROUP BY s.id
-            ORDER BY s.grade ASC, s.classroom ASC, s.full_name ASC
-        """)
-        student_rows = cur.fetchall()
-
-        # 2. Fetch Email Recipients
-        recipients = None
-        cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'DAILY_POINT_LOG'")
-        setting_row = cur.fetchone()
-        if setting_row:
-            val = setting_row['setting_value'] if isinstance(setting_row, dict) else setting_row[0]
-            if val and val.strip():
-                recipients = [e.strip() for e in val.split(',')]
-        
-        conn.close()
-
-        # 3. Generate CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Student Name', 'Grade', 'Classroom', 'Total Points', 'Points Added (Last 24h)', 'Points Redeemed (Last 24h)'])
-        
-        for row in student_rows:
-            is_dict = isinstance(row, dict)
-            r_name = row['full_name'] if is_dict else row[0]
-            r_gr = row['grade'] if is_dict else row[1]
-            r_cl = row['classroom'] if is_dict else row[2]
-            r_pts = row['total_points'] if is_dict else row[3]
-            r_added = row['points_added_24h'] if is_dict else row[4]
-            r_redeemed = row['points_redeemed_24h'] if is_dict else row[5]
-            writer.writerow([r_name, r_gr, r_cl, r_pts, r_added, r_redeemed])
-
-        # 4. Send Email
-        alerts.send_alert(
-            subject="Daily Student Balance Report",
-            message=f"Attached is the report for {datetime.datetime.now().strftime('%Y-%m-%d')}.",
-            to_emails=recipients,
-            attachment_name=f"Student_Balances_{datetime.datetime.now().strftime('%Y-%m-%d')}.csv",
-            attachment_data=output.getvalue().encode('utf-8')
-        )
-        
-        # --- SEND SMS REMINDER ---
-        # --- SEPARATE TRY BLOCK 1: TWILIO SMS ---
-        try:
-            conn_sms = get_db_connection()
-            if conn_sms:
-                cur_sms = conn_sms.cursor()
-                cur_sms.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'ALERT_RECIPIENT_NUMBERS'")
-                row = cur_sms.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    if val and val.strip():
-                        sms_list = [e.strip() for e in val.split(',')]
-                        alerts.send_sms("Daily Report generated. Please check your email.", sms_list)
-                conn_sms.close()
-        except Exception as sms_err:
-            logger.error(f"Daily TWILIO SMS Failed: {sms_err}") # Won't stop the next block
-
-        # --- SEPARATE TRY BLOCK 2: EMAIL-TO-SMS GATEWAY ---
-        try:
-            conn_gw = get_db_connection()
-            if conn_gw:
-                cur_gw = conn_gw.cursor()
-                cur_gw.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'EMAIL_TO_SMS_RECIPIENTS'")
-                row_gw = cur_gw.fetchone()
-                if row_gw:
-                    val_g = row_gw['setting_value'] if isinstance(row_gw, dict) else row_gw[0]
-                    if val_g and val_g.strip():
-                        gw_list = [e.strip() for e in val_g.split(',')]
-                        alerts.send_email_sms("Daily Report Sent.", gw_list)
-                conn_gw.close()
-        except Exception as gw_err:
-            logger.error(f"Daily GATEWAY SMS Failed: {gw_err}")
-
-        # --- SEPARATE TRY BLOCK 3: WHATSAPP ---
-        try:
-            conn_wa = get_db_connection()
-            if conn_wa:
-                cur_wa = conn_wa.cursor()
-                cur_wa.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'WHATSAPP_RECIPIENT_NUMBERS'")
-                row_wa = cur_wa.fetchone()
-                if row_wa:
-                    val_wa = row_wa['setting_value'] if isinstance(row_wa, dict) else row_wa[0]
-                    if val_wa and val_wa.strip():
-                        wa_list = [e.strip() for e in val_wa.split(',')]
-                        alerts.send_whatsapp(f"📊 Daily Report generated for {datetime.datetime.now().strftime('%Y-%m-%d')}. Please check your email for the CSV attachment.", wa_list)
-                conn_wa.close()
-        except Exception as wa_err:
-            logger.error(f"Daily WHATSAPP Failed: {wa_err}")
-
-        # 5. Log Audit Event
-        transaction_manager.log_audit_event(
-            action_type="DAILY_REPORT_RUN",
-            details=f"Daily report sent to: {recipients or 'Default Admin'}",
-            recorded_by="system_cron"
-        )
-
-        return jsonify({"success": True}), 200
-
+        started = scheduler.trigger('daily_report')
+        return jsonify({"success": True, "status": "started" if started else "already_ran_today"}), 202
     except Exception as e:
         logger.exception(f"Daily Student Point Log email Failed: {e}")
         return jsonify({"error": str(e)}), 500
-        
-            
 
 
 # --- Handle Language Switching ---
@@ -528,7 +507,14 @@ def login():
                 session['username'] = db_user
                 session['role'] = role.strip() if role else 'staff'
                 
-                threading.Thread(target=enable_wake_job).start() 
+                # Re-enable the external wake job at most every WAKE_JOB_DEBOUNCE_SECONDS
+                # (the claim stays 'running' until the PATCH reports back)
+                try:
+                    since = datetime.datetime.now() - datetime.timedelta(seconds=WAKE_JOB_DEBOUNCE_SECONDS)
+                    if scheduler.claim('enable_wake_job', since):
+                        threading.Thread(target=enable_wake_job, daemon=True).start()
+                except Exception:
+                    logger.exception("Wake job debounce failed")
                 
                 try:
                     transaction_manager.log_audit_event(
@@ -948,50 +934,59 @@ def whatsapp_setup():
         finally:
             conn.close()
 
-    # Check session status
-    session_status = alerts.check_whatsapp_session()
+    # Render from the cached probe result; never boot Chromium inside a request
+    session_status = whatsapp_status.get_cached_status()
+    if session_status.get('status') == 'unknown' and not session_status.get('refreshing'):
+        if whatsapp_status.refresh_async():
+            session_status['refreshing'] = True
 
     return render_template('whatsapp_setup.html', config=config, session_status=session_status)
 
 
+@app.route('/admin/whatsapp-setup/status', methods=['GET'])
+@login_required
+def whatsapp_session_status():
+    """Returns the cached WhatsApp session status (polled by the setup page)."""
+    if session.get('role') != 'sysadmin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(whatsapp_status.get_cached_status()), 200
+
+
+@app.route('/admin/whatsapp-setup/status/refresh', methods=['POST'])
+@login_required
+def whatsapp_refresh_status():
+    """Starts a background session probe; the client then polls /status."""
+    if session.get('role') != 'sysadmin':
+        return jsonify({'error': 'Access denied'}), 403
+    started = whatsapp_status.refresh_async()
+    return jsonify({'started': started, 'message': 'Refresh started' if started else 'A refresh is already running'}), 202
+
+
 @app.route('/admin/whatsapp-setup/generate-qr', methods=['POST'])
 @login_required
 def whatsapp_generate_qr():
-    """Generate QR code for WhatsApp linking - sysadmin only."""
-    import subprocess
-
+    """Starts a background QR linking job - sysadmin only. Poll whatsapp_qr_job for progress."""
     if session.get('role') != 'sysadmin':
         return jsonify({'error': 'Access denied'}), 403
 
-    whatsapp_service_dir = os.path.join(os.path.dirname(__file__), 'whatsapp_service')
-    generate_script = os.path.join(whatsapp_service_dir, 'generate_qr.js')
+    job, error = whatsapp_link.start_job(session.get('username', 'system'))
+    if error:
+        return jsonify({'error': error}), 500
 
-    if not os.path.exists(generate_script):
-        return jsonify({'error': 'WhatsApp service not installed'}), 500
+    return jsonify(job), 202
 
-    try:
-        result = subprocess.run(
-            ['node', generate_script, 'base64'],
-            capture_output=True,
-            text=True,
-            timeout=130,  # 2+ minutes for QR scan
-            cwd=whatsapp_service_dir,
-            env={**os.environ, 'DATABASE_URL': os.getenv('DATABASE_URL', '')}
-        )
 
-        # Parse output - could be QR data or connection status
-        if result.stdout.strip():
-            import json
-            data = json.loads(result.stdout.strip())
-            return jsonify(data)
-        else:
-            return jsonify({'error': result.stderr or 'Unknown error'}), 500
+@app.route('/admin/whatsapp-setup/qr-job/<job_id>', methods=['GET'])
+@login_required
+def whatsapp_qr_job(job_id):
+    """Returns the status (and QR image once ready) of a linking job - sysadmin only."""
+    if session.get('role') != 'sysadmin':
+        return jsonify({'error': 'Access denied'}), 403
 
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': 'QR generation timed out. Please try again.'}), 504
-    except Exception as e:
-        logger.error(f"QR generation error: {e}")
-        return jsonify({'error': str(e)}), 500
+    job = whatsapp_link.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
 
 
 @app.route('/admin/whatsapp-setup/save-config', methods=['POST'])
@@ -1178,6 +1173,7 @@ def api_update_student(student_id):
             bool(data.get('active', True)), # Defaults to True if missing
             student_id
         ))
+        student_keys.refresh_student(cur, student_id)
 
         # Log the change
         transaction_manager.log_audit_event(
@@ -1187,6 +1183,7 @@ def api_update_student(student_id):
         )
 
         conn.commit()
+        roster_index.mark_stale()
         return jsonify({"success": True, "message": "Student updated successfully!"}), 200
 
     except Exception as e:
@@ -1202,16 +1199,19 @@ def api_update_student(student_id):
 @login_required
 def api_check_duplicates():
     data = request.get_json() or {}
-    name = data.get('name', '')
-    
-    results = student_search.find_students(name)
+    name = (data.get('name') or '').strip()
+    try:
+        exclude_id = int(data['exclude_id']) if data.get('exclude_id') not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "exclude_id must be an integer."}), 400
     
-    matches = []
-    for s in results:
-        is_dict = isinstance(s, dict)
-        s_name = s['full_name'] if is_dict else s[1]
-        if name.lower() in s_name.lower():
-            matches.append(s)
+    # Indexed candidate lookup on phonetic name / phone / email keys, then scoring
+    matches = student_keys.check_duplicates(
+        name,
+        phone=(data.get('phone') or '').strip(),
+        email=(data.get('email') or '').strip(),
+        exclude_id=exclude_id
+    )
     
     return jsonify({"matches": matches}), 200
 
@@ -1245,12 +1245,16 @@ def api_students_search():
         return jsonify({"success": True, "students": []}), 200 
 
     try:
-        # Pass the new show_all flag to the search logic
-        students = student_search.find_students(
-            search_term, 
-            include_inactive=include_inactive,
-            show_all=show_all
-        )
+        # Served from this worker's in-memory index; SQL search is the fallback
+        min_points = request.args.get('min_points', type=int)
+        students = roster_index.search(search_term, include_inactive=include_inactive, show_all=show_all, min_points=min_points)
+        if students is None:
+            students = student_search.find_students(
+                search_term, 
+                include_inactive=include_inactive,
+                show_all=show_all,
+                min_points=min_points
+            )
         return jsonify({"success": True, "students": students}), 200 
     except Exception as e:
         # Using app.logger if logger isn't globally defined in this scope, 
@@ -1261,14 +1265,116 @@ def api_students_search():
             current_app.logger.error(f"Search error: {e}")
             
         return jsonify({"success": False, "message": str(e)}), 500
-        
-        
+
+
+@app.route('/api/students/directory', methods=['GET'])
+@login_required
+def api_students_directory():
+    """
+    Keyset-paginated directory ordered by (full_name, id).
+    Filters: grade, classroom, include_inactive, min_points, max_points.
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
+    import json
+    import base64
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode()).decode()))
+            if len(after) != 2:
+                raise ValueError
+        except Exception:
+            return jsonify({"success": False, "message": "Invalid cursor."}), 400
+
+    page = student_search.list_directory(
+        after=after,
+        limit=max(1, min(request.args.get('limit', 100, type=int) or 100, 500)),
+        grade=request.args.get('grade') or None,
+        classroom=request.args.get('classroom') or None,
+        include_inactive=request.args.get('include_inactive') == 'true',
+        min_points=request.args.get('min_points', type=int),
+        max_points=request.args.get('max_points', type=int)
+    )
+    if page is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+
+    next_cursor = None
+    if page['next']:
+        next_cursor = base64.urlsafe_b64encode(json.dumps(list(page['next'])).encode()).decode()
+    return jsonify({
+        "success": True,
+        "students": page['students'],
+        "next_cursor": next_cursor,
+        "total_estimate": page['total_estimate']
+    }), 200
+
+
+@app.route('/api/sync/roster', methods=['GET'])
+@login_required
+def api_sync_roster():
+    """
+    Delta sync for offline-capable tablets: students, activities and prizes
+    changed since the watermark ?since=<version>, plus deleted ids (see
+    roster_sync.py). While has_more is true, repeat with ?cursor=<next_cursor>
+    (same since); keep the final version for the next sync.
+    ?format=ndjson streams one record per line (first line is the header with
+    version / has_more / next_cursor); otherwise compact JSON. Gzipped when
+    the client accepts it.
+    """
+    import json
+    import gzip
+    import base64
+
+    since = request.args.get('since', 0, type=int)
+    if since < 0:
+        return jsonify({"success": False, "message": "Invalid since version."}), 400
+
+    page = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            page = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if not isinstance(page.get('xmin'), int) or not isinstance(page.get('after'), dict):
+                raise ValueError
+        except Exception:
+            return jsonify({"success": False, "message": "Invalid cursor."}), 400
+
+    delta = roster_sync.changes(since, page)
+    if delta is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+
+    next_page = delta.pop('page')
+    delta['next_cursor'] = base64.urlsafe_b64encode(json.dumps(next_page).encode()).decode() if next_page else None
+
+    dumps = lambda obj: json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=str)
+    if request.args.get('format') == 'ndjson':
+        lines = [dumps({"type": "header", "version": delta['version'], "has_more": delta['has_more'],
+                        "next_cursor": delta['next_cursor']})]
+        for key, kind in (('students', 'student'), ('activities', 'activity'), ('prizes', 'prize')):
+            lines.extend(dumps(dict(row, type=kind)) for row in delta[key])
+        lines.extend(dumps(dict(row, type='deleted')) for row in delta['deleted'])
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        mimetype = 'application/x-ndjson'
+    else:
+        body = dumps(dict(delta, success=True)).encode('utf-8')
+        mimetype = 'application/json'
+
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-store'
+    if len(body) > 512 and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 # ---- Transaction API  ----
 
 @app.route('/api/transaction/record', methods=['POST'])
 @login_required
+@idempotent('transaction_record')
 def api_record_transaction():
     data = request.get_json(silent=True)
     if not data: 
@@ -1293,8 +1399,9 @@ def api_record_transaction():
         description=data.get('description', ''),
         recorded_by=staff_identity,
         # --- NEW: Pass to DB ---
-        activity_id=activity_id 
+        activity_id=activity_id,
         # -----------------------
+        client_uuid=request.headers.get('Idempotency-Key')
     )
     
     if success:
@@ -1303,6 +1410,100 @@ def api_record_transaction():
         return jsonify({"success": False, "message": msg}), 500
 
 
+@app.route('/api/transaction/batch', methods=['POST'])
+@login_required
+def api_record_transaction_batch():
+    """
+    Uploads a queue of awards recorded while offline:
+        {"items": [{"client_uuid", "student_id", "points", "activity_id",
+                    "activity_name", "description", "recorded_at"}, ...]}
+    Safe to resend: items whose client_uuid is already recorded come back as
+    'duplicate'. Returns one result per item, in order.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "items must be a non-empty list."}), 400
+    if len(items) > transaction_manager.BATCH_LIMIT:
+        return jsonify({"success": False,
+                        "message": f"At most {transaction_manager.BATCH_LIMIT} items per upload."}), 413
+
+    results, error = transaction_manager.add_points_batch(items, recorded_by=session.get('username', 'system'))
+    if error:
+        return jsonify({"success": False, "message": error}), 500
+
+    summary = {}
+    for r in results:
+        summary[r['status']] = summary.get(r['status'], 0) + 1
+    return jsonify({"success": True, "results": results, "summary": summary}), 200
+
+
+@app.route('/kiosk')
+@login_required
+def kiosk_page():
+    return render_template('kiosk.html')
+
+
+@app.route('/api/kiosk/award', methods=['POST'])
+@login_required
+@idempotent('kiosk_award')
+def api_kiosk_award():
+    """
+    One scan = one award: resolves the badge code and records the activity's default points.
+    A repeat scan of the same badge for the same activity within
+    badges.SCAN_DEBOUNCE_SECONDS is refused with 409 (double scans, bounced reads).
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('badge_code') or not data.get('activity_id'):
+        return jsonify({"success": False, "message": "badge_code and activity_id are required."}), 400
+    try:
+        activity_id = int(data['activity_id'])
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "activity_id must be an integer."}), 400
+
+    try:
+        student = badges.find_student(data['badge_code'])
+        if not student:
+            return jsonify({"success": False, "message": "Unknown badge."}), 404
+        if not student['active']:
+            return jsonify({"success": False, "message": f"{student['full_name']} is inactive."}), 409
+
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id, name, default_points FROM activities WHERE id = %s AND active = TRUE", (activity_id,))
+            activity = cur.fetchone()
+        finally:
+            conn.close()
+        if not activity:
+            return jsonify({"success": False, "message": "Activity not found."}), 404
+
+        points = activity['default_points'] or 0
+        success, msg = transaction_manager.add_points(
+            student_id=student['id'],
+            points=points,
+            activity_type=activity['name'],
+            description="Kiosk scan",
+            recorded_by=session.get('username', 'kiosk'),
+            activity_id=activity['id'],
+            debounce_seconds=badges.SCAN_DEBOUNCE_SECONDS
+        )
+        if not success:
+            status = 409 if msg == transaction_manager.RECENT_AWARD_MESSAGE else 500
+            return jsonify({"success": False, "message": msg}), status
+        return jsonify({
+            "success": True,
+            "message": msg,
+            "student": {"id": student['id'], "full_name": student['full_name'], "classroom": student['classroom']},
+            "points": points,
+            # Re-read after the award committed (the badge lookup saw the old balance)
+            "total_points": transaction_manager.get_student_balance(student['id'])
+        }), 200
+    except Exception as e:
+        logger.exception(f"Kiosk award error: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
 @app.route('/api/student/<int:student_id>/history', methods=['GET'])
 @login_required
 def api_student_history(student_id):
@@ -1579,44 +1780,72 @@ def download_logs():
 @login_required
 @admin_required
 def clear_logs():
+    """Queues a log rotation job (archive + truncate); the archive is downloadable from the job."""
     staff_identity = session.get('username', 'system')
-    backup_file = f"{LOG_PATH}.bak.{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-    
     try:
-        # --- LOG AUDIT EVENT (DB) ---
-        # We log this to the database because the file log is about to be rotated/cleared
-        transaction_manager.log_audit_event(
-            action_type="CLEAR_LOGS",
-            details=f"System logs manually cleared/rotated. Archived to {os.path.basename(backup_file)}",
-            recorded_by=staff_identity
-        )
+        job = job_queue.enqueue('rotate_logs', {}, created_by=staff_identity)
+        if not job:
+            return jsonify({'success': False, 'message': 'Database connection failed'}), 500
+        return jsonify({'success': True, 'message': 'Log rotation started.', 'job': job}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
 
-        root_logger = logging.getLogger()
-        file_handler_found = None
-        for h in root_logger.handlers:
-            if isinstance(h, RotatingFileHandler):
-                file_handler_found = h
-                break
-        
-        if file_handler_found:
-            file_handler_found.close()
-            root_logger.removeHandler(file_handler_found)
 
-        if os.path.exists(LOG_PATH):
-            os.rename(LOG_PATH, backup_file)
-        
-        # Re-initialize
-        new_handler = RotatingFileHandler(LOG_PATH, maxBytes=500000, backupCount=3)
-        new_handler.setLevel(logging.INFO)
-        new_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
-        root_logger.addHandler(new_handler)
-        
-        root_logger.info(f"Log file rotated. Archived as {os.path.basename(backup_file)}")
-        return jsonify({'success': True, 'message': 'Logs cleared successfully.'})
+# ---- Background Jobs API ----
+
+def _can_view_job(job):
+    return job['created_by'] == session.get('username') or session.get('role') in ['admin', 'sysadmin']
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def api_create_job():
+    data = request.get_json() or {}
+    job_type = data.get('type')
+    allowed_roles = job_handlers.JOB_ROLES.get(job_type)
+
+    if not allowed_roles:
+        return jsonify({"success": False, "message": f"Unknown job type: {job_type}"}), 400
+    if session.get('role', 'staff') not in allowed_roles:
+        return jsonify({"success": False, "message": "Access Denied"}), 403
+
+    job = job_queue.enqueue(job_type, data.get('params') or {}, created_by=session.get('username', 'system'))
+    if not job:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+    return jsonify({"success": True, "job": job}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def api_list_jobs():
+    limit = max(1, min(request.args.get('limit', 20, type=int) or 20, 100))
+    created_by = None if session.get('role') in ['admin', 'sysadmin'] and request.args.get('all') else session.get('username')
+    jobs = job_queue.list_jobs(created_by=created_by, limit=limit)
+    if jobs is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+    return jsonify({"success": True, "jobs": jobs}), 200
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def api_job_status(job_id):
+    job = job_queue.get_job(job_id)
+    if not job or not _can_view_job(job):
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    job.pop('result_path', None)
+    job['download_url'] = url_for('api_job_download', job_id=job_id) if job['status'] == 'done' and job['result_name'] else None
+    return jsonify({"success": True, "job": job}), 200
+
+@app.route('/api/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+def api_job_download(job_id):
+    job = job_queue.get_job(job_id)
+    if not job or not _can_view_job(job) or job['status'] != 'done' or not job.get('result_path'):
+        abort(404)
+
+    # Only serve files from the artifact directory
+    path = os.path.realpath(job['result_path'])
+    if not path.startswith(os.path.realpath(job_queue.JOB_ARTIFACT_DIR) + os.sep) or not os.path.exists(path):
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=job['result_name'])
 
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)})        
-        
 
 # ---- Prize Management API ----
 
@@ -1704,6 +1933,7 @@ def api_list_prizes():
 
 @app.route('/api/prizes/redeem', methods=['POST'])
 @login_required
+@idempotent('prizes_redeem')
 def api_redeem_prize():
     data = request.get_json() or {}
     student_id = data.get('student_id')
@@ -1896,6 +2126,128 @@ def download_audit_logs_csv():
     finally:
         conn.close()
     
+# ---- Alert Delivery Metrics ----
+
+@app.route('/admin/alert-deliveries')
+@login_required
+@admin_required
+def alert_deliveries_page():
+    return render_template('alert_deliveries.html')
+
+@app.route('/api/admin/alert-metrics')
+@login_required
+@admin_required
+def api_alert_metrics():
+    """
+    Success rate / p50 / p95 latency per provider and channel, bucketed over a window.
+    The window is capped at the raw-row retention (ALERT_DELIVERY_RETENTION_DAYS):
+    older rows are rolled up into daily totals by the scheduler and no longer counted.
+    """
+    hours = request.args.get('hours', 24, type=int)
+    bucket = request.args.get('bucket', 'hour')
+    provider = request.args.get('provider') or None
+
+    if bucket not in alert_delivery.BUCKETS:
+        return jsonify({"success": False, "message": f"bucket must be one of {', '.join(alert_delivery.BUCKETS)}"}), 400
+    hours = max(1, min(hours or 24, 24 * scheduler.ALERT_DELIVERY_RETENTION_DAYS))
+
+    metrics = alert_delivery.summary(hours=hours, bucket=bucket, provider=provider)
+    if metrics is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+    return jsonify({"success": True, "hours": hours, "bucket": bucket, **metrics}), 200
+
+@app.route('/api/admin/alert-dead-letters')
+@login_required
+@admin_required
+def api_alert_dead_letters():
+    """Most recent alerts that failed after every retry."""
+    limit = max(1, min(request.args.get('limit', 100, type=int) or 100, 500))
+    hours = request.args.get('hours', type=int)
+    channel = request.args.get('channel') or None
+
+    rows = alert_delivery.dead_letters(limit=limit, hours=hours, channel=channel)
+    if rows is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+    return jsonify({"success": True, "dead_letters": rows}), 200
+
+
+# ---- Duplicate Review ----
+
+@app.route('/admin/duplicates')
+@login_required
+@admin_required
+def duplicates_page():
+    return render_template('duplicates.html')
+
+@app.route('/api/admin/duplicates')
+@login_required
+@admin_required
+def api_list_duplicates():
+    """Pairs found by the last duplicate audit (run it via POST /api/jobs type=duplicate_audit)."""
+    status = request.args.get('status', 'open')
+    if status not in duplicate_audit.STATUSES:
+        return jsonify({"success": False, "message": f"status must be one of {', '.join(duplicate_audit.STATUSES)}"}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int) or 100, 500))
+    offset = max(0, request.args.get('offset', 0, type=int) or 0)
+
+    pairs = duplicate_audit.list_pairs(status=status, limit=limit, offset=offset)
+    if pairs is None:
+        return jsonify({"success": False, "message": "Database connection failed"}), 500
+    return jsonify({"success": True, "pairs": pairs}), 200
+
+@app.route('/api/admin/duplicates/status', methods=['POST'])
+@login_required
+@admin_required
+def api_set_duplicate_status():
+    data = request.get_json() or {}
+    try:
+        student_a, student_b = int(data.get('student_a')), int(data.get('student_b'))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "student_a and student_b are required."}), 400
+    status = data.get('status')
+    if status not in duplicate_audit.STATUSES:
+        return jsonify({"success": False, "message": f"status must be one of {', '.join(duplicate_audit.STATUSES)}"}), 400
+
+    staff = session.get('username', 'Unknown')
+    try:
+        if not duplicate_audit.set_status(student_a, student_b, status, staff):
+            return jsonify({"success": False, "message": "Pair not found."}), 404
+        transaction_manager.log_audit_event(
+            action_type="DUPLICATE_REVIEW",
+            details=f"Duplicate pair {student_a}/{student_b} marked {status}",
+            recorded_by=staff
+        )
+        return jsonify({"success": True}), 200
+    except Exception as e:
+        logger.exception(f"Duplicate status update failed: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/admin/students/merge', methods=['POST'])
+@login_required
+@admin_required
+def api_merge_students():
+    """Merges loser_id into winner_id (history, balance, deactivation) in one transaction."""
+    data = request.get_json() or {}
+    try:
+        winner_id, loser_id = int(data.get('winner_id')), int(data.get('loser_id'))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "winner_id and loser_id are required."}), 400
+
+    try:
+        result = student_merge.merge_students(
+            winner_id, loser_id,
+            justification=data.get('justification', ''),
+            recorded_by=session.get('username', 'Unknown')
+        )
+        return jsonify({"success": True, **result}), 200
+    except student_merge.MergeError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.exception(f"Merge {loser_id} -> {winner_id} failed: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
 # ---- 11. Reporting (View & CSV) ----
 
 # 1. Redemption Report
@@ -0,0 +1,83 @@
+"""
+badges.py - Student badge codes (scan-to-award kiosk)
+Each student gets a short, unique badge_code printed as a QR code on their
+badge (see make_badges.py). The kiosk endpoint resolves a scanned code to
+the student through the unique index on students.badge_code.
+
+Codes are 8 Crockford base32 characters (no I, L, O, U), so codes typed by
+hand survive the usual confusions: normalize_code maps O->0 and I/L->1.
+"""
+import secrets
+import logging
+from psycopg2.extras import execute_values
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 8
+SCAN_DEBOUNCE_SECONDS = 10   # A second scan of the same badge for the same activity within this is refused
+
+
+def new_code():
+    return ''.join(secrets.choice(ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def normalize_code(raw):
+    """Scanner/keyboard input -> canonical code (None if it cannot be a badge code)."""
+    code = (raw or '').strip().upper().replace('-', '').replace(' ', '')
+    code = code.translate(str.maketrans({'O': '0', 'I': '1', 'L': '1'}))
+    if len(code) != CODE_LENGTH or any(c not in ALPHABET for c in code):
+        return None
+    return code
+
+
+def assign_missing(cur, student_ids=None):
+    """
+    Gives every student without a badge_code a fresh one (optionally only
+    the given ids). One set-based UPDATE; a rare collision with an existing
+    code just gets a new draw. Returns the number of codes assigned.
+    Each round re-reads which students still lack a code, so rows another
+    writer filled in meanwhile drop out instead of being retried forever.
+    """
+    assigned = 0
+    while True:
+        if student_ids:
+            cur.execute("SELECT id FROM students WHERE badge_code IS NULL AND id = ANY(%s)", (list(student_ids),))
+        else:
+            cur.execute("SELECT id FROM students WHERE badge_code IS NULL")
+        ids = [r['id'] if isinstance(r, dict) else r[0] for r in cur.fetchall()]
+        if not ids:
+            break
+        codes = {}
+        while len(codes) < len(ids):
+            codes[new_code()] = None
+        rows = list(zip(ids, codes))
+        updated = execute_values(cur, """
+            UPDATE students s SET badge_code = v.code
+            FROM (VALUES %s) AS v(id, code)
+            WHERE s.id = v.id AND s.badge_code IS NULL
+              AND NOT EXISTS (SELECT 1 FROM students o WHERE o.badge_code = v.code)
+            RETURNING s.id
+        """, rows, page_size=5000, fetch=True)
+        assigned += len(updated)
+    return assigned
+
+
+def find_student(code):
+    """Student (id, full_name, classroom, total_points, active) for a scanned code, or None."""
+    code = normalize_code(code)
+    if not code:
+        return None
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, full_name, classroom, total_points, active
+            FROM students WHERE badge_code = %s
+        """, (code,))
+        return cur.fetchone()
+    finally:
+        conn.close()
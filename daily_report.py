@@ -0,0 +1,125 @@
+"""
+daily_report.py - Daily Student Balance Report
+Builds the balance CSV and notifies every configured channel.
+Runs in the background via scheduler.py (daily job, also triggered by the
+legacy cron route), so no HTTP request ever waits on the report or the senders.
+"""
+import io
+import csv
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from db_utils import get_db_connection
+import alerts
+import transaction_manager
+
+logger = logging.getLogger(__name__)
+
+REPORT_SETTING_KEYS = (
+    'DAILY_POINT_LOG', 'ALERT_RECIPIENT_NUMBERS',
+    'EMAIL_TO_SMS_RECIPIENTS', 'WHATSAPP_RECIPIENT_NUMBERS',
+)
+
+
+def _split_setting(val):
+    """Comma-separated setting -> list (None when blank)."""
+    if val and val.strip():
+        return [e.strip() for e in val.split(',') if e.strip()]
+    return None
+
+
+def _fetch_report_data():
+    """Reads the balances and every report setting over ONE connection."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                s.full_name, s.grade, s.classroom, s.total_points,
+                COALESCE(SUM(CASE WHEN al.timestamp >= NOW() - INTERVAL '24 HOURS' AND al.points > 0 THEN al.points ELSE 0 END), 0) as points_added_24h,
+                COALESCE(SUM(CASE WHEN al.timestamp >= NOW() - INTERVAL '24 HOURS' AND al.points < 0 THEN ABS(al.points) ELSE 0 END), 0) as points_redeemed_24h
+            FROM students s
+            LEFT JOIN activity_log al ON s.id = al.student_id
+            WHERE s.active = TRUE
+            GROUP BY s.id
+            ORDER BY s.grade ASC, s.classroom ASC, s.full_name ASC
+        """)
+        student_rows = cur.fetchall()
+
+        cur.execute("""
+            SELECT setting_key, setting_value FROM system_settings
+            WHERE setting_key IN %s
+        """, (REPORT_SETTING_KEYS,))
+        settings = {}
+        for row in cur.fetchall():
+            key = row['setting_key'] if isinstance(row, dict) else row[0]
+            settings[key] = row['setting_value'] if isinstance(row, dict) else row[1]
+        return student_rows, settings
+    finally:
+        conn.close()
+
+
+def build_csv(student_rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Student Name', 'Grade', 'Classroom', 'Total Points', 'Points Added (Last 24h)', 'Points Redeemed (Last 24h)'])
+
+    for row in student_rows:
+        is_dict = isinstance(row, dict)
+        writer.writerow([
+            row['full_name'] if is_dict else row[0],
+            row['grade'] if is_dict else row[1],
+            row['classroom'] if is_dict else row[2],
+            row['total_points'] if is_dict else row[3],
+            row['points_added_24h'] if is_dict else row[4],
+            row['points_redeemed_24h'] if is_dict else row[5]
+        ])
+    return output.getvalue().encode('utf-8')
+
+
+def run(recorded_by="system_cron"):
+    """Generates and sends the report synchronously. Returns the email recipients."""
+    student_rows, settings = _fetch_report_data()
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    csv_data = build_csv(student_rows)
+    recipients = _split_setting(settings.get('DAILY_POINT_LOG'))
+
+    channels = {
+        'EMAIL': lambda: alerts.send_alert(
+            subject="Daily Student Balance Report",
+            message=f"Attached is the report for {today}.",
+            to_emails=recipients,
+            attachment_name=f"Student_Balances_{today}.csv",
+            attachment_data=csv_data
+        ),
+    }
+    sms_list = _split_setting(settings.get('ALERT_RECIPIENT_NUMBERS'))
+    if sms_list:
+        channels['TWILIO SMS'] = lambda: alerts.send_sms("Daily Report generated. Please check your email.", sms_list)
+    gw_list = _split_setting(settings.get('EMAIL_TO_SMS_RECIPIENTS'))
+    if gw_list:
+        channels['GATEWAY SMS'] = lambda: alerts.send_email_sms("Daily Report Sent.", gw_list)
+    wa_list = _split_setting(settings.get('WHATSAPP_RECIPIENT_NUMBERS'))
+    if wa_list:
+        channels['WHATSAPP'] = lambda: alerts.send_whatsapp(
+            f"📊 Daily Report generated for {today}. Please check your email for the CSV attachment.", wa_list
+        )
+
+    # Each channel checks its own enable flag, so dispatch them side by side.
+    # A failing channel is logged and never stops the others.
+    with ThreadPoolExecutor(max_workers=len(channels), thread_name_prefix='daily-report') as pool:
+        futures = {name: pool.submit(fn) for name, fn in channels.items()}
+    for name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"Daily {name} Failed: {e}")
+
+    transaction_manager.log_audit_event(
+        action_type="DAILY_REPORT_RUN",
+        details=f"Daily report sent to: {recipients or 'Default Admin'}",
+        recorded_by=recorded_by
+    )
+    return recipients
@@ -22,6 +22,20 @@ def get_db_connection():
         logger.error(f"DB Connection failed: {e}")
         return None
 
+def estimate_rows(cur, sql, params=()):
+    """Planner row estimate for a query (cheap; no scan). Returns 0 if unavailable."""
+    try:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        row = cur.fetchone()
+        plan = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+        if isinstance(plan, str):
+            import json
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f"Row estimate failed: {e}")
+        return 0
+
 def init_db():
     conn = get_db_connection()
     if not conn:
@@ -117,8 +131,275 @@ def init_db():
         """)
         cur.execute("INSERT INTO system_settings (setting_key, setting_value) VALUES ('POINT_ALERT_THRESHOLD', '500') ON CONFLICT DO NOTHING;")
 
+        # 7. Users (Staff Logins)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL,
+                role TEXT DEFAULT 'staff',
+                active BOOLEAN DEFAULT TRUE
+            );
+        """)
+
+        # 8. WhatsApp QR Linking Jobs (polled by the setup page)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS whatsapp_link_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'starting',
+                qr_data TEXT,
+                phone TEXT,
+                error TEXT,
+                started_by TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # 9. Alert Delivery (one row per alert message; dead letters = status 'failed')
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alert_delivery (
+                id BIGSERIAL PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                channel TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                recipient TEXT,
+                subject TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER DEFAULT 1,
+                latency_ms INTEGER,
+                error TEXT,
+                provider_message_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_alert_delivery_created ON alert_delivery (created_at);
+            CREATE INDEX IF NOT EXISTS idx_alert_delivery_provider_created ON alert_delivery (provider, created_at);
+            CREATE INDEX IF NOT EXISTS idx_alert_delivery_failed ON alert_delivery (created_at) WHERE status = 'failed';
+        """)
+
+        # 10. Scheduler (leader lease + last run per job) and retention targets
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_lease (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS scheduler_runs (
+                job_name TEXT PRIMARY KEY,
+                last_run_at TIMESTAMP,
+                last_status TEXT,
+                last_error TEXT,
+                last_duration_ms INTEGER
+            );
+            ALTER TABLE scheduler_runs ADD COLUMN IF NOT EXISTS failures INTEGER NOT NULL DEFAULT 0;
+            CREATE TABLE IF NOT EXISTS alert_delivery_daily (
+                day DATE NOT NULL,
+                provider TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                total INTEGER,
+                sent INTEGER,
+                failed INTEGER,
+                skipped INTEGER,
+                avg_attempts NUMERIC,
+                p95_ms DOUBLE PRECISION,
+                PRIMARY KEY (day, provider, channel)
+            );
+            CREATE TABLE IF NOT EXISTS audit_log_archive (LIKE audit_log);
+        """)
+
+        # 11. Background Job Queue (see job_queue.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS job_queue (
+                id BIGSERIAL PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                payload JSONB DEFAULT '{}'::JSONB,
+                status TEXT NOT NULL DEFAULT 'queued',
+                progress INTEGER DEFAULT 0,
+                message TEXT,
+                result_path TEXT,
+                result_name TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                created_by TEXT,
+                locked_by TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                heartbeat_at TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_queue_queued ON job_queue (id) WHERE status = 'queued';
+            CREATE INDEX IF NOT EXISTS idx_job_queue_running ON job_queue (heartbeat_at) WHERE status = 'running';
+            CREATE INDEX IF NOT EXISTS idx_job_queue_created_by ON job_queue (created_by, id);
+        """)
+
+        # 12. Student change version (lets roster_index.py sync only changed rows)
+        # change_version orders writes; change_xid is the writing transaction, so
+        # readers can tell which changes are safely committed (see roster_sync.py).
+        cur.execute("""
+            CREATE SEQUENCE IF NOT EXISTS students_change_seq;
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS change_version BIGINT;
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS change_xid BIGINT;
+            UPDATE students SET change_version = nextval('students_change_seq') WHERE change_version IS NULL;
+
+            CREATE OR REPLACE FUNCTION students_bump_change_version() RETURNS TRIGGER AS $$
+            BEGIN
+                NEW.change_version := nextval('students_change_seq');
+                NEW.change_xid := txid_current();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_students_change_version ON students;
+            CREATE TRIGGER trg_students_change_version
+                BEFORE INSERT OR UPDATE ON students
+                FOR EACH ROW EXECUTE FUNCTION students_bump_change_version();
+
+            CREATE INDEX IF NOT EXISTS idx_students_change_version ON students (change_version);
+            CREATE INDEX IF NOT EXISTS idx_students_change_xid ON students (change_xid);
+        """)
+
+        # 13. Student duplicate-detection keys (see student_keys.py; backfilled below when empty)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS student_match_keys (
+                student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                key_type TEXT NOT NULL,
+                key_value TEXT NOT NULL,
+                PRIMARY KEY (key_type, key_value, student_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_student_match_keys_student ON student_match_keys (student_id);
+        """)
+
+        # 14. Duplicate audit results (see duplicate_audit.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS student_duplicates (
+                student_a INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                student_b INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                score NUMERIC(4, 2) NOT NULL,
+                reasons TEXT,
+                status TEXT NOT NULL DEFAULT 'open',
+                found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                reviewed_by TEXT,
+                reviewed_at TIMESTAMP,
+                PRIMARY KEY (student_a, student_b),
+                CHECK (student_a < student_b)
+            );
+            CREATE INDEX IF NOT EXISTS idx_student_duplicates_status ON student_duplicates (status, score DESC);
+        """)
+
+        # 15. Student merges (see student_merge.py)
+        cur.execute("""
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS merged_into INTEGER REFERENCES students(id);
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS merged_at TIMESTAMP;
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS merge_justification TEXT;
+            CREATE INDEX IF NOT EXISTS idx_activity_log_student ON activity_log (student_id);
+        """)
+
+        # 16. Student directory keyset pagination (ORDER BY full_name, id)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_students_name_id ON students (full_name, id);")
+
+        # 17. Student badge codes for the scan-to-award kiosk (see badges.py / make_badges.py)
+        cur.execute("""
+            ALTER TABLE students ADD COLUMN IF NOT EXISTS badge_code TEXT;
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_students_badge_code ON students (badge_code);
+        """)
+
+        # 18. Roster delta sync (see roster_sync.py)
+        # Activities and prizes share students_change_seq and the change_xid
+        # stamp with students; hard deletes leave a tombstone.
+        cur.execute("""
+            ALTER TABLE activities ADD COLUMN IF NOT EXISTS change_version BIGINT;
+            ALTER TABLE prize_inventory ADD COLUMN IF NOT EXISTS change_version BIGINT;
+            ALTER TABLE activities ADD COLUMN IF NOT EXISTS change_xid BIGINT;
+            ALTER TABLE prize_inventory ADD COLUMN IF NOT EXISTS change_xid BIGINT;
+            UPDATE activities SET change_version = nextval('students_change_seq') WHERE change_version IS NULL;
+            UPDATE prize_inventory SET change_version = nextval('students_change_seq') WHERE change_version IS NULL;
+
+            DROP TRIGGER IF EXISTS trg_activities_change_version ON activities;
+            CREATE TRIGGER trg_activities_change_version
+                BEFORE INSERT OR UPDATE ON activities
+                FOR EACH ROW EXECUTE FUNCTION students_bump_change_version();
+
+            DROP TRIGGER IF EXISTS trg_prizes_change_version ON prize_inventory;
+            CREATE TRIGGER trg_prizes_change_version
+                BEFORE INSERT OR UPDATE ON prize_inventory
+                FOR EACH ROW EXECUTE FUNCTION students_bump_change_version();
+
+            -- Rows written before change_xid existed: the trigger stamps them now
+            UPDATE students SET change_xid = 0 WHERE change_xid IS NULL;
+            UPDATE activities SET change_xid = 0 WHERE change_xid IS NULL;
+            UPDATE prize_inventory SET change_xid = 0 WHERE change_xid IS NULL;
+
+            CREATE INDEX IF NOT EXISTS idx_activities_change_version ON activities (change_version);
+            CREATE INDEX IF NOT EXISTS idx_prizes_change_version ON prize_inventory (change_version);
+            CREATE INDEX IF NOT EXISTS idx_activities_change_xid ON activities (change_xid);
+            CREATE INDEX IF NOT EXISTS idx_prizes_change_xid ON prize_inventory (change_xid);
+
+            CREATE TABLE IF NOT EXISTS sync_tombstones (
+                entity TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                change_version BIGINT NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (entity, entity_id)
+            );
+            ALTER TABLE sync_tombstones ADD COLUMN IF NOT EXISTS change_xid BIGINT NOT NULL DEFAULT 0;
+            CREATE INDEX IF NOT EXISTS idx_sync_tombstones_version ON sync_tombstones (change_version);
+            CREATE INDEX IF NOT EXISTS idx_sync_tombstones_xid ON sync_tombstones (change_xid);
+
+            CREATE OR REPLACE FUNCTION record_sync_tombstone() RETURNS TRIGGER AS $$
+            BEGIN
+                INSERT INTO sync_tombstones (entity, entity_id, change_version, change_xid)
+                VALUES (TG_ARGV[0], OLD.id, nextval('students_change_seq'), txid_current())
+                ON CONFLICT (entity, entity_id) DO UPDATE
+                    SET change_version = EXCLUDED.change_version, change_xid = EXCLUDED.change_xid,
+                        deleted_at = CURRENT_TIMESTAMP;
+                RETURN OLD;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_students_tombstone ON students;
+            CREATE TRIGGER trg_students_tombstone AFTER DELETE ON students
+                FOR EACH ROW EXECUTE FUNCTION record_sync_tombstone('student');
+            DROP TRIGGER IF EXISTS trg_activities_tombstone ON activities;
+            CREATE TRIGGER trg_activities_tombstone AFTER DELETE ON activities
+                FOR EACH ROW EXECUTE FUNCTION record_sync_tombstone('activity');
+            DROP TRIGGER IF EXISTS trg_prizes_tombstone ON prize_inventory;
+            CREATE TRIGGER trg_prizes_tombstone AFTER DELETE ON prize_inventory
+                FOR EACH ROW EXECUTE FUNCTION record_sync_tombstone('prize');
+        """)
+
+        # 19. Offline award uploads (see transaction_manager.add_points_batch)
+        cur.execute("""
+            ALTER TABLE activity_log ADD COLUMN IF NOT EXISTS client_uuid UUID;
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_activity_log_client_uuid
+                ON activity_log (client_uuid) WHERE client_uuid IS NOT NULL;
+        """)
+
+        # 20. Idempotency-Key responses (see idempotency.py; pruned by the scheduler)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope TEXT NOT NULL,
+                actor TEXT NOT NULL,
+                idem_key TEXT NOT NULL,
+                request_hash TEXT NOT NULL,
+                status_code SMALLINT,
+                response_body TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, actor, idem_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);
+        """)
+
         conn.commit()
         logger.info("Database initialized/migrated successfully.")
+
+        # First run after section 13: compute keys for the existing roster
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM students) AS has_students,
+                   EXISTS (SELECT 1 FROM student_match_keys) AS has_keys
+        """)
+        row = cur.fetchone()
+        if row['has_students'] and not row['has_keys']:
+            import student_keys
+            student_keys.rebuild_all()
     except Exception as e:
         conn.rollback()
         logger.critical(f"DB Init Failed: {e}")
@@ -0,0 +1,188 @@
+"""
+duplicate_audit.py - Whole-roster duplicate scan
+Runs as the 'duplicate_audit' background job (job_handlers.py). Students are
+grouped by the blocking keys from student_keys.py (phonetic name pairs,
+phone, email); only students that share a key are compared, so the scan is
+roughly linear in roster size instead of O(n^2).
+
+Results go to student_duplicates, one row per pair (student_a < student_b),
+where admins review them (/admin/duplicates). Dismissed pairs stay dismissed
+across re-runs; open pairs that no longer match are removed.
+"""
+import time
+import logging
+from collections import defaultdict
+from psycopg2.extras import execute_values
+from db_utils import get_db_connection
+import student_keys
+
+logger = logging.getLogger(__name__)
+
+MAX_BLOCK = 50               # Blocks larger than this (very common names) use a sorted window
+WINDOW = 10                  # Neighbours compared per student inside a large block
+MAX_CONTACT_BLOCK = 200      # A phone/email shared by more students is a placeholder: skip it
+CONTACT_NAME_THRESHOLD = 0.7 # Shared phone/email still needs a similar name (siblings share contacts)
+STATUSES = ('open', 'dismissed', 'merged')
+
+
+def _load_students(cur):
+    cur.execute("SELECT id, full_name, phone, email FROM students WHERE merged_into IS NULL")
+    for row in cur.fetchall():
+        if isinstance(row, dict):
+            yield row['id'], row['full_name'], row['phone'], row['email']
+        else:
+            yield row[0], row[1], row[2], row[3]
+
+
+def find_pairs(students, progress=None):
+    """
+    students: iterable of (id, full_name, phone, email).
+    Returns {(a, b): (score, reasons)} for likely duplicates.
+    """
+    names = {}
+    blocks = defaultdict(list)
+    for sid, full_name, phone, email in students:
+        names[sid] = student_keys.tokens(full_name)
+        for key in student_keys.match_keys(full_name, phone, email):
+            blocks[key].append(sid)
+
+    if progress:
+        progress(30, f"{len(names):,} students, {len(blocks):,} keys")
+
+    shared = defaultdict(set)   # (a, b) -> key types they share
+    skipped = 0
+    for (key_type, _), ids in blocks.items():
+        if len(ids) < 2:
+            continue
+        if key_type in ('phone', 'email') and len(ids) > MAX_CONTACT_BLOCK:
+            skipped += 1
+            continue
+        if len(ids) > MAX_BLOCK:
+            # Sorted neighbourhood: near-identical names sort next to each other
+            ids.sort(key=lambda sid: (' '.join(names[sid]), sid))
+            width = WINDOW
+        else:
+            width = len(ids)
+        for i in range(len(ids)):
+            for j in range(i + 1, min(i + 1 + width, len(ids))):
+                a, b = ids[i], ids[j]
+                shared[(a, b) if a < b else (b, a)].add(key_type)
+    if skipped:
+        logger.info(f"Duplicate audit skipped {skipped} placeholder contacts (> {MAX_CONTACT_BLOCK} students)")
+
+    if progress:
+        progress(50, f"Scoring {len(shared):,} candidate pairs")
+
+    pairs = {}
+    for (a, b), key_types in shared.items():
+        score = student_keys.tokens_score(names[a], names[b])
+        reasons = [r for r in ('phone', 'email') if r in key_types]
+        if score >= student_keys.MATCH_THRESHOLD:
+            reasons.insert(0, 'name')
+        elif not (reasons and score >= CONTACT_NAME_THRESHOLD):
+            continue
+        pairs[(a, b)] = (score, ','.join(reasons))
+    return pairs
+
+
+def run(progress=None, recorded_by='system'):
+    """Scans the roster and refreshes student_duplicates. Returns a summary dict."""
+    started = time.monotonic()
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT CURRENT_TIMESTAMP AS now")
+        row = cur.fetchone()
+        run_at = row['now'] if isinstance(row, dict) else row[0]
+
+        if progress:
+            progress(5, "Loading students")
+        pairs = find_pairs(_load_students(cur), progress)
+
+        if progress:
+            progress(80, f"Saving {len(pairs):,} pairs")
+        if pairs:
+            execute_values(cur, """
+                INSERT INTO student_duplicates (student_a, student_b, score, reasons, found_at)
+                VALUES %s
+                ON CONFLICT (student_a, student_b) DO UPDATE
+                SET score = EXCLUDED.score, reasons = EXCLUDED.reasons, found_at = EXCLUDED.found_at
+            """, [(a, b, score, reasons, run_at) for (a, b), (score, reasons) in pairs.items()], page_size=5000)
+
+        cur.execute("DELETE FROM student_duplicates WHERE status = 'open' AND found_at < %s", (run_at,))
+        cur.execute("SELECT COUNT(*) AS n FROM student_duplicates WHERE status = 'open'")
+        row = cur.fetchone()
+        open_count = row['n'] if isinstance(row, dict) else row[0]
+
+        elapsed = round(time.monotonic() - started, 1)
+        cur.execute("""
+            INSERT INTO audit_log (action_type, details, recorded_by, event_time)
+            VALUES ('DUPLICATE_AUDIT_RUN', %s, %s, CURRENT_TIMESTAMP)
+        """, (f"Duplicate audit: {len(pairs)} matching pairs, {open_count} open for review ({elapsed}s)", recorded_by))
+        conn.commit()
+        logger.info(f"Duplicate audit done: {len(pairs)} pairs, {open_count} open, {elapsed}s")
+        return {"pairs": len(pairs), "open": open_count, "seconds": elapsed}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def list_pairs(status='open', limit=100, offset=0):
+    """Pairs for review with both students' details, best score first."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT d.student_a, d.student_b, d.score, d.reasons, d.status, d.found_at,
+                   d.reviewed_by, d.reviewed_at,
+                   a.full_name AS a_name, a.classroom AS a_classroom, a.grade AS a_grade,
+                   a.phone AS a_phone, a.email AS a_email, a.total_points AS a_points, a.active AS a_active,
+                   b.full_name AS b_name, b.classroom AS b_classroom, b.grade AS b_grade,
+                   b.phone AS b_phone, b.email AS b_email, b.total_points AS b_points, b.active AS b_active
+            FROM student_duplicates d
+            JOIN students a ON a.id = d.student_a
+            JOIN students b ON b.id = d.student_b
+            WHERE d.status = %s
+            ORDER BY d.score DESC, d.student_a, d.student_b
+            LIMIT %s OFFSET %s
+        """, (status, limit, offset))
+        rows = []
+        for row in cur.fetchall():
+            item = dict(row)
+            for ts in ('found_at', 'reviewed_at'):
+                if item[ts] is not None:
+                    item[ts] = item[ts].isoformat()
+            item['score'] = float(item['score'])
+            item['reasons'] = item['reasons'].split(',') if item['reasons'] else []
+            rows.append(item)
+        return rows
+    finally:
+        conn.close()
+
+
+def set_status(student_a, student_b, status, reviewed_by):
+    """Marks a pair dismissed / merged / open again. Returns False if the pair is unknown."""
+    if status not in STATUSES:
+        raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+    a, b = sorted((student_a, student_b))
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE student_duplicates
+            SET status = %s, reviewed_by = %s, reviewed_at = CURRENT_TIMESTAMP
+            WHERE student_a = %s AND student_b = %s
+        """, (status, reviewed_by, a, b))
+        found = cur.rowcount > 0
+        conn.commit()
+        return found
+    finally:
+        conn.close()
@@ -0,0 +1,123 @@
+"""
+idempotency.py - Idempotency-Key support for the point-changing APIs
+A client sends the same Idempotency-Key header when it retries a request
+(double-click, lost response, flaky Wi-Fi). The first request claims the key
+and runs; its response is stored in idempotency_keys. Any replay gets the
+stored response back without running the award/redemption again.
+
+Keys are scoped per endpoint and per staff login, and bound to a hash of the
+request body: re-using a key for a different request is rejected. Stored
+responses expire after IDEMPOTENCY_TTL_HOURS (pruned by the scheduler's
+'idempotency_prune' job).
+
+A claim whose request is still running answers 'in_progress'. If the worker
+died before finishing, the claim can be taken over after CLAIM_TIMEOUT_SECONDS.
+Server errors (5xx) are not stored: the key is released so the retry runs.
+"""
+import os
+import hashlib
+import logging
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+CLAIM_TIMEOUT_SECONDS = 60
+MAX_KEY_LENGTH = 255
+
+
+def request_hash(body):
+    return hashlib.sha256(body or b'').hexdigest()
+
+
+def claim(scope, actor, key, body_hash):
+    """
+    Claims a key before the request runs. Returns (state, stored):
+      ('new', None)                    -> run the request, then call finish()
+      ('replay', (status_code, body))  -> return the stored response
+      ('in_progress', None)            -> the first request has not finished yet
+      ('mismatch', None)               -> key already used for a different request
+    Raises RuntimeError if the database is unavailable.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO idempotency_keys (scope, actor, idem_key, request_hash)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (scope, actor, idem_key) DO NOTHING
+            RETURNING created_at
+        """, (scope, actor, key, body_hash))
+        if cur.fetchone():
+            conn.commit()
+            return 'new', None
+
+        cur.execute("""
+            SELECT request_hash, status_code, response_body,
+                   created_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS stale,
+                   created_at < CURRENT_TIMESTAMP - make_interval(hours => %s) AS expired
+            FROM idempotency_keys
+            WHERE scope = %s AND actor = %s AND idem_key = %s
+            FOR UPDATE
+        """, (CLAIM_TIMEOUT_SECONDS, TTL_HOURS, scope, actor, key))
+        row = cur.fetchone()
+
+        # Expired (not yet pruned) or abandoned claims are taken over
+        if row is None or row['expired'] or (row['status_code'] is None and row['stale']):
+            cur.execute("""
+                INSERT INTO idempotency_keys (scope, actor, idem_key, request_hash)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (scope, actor, idem_key) DO UPDATE
+                    SET request_hash = EXCLUDED.request_hash, status_code = NULL,
+                        response_body = NULL, created_at = CURRENT_TIMESTAMP
+            """, (scope, actor, key, body_hash))
+            conn.commit()
+            return 'new', None
+
+        conn.commit()
+        if row['request_hash'] != body_hash:
+            return 'mismatch', None
+        if row['status_code'] is None:
+            return 'in_progress', None
+        return 'replay', (row['status_code'], row['response_body'])
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def finish(scope, actor, key, status_code, body):
+    """Stores the response for replays (or releases the key after a server error)."""
+    conn = get_db_connection()
+    if not conn:
+        logger.error(f"Idempotency key {scope}/{key} left claimed: database connection failed")
+        return
+    try:
+        cur = conn.cursor()
+        if status_code >= 500:
+            cur.execute("""
+                DELETE FROM idempotency_keys WHERE scope = %s AND actor = %s AND idem_key = %s
+            """, (scope, actor, key))
+        else:
+            cur.execute("""
+                UPDATE idempotency_keys SET status_code = %s, response_body = %s
+                WHERE scope = %s AND actor = %s AND idem_key = %s
+            """, (status_code, body, scope, actor, key))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Failed to store idempotent response for {scope}/{key}: {e}")
+    finally:
+        conn.close()
+
+
+def prune(cur):
+    """Deletes stored responses older than TTL_HOURS. Returns the number removed."""
+    cur.execute("""
+        DELETE FROM idempotency_keys
+        WHERE created_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+    """, (TTL_HOURS,))
+    return cur.rowcount
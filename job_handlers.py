@@ -0,0 +1,165 @@
+"""
+job_handlers.py - Handlers for job_queue job types
+Each handler is (job, progress) -> result file path or None.
+Exports stream rows through a server-side cursor straight to disk, so
+memory stays flat no matter how large activity_log / audit_log get.
+"""
+import os
+import csv
+import shutil
+import logging
+from datetime import datetime
+from db_utils import get_db_connection, estimate_rows
+from job_queue import register, artifact_path
+
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 5000
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'app.log')
+
+# job_type -> roles allowed to queue it from the API
+JOB_ROLES = {
+    'students_csv': ('staff', 'admin', 'sysadmin'),
+    'audit_csv': ('admin', 'sysadmin'),
+    'redemptions_csv': ('admin', 'sysadmin'),
+    'daily_report': ('admin', 'sysadmin'),
+    'rotate_logs': ('admin', 'sysadmin'),
+    'duplicate_audit': ('admin', 'sysadmin'),
+}
+
+
+def _export_csv(job, progress, filename, headers, sql, params, format_row):
+    """Runs sql with a named cursor and writes every row to the job's artifact file."""
+    path = artifact_path(job['id'], filename)
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        total = estimate_rows(conn.cursor(), sql, params) or 1
+        cur = conn.cursor(name=f"export_{job['id']}")
+        cur.itersize = FETCH_SIZE
+        cur.execute(sql, params)
+
+        written = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            for row in cur:
+                writer.writerow(format_row(row))
+                written += 1
+                if written % FETCH_SIZE == 0:
+                    progress(100 * written / max(total, written), f"{written:,} rows")
+        cur.close()
+        conn.commit()
+        return path
+    finally:
+        conn.close()
+
+
+@register('students_csv')
+def export_students_csv(job, progress):
+    sql = """
+        SELECT s.id, s.full_name, s.nickname, s.grade, s.classroom,
+               s.parent_name, s.email, s.phone, s.sms_consent,
+               COALESCE(SUM(al.points), 0) as total_points
+        FROM students s
+        LEFT JOIN activity_log al ON s.id = al.student_id
+        GROUP BY s.id
+        ORDER BY s.grade ASC, s.classroom ASC, s.full_name ASC
+    """
+    headers = ['Student ID', 'Full Name', 'Nickname', 'Grade', 'Classroom',
+               'Parent Name', 'Email', 'Phone', 'SMS Consent', 'Total Points']
+
+    def fmt(row):
+        return [row['id'], row['full_name'], row['nickname'], row['grade'], row['classroom'],
+                row['parent_name'], row['email'], row['phone'],
+                'Yes' if row['sms_consent'] else 'No', row['total_points']]
+
+    filename = f"All_Students_Export_{datetime.now().strftime('%Y-%m-%d')}.csv"
+    return _export_csv(job, progress, filename, headers, sql, (), fmt)
+
+
+@register('audit_csv')
+def export_audit_csv(job, progress):
+    """Payload mirrors the audit log page filters: start_date, end_date, search."""
+    payload = job.get('payload') or {}
+    sql = "SELECT id, event_time, action_type, recorded_by, details FROM audit_log WHERE 1=1"
+    params = []
+
+    if payload.get('start_date'):
+        sql += " AND event_time::DATE >= %s"
+        params.append(payload['start_date'])
+    if payload.get('end_date'):
+        sql += " AND event_time::DATE <= %s"
+        params.append(payload['end_date'])
+    if payload.get('search'):
+        sql += " AND (details ILIKE %s OR action_type ILIKE %s OR recorded_by ILIKE %s)"
+        pattern = f"%{payload['search']}%"
+        params.extend([pattern, pattern, pattern])
+    sql += " ORDER BY event_time DESC"
+
+    def fmt(row):
+        return [row['id'], row['event_time'], row['action_type'], row['recorded_by'], row['details']]
+
+    filename = f"Audit_Logs_{datetime.now().strftime('%Y-%m-%d')}.csv"
+    return _export_csv(job, progress, filename, ['ID', 'Timestamp', 'Action', 'User', 'Details'], sql, tuple(params), fmt)
+
+
+@register('redemptions_csv')
+def export_redemptions_csv(job, progress):
+    sql = """
+        SELECT al.timestamp, s.full_name, s.grade, s.classroom,
+               al.activity_type, al.points, al.recorded_by
+        FROM activity_log al
+        JOIN students s ON al.student_id = s.id
+        WHERE al.activity_type LIKE 'Redemption:%%'
+        ORDER BY al.timestamp DESC
+    """
+
+    def fmt(row):
+        return [row['timestamp'], row['full_name'], row['grade'], row['classroom'],
+                row['activity_type'], row['points'], row['recorded_by']]
+
+    filename = f"Redemptions_{datetime.now().strftime('%Y-%m-%d')}.csv"
+    headers = ['Date', 'Student', 'Grade', 'Classroom', 'Prize', 'Points', 'Staff']
+    return _export_csv(job, progress, filename, headers, sql, (), fmt)
+
+
+@register('daily_report')
+def run_daily_report(job, progress):
+    import daily_report
+    progress(10, "Generating report")
+    daily_report.run(recorded_by=job.get('created_by') or 'system')
+    return None
+
+
+@register('duplicate_audit')
+def run_duplicate_audit(job, progress):
+    import duplicate_audit
+    duplicate_audit.run(progress, recorded_by=job.get('created_by') or 'system')
+    return None
+
+
+@register('rotate_logs')
+def rotate_logs(job, progress):
+    """
+    Archives app.log as the job's artifact and truncates it in place.
+    Log handlers append (O_APPEND), so every process keeps writing to the
+    fresh file without being told about the rotation.
+    """
+    import transaction_manager
+    if not os.path.exists(LOG_PATH):
+        return None
+
+    archive = artifact_path(job['id'], f"app.log.{datetime.now().strftime('%Y%m%d%H%M%S')}")
+    shutil.copyfile(LOG_PATH, archive)
+    with open(LOG_PATH, 'r+') as f:
+        f.truncate(0)
+
+    transaction_manager.log_audit_event(
+        action_type="CLEAR_LOGS",
+        details=f"System logs cleared/rotated. Archived to {os.path.basename(archive)}",
+        recorded_by=job.get('created_by') or 'system'
+    )
+    logger.info(f"Log file rotated. Archived as {os.path.basename(archive)}")
+    return archive
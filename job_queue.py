@@ -0,0 +1,312 @@
+"""
+job_queue.py - Postgres-backed background job queue
+Long-running admin work (CSV exports, the daily report, log rotation) is
+queued in the job_queue table and picked up by workers with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can share it.
+
+Workers:
+    JOB_WORKER_MODE=inline (default)  each web process starts a worker thread at boot (and on enqueue)
+    JOB_WORKER_MODE=external          only `python worker.py` processes run jobs
+
+Inline is the supported deployment. Result files (JOB_ARTIFACT_DIR) and the
+log file that rotate_logs rotates are local to the machine, so an external
+worker is only correct on the same host as the web processes (shared disk),
+never as a separate dyno/container.
+
+While a job runs, a heartbeat thread touches heartbeat_at every
+HEARTBEAT_SECONDS, so a long handler that reports no progress is not taken
+for a dead worker and run twice.
+
+Handlers are registered in job_handlers.py. A handler receives the job dict
+and a progress(percent, message) callback, and may return the path of a
+result file written under JOB_ARTIFACT_DIR (served by /api/jobs/<id>/download).
+"""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+JOB_ARTIFACT_DIR = os.getenv('JOB_ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job_artifacts'))
+JOB_WORKER_MODE = os.getenv('JOB_WORKER_MODE', 'inline').lower()
+POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '5'))
+STALE_MINUTES = 15          # A running job with no heartbeat for this long is requeued
+HEARTBEAT_SECONDS = 60      # Heartbeat interval while a job runs (well under STALE_MINUTES)
+MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = ("id, job_type, payload, status, progress, message, result_name, error, "
+               "attempts, created_by, created_at, started_at, finished_at")
+
+HANDLERS = {}
+
+_inline_started = False
+_inline_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def register(job_type):
+    """Decorator: @register('students_csv') def handler(job, progress): ..."""
+    def _wrap(fn):
+        HANDLERS[job_type] = fn
+        return fn
+    return _wrap
+
+
+def _row_to_job(row):
+    if not row:
+        return None
+    is_dict = isinstance(row, dict)
+    keys = [c.strip() for c in JOB_COLUMNS.split(',')]
+    job = {k: (row[k] if is_dict else row[i]) for i, k in enumerate(keys)}
+    for ts in ('created_at', 'started_at', 'finished_at'):
+        if job[ts] is not None:
+            job[ts] = job[ts].isoformat()
+    if isinstance(job['payload'], str):
+        job['payload'] = json.loads(job['payload'])
+    return job
+
+
+def artifact_path(job_id, filename):
+    """Where a handler should write its result file."""
+    os.makedirs(JOB_ARTIFACT_DIR, exist_ok=True)
+    return os.path.join(JOB_ARTIFACT_DIR, f"job_{job_id}_{os.path.basename(filename)}")
+
+
+# --- PRODUCER SIDE ---
+
+def enqueue(job_type, payload=None, created_by='system'):
+    """Queues a job and returns it as a dict (None if the DB is unavailable)."""
+    if job_type not in HANDLERS:
+        import job_handlers  # noqa: F401  (registers handlers)
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO job_queue (job_type, payload, created_by)
+            VALUES (%s, %s, %s)
+            RETURNING {JOB_COLUMNS}
+        """, (job_type, json.dumps(payload or {}), created_by))
+        job = _row_to_job(cur.fetchone())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if JOB_WORKER_MODE == 'inline':
+        start_inline_worker()
+    _wake.set()
+    return job
+
+
+def get_job(job_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {JOB_COLUMNS}, result_path FROM job_queue WHERE id = %s", (job_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        job = _row_to_job(row)
+        job['result_path'] = row['result_path'] if isinstance(row, dict) else row[-1]
+        return job
+    finally:
+        conn.close()
+
+
+def list_jobs(created_by=None, limit=20):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        if created_by:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM job_queue WHERE created_by = %s ORDER BY id DESC LIMIT %s", (created_by, limit))
+        else:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM job_queue ORDER BY id DESC LIMIT %s", (limit,))
+        return [_row_to_job(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+# --- WORKER SIDE ---
+
+def _claim_next(worker_id):
+    """Locks the oldest queued job (skipping ones other workers hold) and marks it running."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE job_queue SET status = 'running', attempts = attempts + 1,
+                   started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP,
+                   locked_by = %s, progress = 0, error = NULL
+            WHERE id = (
+                SELECT id FROM job_queue
+                WHERE status = 'queued'
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {JOB_COLUMNS}
+        """, (worker_id,))
+        job = _row_to_job(cur.fetchone())
+        conn.commit()
+        return job
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Job claim failed: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def _requeue_stale():
+    """Jobs whose worker died mid-run go back to the queue (or fail after MAX_ATTEMPTS)."""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE job_queue
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                error = 'Worker stopped responding', locked_by = NULL
+            WHERE status = 'running'
+              AND heartbeat_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 minute')
+        """, (MAX_ATTEMPTS, STALE_MINUTES))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Stale job sweep failed: {e}")
+    finally:
+        conn.close()
+
+
+def _update(job_id, **fields):
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        set_clauses = ", ".join(f"{k} = %s" for k in fields)
+        cur.execute(
+            f"UPDATE job_queue SET {set_clauses}, heartbeat_at = CURRENT_TIMESTAMP WHERE id = %s",
+            tuple(fields.values()) + (job_id,)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not update job {job_id}: {e}")
+    finally:
+        conn.close()
+
+
+def _heartbeat(job_id):
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE job_queue SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'running'", (job_id,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+    finally:
+        conn.close()
+
+
+def _start_heartbeat(job_id):
+    """Keeps the job's heartbeat fresh until the returned event is set."""
+    done = threading.Event()
+
+    def _beat():
+        while not done.wait(HEARTBEAT_SECONDS):
+            _heartbeat(job_id)
+
+    threading.Thread(target=_beat, name=f"job-heartbeat-{job_id}", daemon=True).start()
+    return done
+
+
+def _run(job):
+    handler = HANDLERS.get(job['job_type'])
+    if handler is None:
+        _update(job['id'], status='failed', error=f"No handler for {job['job_type']}", finished_at=datetime.now())
+        return
+
+    last_report = [0.0]
+
+    def progress(percent, message=None):
+        # Heartbeat + progress, at most once a second
+        now = time.monotonic()
+        if now - last_report[0] >= 1.0:
+            last_report[0] = now
+            _update(job['id'], progress=max(0, min(99, int(percent))), message=message)
+
+    heartbeat = _start_heartbeat(job['id'])
+    try:
+        result_path = handler(job, progress)
+        fields = {'status': 'done', 'progress': 100, 'finished_at': datetime.now()}
+        if result_path:
+            fields['result_path'] = result_path
+            fields['result_name'] = os.path.basename(result_path).split('_', 2)[-1]
+        _update(job['id'], **fields)
+    except Exception as e:
+        logger.exception(f"Job {job['id']} ({job['job_type']}) failed: {e}")
+        _update(job['id'], status='failed', error=str(e), finished_at=datetime.now())
+    finally:
+        heartbeat.set()
+
+
+def run_worker(once=False, worker_id=None):
+    """Processes jobs until stopped (or until the queue is empty when once=True)."""
+    import job_handlers  # noqa: F401  (registers handlers)
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    last_sweep = 0.0
+    while True:
+        if time.monotonic() - last_sweep > 60:
+            _requeue_stale()
+            last_sweep = time.monotonic()
+
+        job = _claim_next(worker_id)
+        if job:
+            _run(job)
+            continue
+        if once:
+            return
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+
+
+def start_inline_worker():
+    """Starts one worker thread in this process (idempotent)."""
+    global _inline_started
+    with _inline_lock:
+        if _inline_started:
+            return
+        _inline_started = True
+
+    def _loop():
+        while True:
+            try:
+                run_worker()
+            except Exception as e:
+                logger.warning(f"Inline job worker crashed, restarting: {e}")
+                time.sleep(POLL_SECONDS)
+
+    threading.Thread(target=_loop, name="job-worker", daemon=True).start()
@@ -0,0 +1,571 @@
+"""
+load_test.py - Local load-testing harness for the Point Tracker
+Seeds a LOCAL Postgres with synthetic volume and drives a realistic traffic
+mix (search, award, redeem, history, reports) against the Flask app.
+Alert providers are stubbed (or faked) so no email/SMS/WhatsApp is ever sent.
+
+Usage:
+    # 1. Seed (DATABASE_URL must point at a local database)
+    python load_test.py seed --students 50000 --activity-rows 10000000 --audit-rows 20000000
+
+    # 2. Drive traffic in-process and save the results
+    python load_test.py run --duration 60 --concurrency 8 --output bench_baseline.json
+
+    # 3. Re-run after a change and compare against the saved baseline
+    python load_test.py run --duration 60 --concurrency 8 --baseline bench_baseline.json
+
+    # Optional: target a running server (e.g. gunicorn) instead of the in-process app
+    python load_test.py run --base-url http://127.0.0.1:8000
+
+    # Optional: run the real alert pipeline against fake providers (latency, failures, 429s)
+    python load_test.py run --alerts fake --fake-latency-ms 250 --fake-failure-rate 0.05 --fake-throttle-rate 0.02
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BENCH_USER = "bench_admin"
+BENCH_PASSWORD = "Bench123!"
+
+FIRST_NAMES = [
+    "José", "Luis", "María", "Juan", "Ana", "Carlos", "Sofía", "Miguel", "Valentina", "Diego",
+    "Camila", "Jorge", "Fernanda", "Alejandro", "Daniela", "Ricardo", "Ximena", "Fernando", "Lucía", "Andrés",
+    "Regina", "Emiliano", "Renata", "Santiago", "Mariana", "Mateo", "Paula", "Sebastián", "Isabella", "Leonardo"
+]
+LAST_NAMES = [
+    "Pérez", "García", "Hernández", "López", "Martínez", "González", "Rodríguez", "Sánchez", "Ramírez", "Cruz",
+    "Flores", "Gómez", "Morales", "Vázquez", "Reyes", "Jiménez", "Torres", "Díaz", "Gutiérrez", "Ruiz",
+    "Mendoza", "Aguilar", "Ortiz", "Moreno", "Castillo", "Romero", "Álvarez", "Méndez", "Chávez", "Rivera"
+]
+ACTIVITY_NAMES = [
+    "Reading Log", "Book Report", "Library Visit", "Reading Challenge", "Homework Club",
+    "Story Time", "Spelling Bee", "Poetry Recital", "Attendance Bonus", "Family Reading Night"
+]
+PRIZE_NAMES = [
+    "Pencil", "Eraser", "Sticker Pack", "Notebook", "Bookmark", "Comic Book",
+    "Puzzle", "Board Game", "Backpack", "Headphones"
+]
+
+DEFAULT_MIX = "search=45,award=20,history=20,redeem=5,profile=5,report=5"
+
+
+# ---- 1. Seeding ----
+
+def _require_local_database(allow_remote):
+    """
+    The db_utils fallback URL points at a cloud database, so we refuse to
+    seed unless DATABASE_URL is explicitly set to a local host.
+    """
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        print("❌ DATABASE_URL is not set. Point it at a LOCAL Postgres before seeding.")
+        sys.exit(1)
+
+    host = urlparse(db_url).hostname or ""
+    if host not in ("localhost", "127.0.0.1", "::1") and not allow_remote:
+        print(f"❌ Refusing to seed non-local host '{host}'. Use --allow-remote if you really mean it.")
+        sys.exit(1)
+
+
+def _sql_array(values):
+    """Builds a Postgres ARRAY literal from trusted constants."""
+    quoted = ", ".join("'" + v.replace("'", "''") + "'" for v in values)
+    return f"ARRAY[{quoted}]"
+
+
+def seed(args):
+    from werkzeug.security import generate_password_hash
+    from db_utils import get_db_connection, init_db
+
+    _require_local_database(args.allow_remote)
+    init_db()
+
+    conn = get_db_connection()
+    if not conn:
+        print("❌ Could not connect to the database.")
+        sys.exit(1)
+
+    try:
+        cur = conn.cursor()
+        started = time.time()
+
+        # 1. Catalogs (small, idempotent)
+        for i, name in enumerate(ACTIVITY_NAMES):
+            cur.execute("""
+                INSERT INTO activities (name, description, default_points, active)
+                VALUES (%s, 'Synthetic benchmark activity', %s, TRUE)
+                ON CONFLICT (name) DO NOTHING
+            """, (name, 10 * (i + 1)))
+        for i, name in enumerate(PRIZE_NAMES):
+            cur.execute("""
+                INSERT INTO prize_inventory (name, description, point_cost, stock_count, active)
+                VALUES (%s, 'Synthetic benchmark prize', %s, %s, TRUE)
+                ON CONFLICT (name) DO UPDATE SET stock_count = EXCLUDED.stock_count
+            """, (name, 25 * (i + 1), 10_000_000))
+
+        # 2. Bench login (used by --base-url mode)
+        cur.execute("SELECT id FROM users WHERE username = %s", (BENCH_USER,))
+        if not cur.fetchone():
+            cur.execute("""
+                INSERT INTO users (username, password_hash, role, active)
+                VALUES (%s, %s, 'sysadmin', TRUE)
+            """, (BENCH_USER, generate_password_hash(BENCH_PASSWORD)))
+        conn.commit()
+
+        # 3. Students (generated server-side; one round trip)
+        print(f"⏳ Inserting {args.students:,} students...")
+        cur.execute(f"""
+            INSERT INTO students (full_name, nickname, grade, classroom, parent_name, phone, email, sms_consent, total_points, active)
+            SELECT
+                f.name || ' ' || l1.name || ' ' || l2.name,
+                CASE WHEN random() < 0.3 THEN f.name ELSE NULL END,
+                (1 + (g % 6))::TEXT,
+                (1 + (g % 6))::TEXT || chr(65 + (g % 4)),
+                'Parent ' || l1.name,
+                CASE WHEN random() < 0.7 THEN '55' || lpad((g * 7919 % 100000000)::TEXT, 8, '0') ELSE NULL END,
+                CASE WHEN random() < 0.5 THEN 'bench' || g || '@example.com' ELSE NULL END,
+                random() < 0.5,
+                0,
+                random() > 0.05
+            FROM generate_series(1, %s) AS g
+            CROSS JOIN LATERAL (SELECT ({_sql_array(FIRST_NAMES)})[1 + (random() * {len(FIRST_NAMES) - 1})::INT + (g * 0)] AS name) f
+            CROSS JOIN LATERAL (SELECT ({_sql_array(LAST_NAMES)})[1 + (random() * {len(LAST_NAMES) - 1})::INT + (g * 0)] AS name) l1
+            CROSS JOIN LATERAL (SELECT ({_sql_array(LAST_NAMES)})[1 + (random() * {len(LAST_NAMES) - 1})::INT + (g * 0)] AS name) l2
+        """, (args.students,))
+        conn.commit()
+
+        cur.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM students")
+        bounds = cur.fetchone()
+        lo, hi = bounds['lo'], bounds['hi']
+        cur.execute("SELECT id, name FROM activities ORDER BY id")
+        activity_rows = cur.fetchall()
+        act_lo, act_hi = activity_rows[0]['id'], activity_rows[-1]['id']
+
+        # 4. Activity log, in chunks so a 10M-row seed does not build one giant transaction
+        _seed_chunked(cur, conn, "activity_log", args.activity_rows, args.chunk_size, f"""
+            INSERT INTO activity_log (student_id, activity_type, points, description, timestamp, recorded_by, activity_id)
+            SELECT
+                {lo} + (random() * {hi - lo})::INT,
+                CASE WHEN r < 0.05 THEN 'Redemption: ' || ({_sql_array(PRIZE_NAMES)})[1 + (random() * {len(PRIZE_NAMES) - 1})::INT]
+                     ELSE ({_sql_array(ACTIVITY_NAMES)})[1 + (random() * {len(ACTIVITY_NAMES) - 1})::INT] END,
+                CASE WHEN r < 0.05 THEN -(25 * (1 + (random() * 9)::INT)) ELSE 5 * (1 + (random() * 19)::INT) END,
+                'Synthetic',
+                NOW() - (random() * INTERVAL '365 days'),
+                'bench_seed',
+                CASE WHEN r < 0.05 THEN NULL ELSE {act_lo} + (random() * {act_hi - act_lo})::INT END
+            FROM (SELECT random() AS r FROM generate_series(1, %s)) AS s
+        """)
+
+        # 5. Audit log
+        _seed_chunked(cur, conn, "audit_log", args.audit_rows, args.chunk_size, f"""
+            INSERT INTO audit_log (event_time, event_type, action_type, actor, recorded_by, target_table, target_id, details)
+            SELECT
+                NOW() - (random() * INTERVAL '365 days'),
+                'TRANSACTION',
+                (ARRAY['POINT_AWARD', 'REDEEM_POINTS', 'USER_LOGIN', 'EMAIL_SENT', 'UPDATE_STUDENT'])[1 + (random() * 4)::INT],
+                'bench_seed',
+                'bench_seed',
+                'activity_log',
+                (random() * 1000000)::INT,
+                'Synthetic audit row ' || g
+            FROM generate_series(1, %s) AS g
+        """)
+
+        # 6. Rebuild the balance cache from the ledger
+        print("⏳ Recomputing student balances from activity_log...")
+        cur.execute("""
+            UPDATE students s
+            SET total_points = sub.total
+            FROM (SELECT student_id, SUM(points) AS total FROM activity_log GROUP BY student_id) sub
+            WHERE s.id = sub.student_id
+        """)
+        conn.commit()
+
+        # 7. Fresh planner statistics
+        conn.autocommit = True
+        cur.execute("ANALYZE students; ANALYZE activity_log; ANALYZE audit_log;")
+
+        print(f"✅ Seed complete in {time.time() - started:.1f}s")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Seed failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+def _seed_chunked(cur, conn, table, total, chunk_size, insert_sql):
+    """Runs insert_sql (with a single %s row count) until `total` rows are written."""
+    if total <= 0:
+        return
+    print(f"⏳ Inserting {total:,} rows into {table}...")
+    written = 0
+    while written < total:
+        batch = min(chunk_size, total - written)
+        cur.execute(insert_sql, (batch,))
+        conn.commit()
+        written += batch
+        print(f"   {table}: {written:,}/{total:,}")
+
+
+# ---- 2. Alert Stubs / Fake Providers ----
+
+STUB_CALLS = {}
+_stub_lock = threading.Lock()
+
+
+def stub_alert_providers():
+    """
+    Replaces the public alert entry points with counters so award and
+    redemption flows exercise their full code path without network calls.
+    """
+    import alerts
+
+    def make_stub(name):
+        def _stub(*args, **kwargs):
+            with _stub_lock:
+                STUB_CALLS[name] = STUB_CALLS.get(name, 0) + 1
+            return True
+        return _stub
+
+    for name in ("send_alert", "send_sms", "send_email_sms", "send_email_batch", "send_whatsapp"):
+        setattr(alerts, name, make_stub(name))
+
+
+def fake_alert_providers(args):
+    """
+    Keeps the whole alert pipeline (coalescing, threads, audit logging) and
+    swaps only the delivery layer for in-process fakes.
+    """
+    import alert_providers
+    alert_providers.configure(
+        'fake',
+        latency_ms=args.fake_latency_ms,
+        jitter_ms=args.fake_jitter_ms,
+        failure_rate=args.fake_failure_rate,
+        throttle_rate=args.fake_throttle_rate,
+    )
+
+
+# ---- 3. Traffic Drivers ----
+
+class InProcessClient:
+    """Drives the Flask app through its test client with a logged-in admin session."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['username'] = BENCH_USER
+            sess['role'] = 'sysadmin'
+
+    def get(self, path, params=None):
+        resp = self.client.get(path, query_string=params)
+        return resp.status_code, len(resp.data)
+
+    def post(self, path, payload):
+        resp = self.client.post(path, json=payload)
+        return resp.status_code, len(resp.data)
+
+
+class HttpClient:
+    """Drives a running server over HTTP; logs in once per worker."""
+
+    def __init__(self, base_url, username, password):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        resp = self.session.post(f"{self.base_url}/login", data={"username": username, "password": password}, allow_redirects=False)
+        if resp.status_code not in (302, 303):
+            raise RuntimeError(f"Bench login failed (HTTP {resp.status_code}). Did you run 'seed' against this server's DB?")
+
+    def get(self, path, params=None):
+        resp = self.session.get(f"{self.base_url}{path}", params=params)
+        return resp.status_code, len(resp.content)
+
+    def post(self, path, payload):
+        resp = self.session.post(f"{self.base_url}{path}", json=payload)
+        return resp.status_code, len(resp.content)
+
+
+def load_fixtures():
+    """Samples real IDs and search terms from the seeded database."""
+    from db_utils import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        print("❌ Could not connect to the database.")
+        sys.exit(1)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, full_name FROM students WHERE active = TRUE ORDER BY random() LIMIT 5000")
+        students = cur.fetchall()
+        cur.execute("SELECT id, name, default_points FROM activities WHERE active = TRUE")
+        activities = cur.fetchall()
+        cur.execute("SELECT id FROM prize_inventory WHERE active = TRUE AND stock_count > 0 ORDER BY point_cost LIMIT 3")
+        prizes = cur.fetchall()
+    finally:
+        conn.close()
+
+    if not students or not activities:
+        print("❌ No students/activities found. Run 'python load_test.py seed' first.")
+        sys.exit(1)
+
+    terms = set()
+    for s in students[:500]:
+        first = s['full_name'].split(' ')[0]
+        terms.add(first[:3])
+        terms.add(first)
+    return {
+        "student_ids": [s['id'] for s in students],
+        "activities": activities,
+        "prize_ids": [p['id'] for p in prizes],
+        "terms": sorted(terms),
+    }
+
+
+def build_operations(fx):
+    """Each operation returns (endpoint_label, status_code, response_bytes)."""
+
+    def op_search(c):
+        status, size = c.get('/api/students/search', {'term': random.choice(fx['terms'])})
+        return 'GET /api/students/search', status, size
+
+    def op_award(c):
+        act = random.choice(fx['activities'])
+        status, size = c.post('/api/transaction/record', {
+            'student_id': random.choice(fx['student_ids']),
+            'activity_id': act['id'],
+            'activity_name': act['name'],
+            'points': act['default_points'] or 10,
+            'description': 'load_test'
+        })
+        return 'POST /api/transaction/record', status, size
+
+    def op_redeem(c):
+        if not fx['prize_ids']:
+            return op_award(c)
+        status, size = c.post('/api/prizes/redeem', {
+            'student_id': random.choice(fx['student_ids']),
+            'prize_id': random.choice(fx['prize_ids'])
+        })
+        return 'POST /api/prizes/redeem', status, size
+
+    def op_history(c):
+        status, size = c.get(f"/api/student/{random.choice(fx['student_ids'])}/history")
+        return 'GET /api/student/<id>/history', status, size
+
+    def op_profile(c):
+        status, size = c.get(f"/api/student/{random.choice(fx['student_ids'])}")
+        return 'GET /api/student/<id>', status, size
+
+    def op_report(c):
+        path = random.choice(['/reports/redemptions', '/reports/inventory'])
+        status, size = c.get(path)
+        return f'GET {path}', status, size
+
+    return {
+        'search': op_search,
+        'award': op_award,
+        'redeem': op_redeem,
+        'history': op_history,
+        'profile': op_profile,
+        'report': op_report,
+    }
+
+
+def parse_mix(mix_str):
+    mix = {}
+    for part in mix_str.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * (pct / 100.0)
+    f = int(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+def summarize(samples, elapsed):
+    """samples: {label: [(latency_ms, status), ...]} -> {label: stats}"""
+    report = {}
+    for label, rows in sorted(samples.items()):
+        latencies = sorted(r[0] for r in rows)
+        errors = sum(1 for r in rows if r[1] >= 500)
+        report[label] = {
+            "count": len(rows),
+            "errors": errors,
+            "rps": round(len(rows) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p90_ms": round(percentile(latencies, 90), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        }
+    return report
+
+
+def print_report(report, elapsed, baseline=None):
+    header = f"{'Endpoint':<34} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    print("\n" + header)
+    print("-" * len(header))
+    total = 0
+    for label, s in report.items():
+        total += s['count']
+        line = (f"{label:<34} {s['count']:>7} {s['errors']:>5} {s['rps']:>8.1f} "
+                f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+        if baseline and label in baseline:
+            base_p95 = baseline[label].get('p95_ms') or 0
+            base_rps = baseline[label].get('rps') or 0
+            if base_p95:
+                line += f"   p95 {((s['p95_ms'] - base_p95) / base_p95) * 100:+.1f}%"
+            if base_rps:
+                line += f"  rps {((s['rps'] - base_rps) / base_rps) * 100:+.1f}%"
+        print(line)
+    print("-" * len(header))
+    print(f"Total: {total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s)")
+    if STUB_CALLS:
+        print(f"Stubbed alert calls: {STUB_CALLS}")
+
+
+def print_provider_stats():
+    import alert_providers
+    for kind, st in alert_providers.stats().items():
+        print(f"Fake {kind}: calls={st['calls']} messages={st['messages']} sent={st['sent']} "
+              f"failed={st['failed']} throttled={st['throttled']} max_in_flight={st['max_in_flight']} "
+              f"still_in_flight={st['in_flight']}")
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    fixtures = load_fixtures()
+    ops = build_operations(fixtures)
+
+    unknown = [m for m in mix if m not in ops]
+    if unknown:
+        print(f"❌ Unknown operations in --mix: {unknown}. Valid: {sorted(ops)}")
+        sys.exit(1)
+
+    names = list(mix.keys())
+    weights = [mix[n] for n in names]
+
+    if args.base_url:
+        make_client = lambda: HttpClient(args.base_url, args.username, args.password)
+    else:
+        if args.alerts == 'fake':
+            fake_alert_providers(args)
+        else:
+            stub_alert_providers()
+        import logging
+        # No WhatsApp probes or other background monitors while measuring
+        os.environ.setdefault('ENABLE_BACKGROUND_MONITORS', '0')
+        import app as app_module
+        # Keep per-request INFO lines off the console; the file log still records them.
+        app_module.console_handler.setLevel(logging.WARNING)
+        make_client = lambda: InProcessClient(app_module.app)
+
+    samples = {}
+    samples_lock = threading.Lock()
+    stop_at = time.time() + args.warmup + args.duration
+    record_after = time.time() + args.warmup
+
+    def worker(seed_value):
+        random.seed(seed_value)
+        client = make_client()
+        local = {}
+        while time.time() < stop_at:
+            op = ops[random.choices(names, weights)[0]]
+            t0 = time.perf_counter()
+            try:
+                label, status, _ = op(client)
+            except Exception as e:
+                label, status = f"EXCEPTION {type(e).__name__}", 599
+            latency_ms = (time.perf_counter() - t0) * 1000
+            if time.time() >= record_after:
+                local.setdefault(label, []).append((latency_ms, status))
+        with samples_lock:
+            for label, rows in local.items():
+                samples.setdefault(label, []).extend(rows)
+
+    print(f"⏳ Running {args.concurrency} workers for {args.duration}s (+{args.warmup}s warmup) mix={mix}")
+    threads = [threading.Thread(target=worker, args=(args.seed + i,), daemon=True) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    report = summarize(samples, args.duration)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f).get('endpoints', {})
+    print_report(report, args.duration, baseline)
+    if args.alerts == 'fake' and not args.base_url:
+        print_provider_stats()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "run_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "duration_s": args.duration,
+                "concurrency": args.concurrency,
+                "mix": mix,
+                "target": args.base_url or "in-process",
+                "endpoints": report,
+            }, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Point Tracker load-testing harness")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="Populate a local database with synthetic data")
+    p_seed.add_argument("--students", type=int, default=50_000)
+    p_seed.add_argument("--activity-rows", type=int, default=10_000_000)
+    p_seed.add_argument("--audit-rows", type=int, default=20_000_000)
+    p_seed.add_argument("--chunk-size", type=int, default=1_000_000)
+    p_seed.add_argument("--allow-remote", action="store_true", help="Allow seeding a non-local DATABASE_URL")
+
+    p_run = sub.add_parser("run", help="Drive a traffic mix and report latency percentiles")
+    p_run.add_argument("--duration", type=int, default=60, help="Measured seconds")
+    p_run.add_argument("--warmup", type=int, default=5, help="Unmeasured seconds before recording")
+    p_run.add_argument("--concurrency", type=int, default=8)
+    p_run.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted operations (default: {DEFAULT_MIX})")
+    p_run.add_argument("--seed", type=int, default=42, help="Random seed for reproducible mixes")
+    p_run.add_argument("--base-url", help="Target a running server instead of the in-process app")
+    p_run.add_argument("--username", default=BENCH_USER)
+    p_run.add_argument("--password", default=BENCH_PASSWORD)
+    p_run.add_argument("--output", help="Write JSON results to this file")
+    p_run.add_argument("--baseline", help="Compare against a previous --output file")
+    p_run.add_argument("--alerts", choices=("stub", "fake"), default="stub",
+                       help="stub: count alert calls only; fake: real alert pipeline with fake providers")
+    p_run.add_argument("--fake-latency-ms", type=float, default=50.0)
+    p_run.add_argument("--fake-jitter-ms", type=float, default=0.0)
+    p_run.add_argument("--fake-failure-rate", type=float, default=0.0)
+    p_run.add_argument("--fake-throttle-rate", type=float, default=0.0)
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
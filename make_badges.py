@@ -0,0 +1,93 @@
+"""
+make_badges.py - Printable QR badge sheets
+Each badge carries the student's name, classroom and a QR code of their
+badge_code (see badges.py) with the school logo in the centre, in the same
+style as static/make_integrated_qr.py. Scanning a badge at the kiosk
+(/api/kiosk/award) awards points without searching for the student.
+Rendering is done by badge_render.py across all cores.
+
+Usage:
+    python make_badges.py                          # every active student -> badges/badges.pdf
+    python make_badges.py --classroom A1 --classroom B2
+    python make_badges.py --url "https://example.com/guide|Escanea para ver la guía móvil"
+    python make_badges.py --format png --workers 4 --out badges/school.pdf
+
+Students without a badge_code get one first. Pages never mix classrooms.
+"""
+import os
+import time
+import argparse
+from db_utils import get_db_connection
+import badges
+import badge_render
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def student_targets(classrooms=None):
+    """Assigns missing codes, then returns one target per active student (grouped by classroom)."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        assigned = badges.assign_missing(cur)
+        conn.commit()
+        if assigned:
+            print(f"Assigned {assigned} new badge codes")
+
+        sql = "SELECT id, full_name, classroom, badge_code FROM students WHERE active = TRUE"
+        params = ()
+        if classrooms:
+            sql += " AND classroom = ANY(%s)"
+            params = (list(classrooms),)
+        cur.execute(sql + " ORDER BY classroom, full_name, id", params)
+
+        targets = []
+        for row in cur.fetchall():
+            classroom = row['classroom'] or 'Sin salón'
+            targets.append({
+                'qr': row['badge_code'],
+                'title': row['full_name'],
+                'subtitle': f"{classroom}  ·  {row['badge_code']}",
+                'group': classroom,
+            })
+        return targets
+    finally:
+        conn.close()
+
+
+def url_targets(specs):
+    """'URL|Caption' -> poster-style targets (one group, so they share pages)."""
+    targets = []
+    for spec in specs:
+        url, _, caption = spec.partition('|')
+        targets.append({'qr': url.strip(), 'title': caption.strip() or url.strip(), 'subtitle': url.strip(), 'group': 'urls'})
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render printable QR badge sheets")
+    parser.add_argument('--classroom', action='append', help="Only these classrooms (repeatable)")
+    parser.add_argument('--url', action='append', default=[], help="Extra 'URL|Caption' QR tiles; with --url only, students are skipped")
+    parser.add_argument('--out', default=os.path.join(BASE_DIR, 'badges', 'badges.pdf'), help="Output file (.pdf, or base name for PNG pages)")
+    parser.add_argument('--format', choices=('pdf', 'png'), default='pdf')
+    parser.add_argument('--workers', type=int, default=None, help="Render processes (default: all cores)")
+    args = parser.parse_args()
+
+    targets = []
+    if args.classroom or not args.url:
+        targets.extend(student_targets(args.classroom))
+    targets.extend(url_targets(args.url))
+    if not targets:
+        print("Nothing to render.")
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    started = time.monotonic()
+    files = badge_render.render(targets, args.out, fmt=args.format, workers=args.workers)
+    print(f"Rendered {len(targets)} badges in {time.monotonic() - started:.1f}s -> {', '.join(files)}")
+
+
+if __name__ == "__main__":
+    main()
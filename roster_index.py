@@ -0,0 +1,273 @@
+"""
+roster_index.py - In-memory student index for typeahead search
+Each worker keeps the roster in memory with a trigram index over
+full name, nickname and ID, and answers /api/students/search without
+touching the database.
+
+Freshness:
+  - A trigger stamps every INSERT/UPDATE of students (including point
+    balance changes) with change_version and the writing transaction
+    (change_xid), so a refresh only pulls changed rows.
+  - Each refresh remembers the commit-safe watermark taken before it read
+    (roster_sync.commit_watermark, the oldest transaction still running) and
+    the next one pulls change_xid >= watermark. A transaction that commits
+    late is therefore still picked up on the next refresh; rows already
+    seen at the same change_version are skipped.
+  - search() refreshes at most every REFRESH_SECONDS; writers in this
+    process call mark_stale() so their own changes show up immediately.
+  - A full reload every FULL_RELOAD_SECONDS picks up hard deletes.
+If the index cannot load (e.g. the change_version migration has not run),
+search() returns None and the caller falls back to the SQL search.
+
+Results are memoized in a small LRU keyed by the normalized query. The cache
+is tied to the index generation: any row that actually changes on refresh (or
+mark_stale() after a local write) empties it, so a hit is always what a
+search of the synced index would return.
+"""
+import os
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from db_utils import get_db_connection
+from roster_sync import commit_watermark
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = float(os.getenv('ROSTER_REFRESH_SECONDS', '2'))
+FULL_RELOAD_SECONDS = 600
+RESULT_LIMIT = 50
+CACHE_SIZE = int(os.getenv('ROSTER_CACHE_SIZE', '256'))
+CACHE_MAX_ROWS = 500        # Larger results (show_all on a big roster) are not cached
+
+FIELDS = "id, full_name, nickname, classroom, grade, total_points, phone, email, active, change_version"
+
+_lock = threading.RLock()
+_students = {}        # id -> row dict (same keys as student_search.find_students)
+_haystacks = {}       # id -> tuple of normalized searchable strings
+_grams = {}           # trigram -> set of ids
+_order = []           # ids sorted by name (rebuilt lazily)
+_order_dirty = True
+_version = 0          # highest change_version seen
+_xmin = 0             # commit-safe watermark: changes from transactions below it are loaded
+_generation = 0       # bumped whenever a refresh changes the index
+_loaded_at = 0.0
+_checked_at = 0.0
+_cache = OrderedDict()  # (terms, include_inactive, show_all, limit, min_points) -> results
+_cache_generation = None
+_cache_hits = 0
+_cache_misses = 0
+
+
+def normalize(text):
+    """Lowercase and strip accents ('José' -> 'jose')."""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _index(row):
+    sid = row['id']
+    _unindex(sid)
+    hay = (normalize(row['full_name']), normalize(row['nickname']), str(sid))
+    _students[sid] = row
+    _haystacks[sid] = hay
+    for field in hay:
+        for g in _trigrams(field):
+            _grams.setdefault(g, set()).add(sid)
+
+
+def _unindex(sid):
+    hay = _haystacks.pop(sid, None)
+    _students.pop(sid, None)
+    if hay:
+        for field in hay:
+            for g in _trigrams(field):
+                ids = _grams.get(g)
+                if ids:
+                    ids.discard(sid)
+                    if not ids:
+                        del _grams[g]
+
+
+def _row_dict(row):
+    keys = [c.strip() for c in FIELDS.split(',')]
+    if isinstance(row, dict):
+        return {k: row[k] for k in keys}
+    return dict(zip(keys, row))
+
+
+def _fetch(since_xid=None):
+    """Rows changed by transactions at or above since_xid (all rows if None), plus the new watermark."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        # Taken before reading, so every transaction below it is visible to the read
+        xmin = commit_watermark(cur)
+        if since_xid is None:
+            cur.execute(f"SELECT {FIELDS} FROM students")
+        else:
+            cur.execute(f"SELECT {FIELDS} FROM students WHERE change_xid >= %s ORDER BY change_version", (since_xid,))
+        return [_row_dict(r) for r in cur.fetchall()], xmin
+    finally:
+        conn.close()
+
+
+def _full_load():
+    global _version, _xmin, _generation, _loaded_at, _checked_at, _order_dirty
+    rows, xmin = _fetch()
+    with _lock:
+        _students.clear()
+        _haystacks.clear()
+        _grams.clear()
+        for row in rows:
+            _index(row)
+        _version = max((r['change_version'] or 0 for r in rows), default=0)
+        _xmin = xmin
+        _generation += 1
+        _loaded_at = _checked_at = time.monotonic()
+        _order_dirty = True
+    logger.info(f"Roster index loaded: {len(rows)} students (version {_version})")
+
+
+def _incremental():
+    global _version, _xmin, _generation, _checked_at, _order_dirty
+    rows, xmin = _fetch(since_xid=_xmin)
+    with _lock:
+        changed = False
+        for row in rows:
+            current = _students.get(row['id'])
+            if current is not None and current['change_version'] == row['change_version']:
+                continue  # Re-read inside the overlap window, already indexed
+            _index(row)
+            _version = max(_version, row['change_version'] or 0)
+            changed = True
+        _xmin = xmin
+        _checked_at = time.monotonic()
+        if changed:
+            _generation += 1
+            _order_dirty = True
+
+
+def refresh(force=False):
+    """Brings the index up to date. Returns False if it could not be loaded."""
+    now = time.monotonic()
+    try:
+        if not _loaded_at or now - _loaded_at > FULL_RELOAD_SECONDS:
+            _full_load()
+        elif force or now - _checked_at >= REFRESH_SECONDS:
+            _incremental()
+        return True
+    except Exception as e:
+        logger.warning(f"Roster index refresh failed: {e}")
+        return bool(_loaded_at)
+
+
+def mark_stale():
+    """Called after this process writes to students, so the next search re-syncs."""
+    global _checked_at, _cache_generation
+    with _lock:
+        _checked_at = 0.0
+        _cache.clear()
+        _cache_generation = None
+
+
+def cache_stats():
+    return {"entries": len(_cache), "hits": _cache_hits, "misses": _cache_misses,
+            "version": _version, "generation": _cache_generation}
+
+
+def version():
+    return _version
+
+
+def _sorted_ids():
+    global _order, _order_dirty
+    if _order_dirty:
+        _order = sorted(_students, key=lambda sid: (_haystacks[sid][0], sid))
+        _order_dirty = False
+    return _order
+
+
+def _matches(hay, tokens):
+    """SQL-equivalent of ILIKE '%tok1%tok2%': tokens appear in order within one field."""
+    for field in hay:
+        pos = 0
+        for tok in tokens:
+            pos = field.find(tok, pos)
+            if pos < 0:
+                break
+            pos += len(tok)
+        else:
+            return True
+    return False
+
+
+def search(term='', include_inactive=False, show_all=False, limit=RESULT_LIMIT, min_points=None):
+    """
+    Same contract as student_search.find_students (list of row dicts ordered
+    by name, max 50 unless show_all). Returns None if the index is unavailable.
+    """
+    global _cache_generation, _cache_hits, _cache_misses
+    with _lock:
+        if not refresh():
+            return None
+
+        tokens = [t for t in normalize(term).split() if t] if not show_all else []
+
+        if _cache_generation != _generation:
+            _cache.clear()
+            _cache_generation = _generation
+        key = (' '.join(tokens), include_inactive, show_all, limit, min_points)
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _cache_hits += 1
+            return list(cached)
+        _cache_misses += 1
+
+        results = _search(tokens, include_inactive, show_all, limit, min_points)
+        if len(results) <= CACHE_MAX_ROWS:
+            _cache[key] = results
+            if len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        return list(results)
+
+
+def _search(tokens, include_inactive, show_all, limit, min_points):
+    """Uncached lookup; caller holds _lock."""
+    candidates = None
+    long_tokens = [t for t in tokens if len(t) >= 3]
+    if long_tokens:
+        for tok in long_tokens:
+            for g in _trigrams(tok):
+                ids = _grams.get(g)
+                if not ids:
+                    return []
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+    results = []
+    for sid in _sorted_ids():
+        if candidates is not None and sid not in candidates:
+            continue
+        row = _students[sid]
+        if not include_inactive and not row['active']:
+            continue
+        if min_points is not None and (row['total_points'] or 0) < min_points:
+            continue
+        if tokens and not _matches(_haystacks[sid], tokens):
+            continue
+        results.append({k: v for k, v in row.items() if k != 'change_version'})
+        if not show_all and len(results) >= limit:
+            break
+    return results
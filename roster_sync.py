@@ -0,0 +1,98 @@
+"""
+roster_sync.py - Delta sync of the roster and catalogs for classroom tablets
+Students, activities and prizes are stamped by triggers on every INSERT/UPDATE
+(db_utils sections 12 and 18) with change_version (one shared sequence, used
+to page through a delta) and change_xid (the writing transaction). Hard
+deletes leave a row in sync_tombstones. A tablet keeps its own copy and asks
+for everything after the watermark it got last time:
+
+    GET /api/sync/roster?since=<version>
+
+The watermark is a transaction id, not a change_version: change_version is
+drawn when a row is written, not when it commits, so a slow transaction can
+commit a lower version after a higher one has been served. Instead, each sync
+returns the oldest transaction still running when it read (snapshot xmin).
+Every transaction below it had finished, so its rows were visible to that
+read; anything at or above it is sent again next time. Re-sent rows are
+upserts on the tablet, so the overlap is harmless and only lasts while a
+transaction that started before the sync is still open.
+
+Large deltas (or since=0, the first download) come back in pages of
+PAGE_LIMIT rows per table; the caller passes the returned page back until
+has_more is false, then keeps version for the next sync.
+"""
+import logging
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+PAGE_LIMIT = 2000
+
+# Columns a tablet needs (no parent contact details leave the server)
+TABLES = {
+    'students': ("students",
+                 "id, full_name, nickname, grade, classroom, total_points, active, badge_code, change_version"),
+    'activities': ("activities",
+                   "id, name, description, default_points, active, change_version"),
+    'prizes': ("prize_inventory",
+               "id, name, description, point_cost, stock_count, active, change_version"),
+    'deleted': ("sync_tombstones",
+                "entity, entity_id AS id, change_version"),
+}
+
+
+def commit_watermark(cur):
+    """Oldest transaction still in progress: every change stamped below it is committed (or rolled back)."""
+    cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin")
+    row = cur.fetchone()
+    return row['xmin'] if isinstance(row, dict) else row[0]
+
+
+def changes(since=0, page=None, limit=PAGE_LIMIT):
+    """
+    Everything changed at or after the watermark `since`:
+        {'version', 'has_more', 'page', 'students', 'activities', 'prizes', 'deleted'}
+    deleted is a list of {'entity', 'id'}.
+    page is None on the first call of a sync. While has_more is true, pass the
+    returned page back (same since) for the rest; version is the watermark to
+    keep once the last page is in.
+    Returns None if the database is unavailable.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        # Taken before reading, so every transaction below it is visible to the reads
+        if page is None:
+            page = {'xmin': commit_watermark(cur), 'after': {}}
+
+        result = {}
+        after = {}
+        has_more = False
+        for key, (table, fields) in TABLES.items():
+            last = int(page['after'].get(key, 0))
+            cur.execute(f"""
+                SELECT {fields} FROM {table}
+                WHERE change_xid >= %s AND change_version > %s
+                ORDER BY change_version
+                LIMIT %s
+            """, (since, last, limit))
+            rows = cur.fetchall()
+            if len(rows) == limit:
+                has_more = True
+            after[key] = rows[-1]['change_version'] if rows else last
+            result[key] = [{k: v for k, v in r.items() if k != 'change_version'} if key == 'deleted' else r
+                           for r in rows]
+
+        result['version'] = page['xmin']
+        result['has_more'] = has_more
+        result['page'] = {'xmin': page['xmin'], 'after': after} if has_more else None
+        return result
+
+    except Exception as e:
+        logger.error(f"Roster sync query failed (since={since}): {e}")
+        return None
+    finally:
+        conn.close()
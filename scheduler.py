@@ -0,0 +1,333 @@
+"""
+scheduler.py - In-app job scheduler
+Replaces the external cron pings for periodic work. Every gunicorn worker
+starts the loop, but only the holder of the DB lease (scheduler_lease) runs
+jobs, so each job fires once across all workers and instances.
+
+Each run is claimed in scheduler_runs before it starts; the claim doubles as
+the "last ran at" record, so restarts and the legacy /api/cron/daily_report
+route never cause a second run. A run that fails is retried after
+RETRY_SECONDS, up to MAX_FAILURES times per period. A job runs in its own thread while the
+scheduler keeps renewing the lease, so a long job (the 02:30 audit archive)
+cannot let the lease lapse and hand the schedule to another process.
+
+Jobs:
+    daily_report          once a day, not before DAILY_REPORT_TIME (server local time, default 07:00)
+    whatsapp_probe        re-probe the WhatsApp session every WHATSAPP_STATUS_INTERVAL seconds
+    alert_delivery_rollup roll alert_delivery rows older than ALERT_DELIVERY_RETENTION_DAYS into daily totals
+    audit_archive         move audit_log rows older than AUDIT_RETENTION_DAYS to audit_log_archive
+    idempotency_prune     hourly, drop stored Idempotency-Key responses older than IDEMPOTENCY_TTL_HOURS
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'scheduler'
+LEASE_SECONDS = 120            # Renewed every TICK_SECONDS while a job runs, so jobs may take longer
+TICK_SECONDS = 30
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+DAILY_REPORT_TIME = os.getenv('DAILY_REPORT_TIME', '07:00')
+ALERT_DELIVERY_RETENTION_DAYS = int(os.getenv('ALERT_DELIVERY_RETENTION_DAYS', '30'))
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = 10000
+RETRY_SECONDS = 600            # A failed run is claimable again after this long...
+MAX_FAILURES = 3               # ...until it has failed this many times in the same period
+
+_started = False
+
+
+# --- JOB BODIES ---
+
+def _run_daily_report():
+    import daily_report
+    daily_report.run(recorded_by="system_scheduler")
+
+
+def _run_whatsapp_probe():
+    import whatsapp_status
+    whatsapp_status.probe_if_stale()
+
+
+def _run_alert_delivery_rollup():
+    """Whole days older than the retention window become one row per provider/channel."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cutoff = (datetime.now() - timedelta(days=ALERT_DELIVERY_RETENTION_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+        cur.execute("""
+            INSERT INTO alert_delivery_daily (day, provider, channel, total, sent, failed, skipped, avg_attempts, p95_ms)
+            SELECT created_at::DATE, provider, channel,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE status = 'sent'),
+                   COUNT(*) FILTER (WHERE status = 'failed'),
+                   COUNT(*) FILTER (WHERE status = 'skipped'),
+                   ROUND(AVG(attempts), 2),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)
+            FROM alert_delivery
+            WHERE created_at < %s
+            GROUP BY 1, provider, channel
+            ON CONFLICT (day, provider, channel) DO NOTHING
+        """, (cutoff,))
+        cur.execute("DELETE FROM alert_delivery WHERE created_at < %s", (cutoff,))
+        removed = cur.rowcount
+        conn.commit()
+        if removed:
+            logger.info(f"Rolled up {removed} alert_delivery rows older than {cutoff.date()}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _run_audit_archive():
+    """Moves old audit rows in id-ordered batches (short transactions, no long locks)."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cutoff = datetime.now() - timedelta(days=AUDIT_RETENTION_DAYS)
+        moved = 0
+        while True:
+            cur.execute("""
+                WITH moved AS (
+                    DELETE FROM audit_log
+                    WHERE id IN (
+                        SELECT id FROM audit_log WHERE event_time < %s ORDER BY id LIMIT %s
+                    )
+                    RETURNING *
+                )
+                INSERT INTO audit_log_archive SELECT * FROM moved
+            """, (cutoff, ARCHIVE_BATCH_SIZE))
+            batch = cur.rowcount
+            conn.commit()
+            moved += batch
+            if batch < ARCHIVE_BATCH_SIZE:
+                break
+
+        # Finished QR linking jobs are only useful while the setup page polls them
+        cur.execute("DELETE FROM whatsapp_link_jobs WHERE updated_at < CURRENT_TIMESTAMP - INTERVAL '7 days'")
+        conn.commit()
+        if moved:
+            logger.info(f"Archived {moved} audit_log rows older than {cutoff.date()}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _run_idempotency_prune():
+    import idempotency
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        removed = idempotency.prune(conn.cursor())
+        conn.commit()
+        if removed:
+            logger.info(f"Pruned {removed} expired idempotency keys")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _whatsapp_probe_interval():
+    import whatsapp_status
+    return whatsapp_status.MONITOR_INTERVAL_SECONDS
+
+
+# name -> (body, schedule). schedule is ('daily', 'HH:MM') or ('every', seconds or callable)
+JOBS = {
+    'daily_report': (_run_daily_report, ('daily', DAILY_REPORT_TIME)),
+    'whatsapp_probe': (_run_whatsapp_probe, ('every', _whatsapp_probe_interval)),
+    'alert_delivery_rollup': (_run_alert_delivery_rollup, ('daily', '02:00')),
+    'audit_archive': (_run_audit_archive, ('daily', '02:30')),
+    'idempotency_prune': (_run_idempotency_prune, ('every', 3600)),
+}
+
+
+# --- LEASE & CLAIMS ---
+
+def _acquire_lease():
+    """Takes or renews the scheduler lease. Returns True if this process holds it."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cur = conn.cursor()
+        now = datetime.now()
+        cur.execute("""
+            INSERT INTO scheduler_lease (name, holder, expires_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+            WHERE scheduler_lease.holder = EXCLUDED.holder OR scheduler_lease.expires_at < %s
+            RETURNING holder
+        """, (LEASE_NAME, HOLDER_ID, now + timedelta(seconds=LEASE_SECONDS), now))
+        held = cur.fetchone() is not None
+        conn.commit()
+        return held
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Scheduler lease check failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def claim(job_name, not_run_since, status='running'):
+    """
+    Atomically records a run of job_name now if its last run is older than
+    `not_run_since`, or if that run failed (see RETRY_SECONDS / MAX_FAILURES).
+    Returns False if it already ran (or another process won). Callers that
+    run the work themselves report the outcome with finish().
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cur = conn.cursor()
+        now = datetime.now()
+        cur.execute("""
+            INSERT INTO scheduler_runs (job_name, last_run_at, last_status)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (job_name) DO UPDATE
+                SET last_run_at = EXCLUDED.last_run_at, last_status = EXCLUDED.last_status, last_error = NULL,
+                    failures = CASE WHEN scheduler_runs.last_run_at < %s THEN 0 ELSE scheduler_runs.failures END
+            WHERE scheduler_runs.last_run_at IS NULL OR scheduler_runs.last_run_at < %s
+               OR (scheduler_runs.last_status = 'failed' AND scheduler_runs.failures < %s
+                   AND scheduler_runs.last_run_at < %s)
+            RETURNING job_name
+        """, (job_name, now, status, not_run_since, not_run_since,
+              MAX_FAILURES, now - timedelta(seconds=RETRY_SECONDS)))
+        claimed = cur.fetchone() is not None
+        conn.commit()
+        return claimed
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not claim job {job_name}: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def finish(job_name, status, error=None, duration_ms=None):
+    """Records the outcome of a claimed run ('ok' or 'failed'; failed runs count toward MAX_FAILURES)."""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE scheduler_runs
+            SET last_status = %s, last_error = %s, last_duration_ms = %s,
+                failures = CASE WHEN %s = 'failed' THEN failures + 1 ELSE 0 END
+            WHERE job_name = %s
+        """, (status, error, duration_ms, status, job_name))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not record job result for {job_name}: {e}")
+    finally:
+        conn.close()
+
+
+def start_of_today():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _due_since(schedule, now):
+    """Returns the 'not run since' threshold if the job is due now, else None."""
+    kind, value = schedule
+    if kind == 'daily':
+        hour, minute = (int(p) for p in value.split(':'))
+        if (now.hour, now.minute) < (hour, minute):
+            return None
+        return start_of_today()
+    interval = value() if callable(value) else value
+    if not interval or interval <= 0:
+        return None
+    return now - timedelta(seconds=interval)
+
+
+def _execute(job_name):
+    body = JOBS[job_name][0]
+    started = time.perf_counter()
+    try:
+        body()
+        finish(job_name, 'ok', None, int((time.perf_counter() - started) * 1000))
+    except Exception as e:
+        logger.exception(f"Scheduled job {job_name} failed: {e}")
+        finish(job_name, 'failed', str(e), int((time.perf_counter() - started) * 1000))
+
+
+# --- PUBLIC ---
+
+def trigger(job_name):
+    """
+    Runs a daily job in the background unless it already ran today (a failed
+    run can be retried, see claim). Used by the legacy cron route so cron and
+    scheduler never both send.
+    Returns True if this call started it.
+    """
+    if not claim(job_name, start_of_today()):
+        return False
+    threading.Thread(target=_execute, args=(job_name,), name=f"job-{job_name}", daemon=True).start()
+    return True
+
+
+def _execute_holding_lease(job_name):
+    """Runs a job to completion in its own thread, renewing the lease every TICK_SECONDS meanwhile."""
+    worker = threading.Thread(target=_execute, args=(job_name,), name=f"job-{job_name}", daemon=True)
+    worker.start()
+    while True:
+        worker.join(TICK_SECONDS)
+        if not worker.is_alive():
+            return
+        if not _acquire_lease():
+            logger.warning(f"Scheduler lease lost while {job_name} is still running")
+
+
+def tick():
+    """One scheduler pass: runs every due job, one after another, if this process holds the lease."""
+    if not _acquire_lease():
+        return
+    for job_name, (_, schedule) in JOBS.items():
+        now = datetime.now()
+        since = _due_since(schedule, now)
+        if since is not None and claim(job_name, since):
+            _execute_holding_lease(job_name)
+            if not _acquire_lease():  # Renew between jobs
+                return
+
+
+def start(initial_delay=60):
+    """Starts the scheduler loop once per process (daemon thread)."""
+    global _started
+    if _started:
+        return
+    _started = True
+
+    def _loop():
+        time.sleep(initial_delay)
+        while True:
+            try:
+                tick()
+            except Exception as e:
+                logger.warning(f"Scheduler tick failed: {e}")
+            time.sleep(TICK_SECONDS)
+
+    threading.Thread(target=_loop, name="scheduler", daemon=True).start()
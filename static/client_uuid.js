@@ -0,0 +1,13 @@
+/**
+ * client_uuid.js - Random UUIDs for Idempotency-Key headers and offline award ids.
+ * Has no side effects, so any page can include it (offline_queue.js needs it too).
+ */
+function newClientUuid() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    // Fallback for plain-HTTP pages where randomUUID is unavailable
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
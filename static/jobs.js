@@ -0,0 +1,48 @@
+/**
+ * jobs.js - Runs a background job (see job_queue.py) and downloads its result.
+ * Usage: runJob('students_csv', {}, buttonElement)
+ * The button shows progress while the job runs and is restored afterwards.
+ */
+async function runJob(type, params, button) {
+    const originalText = button ? button.innerHTML : null;
+    const setLabel = (text) => { if (button) button.innerHTML = text; };
+
+    if (button) {
+        button.disabled = true;
+        button.style.pointerEvents = 'none';
+    }
+    setLabel('⏳ 0%');
+
+    try {
+        const response = await fetch('/api/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ type: type, params: params || {} })
+        });
+        const data = await response.json();
+        if (!data.success) throw new Error(data.message || 'Could not start job');
+
+        let job = data.job;
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            const poll = await fetch(`/api/jobs/${job.id}`);
+            const pollData = await poll.json();
+            if (!pollData.success) throw new Error(pollData.message || 'Job lost');
+            job = pollData.job;
+            setLabel(job.status === 'queued' ? '⏳ …' : `⏳ ${job.progress || 0}%`);
+        }
+
+        if (job.status === 'failed') throw new Error(job.error || 'Job failed');
+        if (job.download_url) window.location.href = job.download_url;
+        return job;
+    } catch (err) {
+        alert('Error: ' + err.message);
+        return null;
+    } finally {
+        if (button) {
+            button.disabled = false;
+            button.style.pointerEvents = '';
+            button.innerHTML = originalText;
+        }
+    }
+}
@@ -0,0 +1,70 @@
+/**
+ * offline_queue.js - Keeps point awards made while offline and uploads them later.
+ * Requires client_uuid.js (newClientUuid), loaded first.
+ * Usage: queueAward(payload, idempotencyKey) when /api/transaction/record cannot be reached.
+ * Each award gets a client_uuid when queued, so re-sending the queue after a
+ * dropped upload never double-awards (see /api/transaction/batch).
+ * The queue lives in localStorage and is flushed on load, when the browser
+ * comes back online, and every FLUSH_INTERVAL_MS.
+ */
+const OFFLINE_QUEUE_KEY = 'offlineAwardQueue';
+const OFFLINE_BATCH_SIZE = 200;
+const FLUSH_INTERVAL_MS = 30000;
+let offlineFlushing = false;
+
+function loadOfflineQueue() {
+    try {
+        return JSON.parse(localStorage.getItem(OFFLINE_QUEUE_KEY)) || [];
+    } catch (e) {
+        return [];
+    }
+}
+
+function saveOfflineQueue(queue) {
+    localStorage.setItem(OFFLINE_QUEUE_KEY, JSON.stringify(queue));
+    document.dispatchEvent(new CustomEvent('offlinequeuechange', { detail: { pending: queue.length } }));
+}
+
+// Pass the Idempotency-Key already sent for this award so a request that did reach the server is not applied twice
+function queueAward(payload, clientUuid) {
+    const queue = loadOfflineQueue();
+    queue.push(Object.assign({}, payload, { client_uuid: clientUuid || newClientUuid(), recorded_at: new Date().toISOString() }));
+    saveOfflineQueue(queue);
+    return queue.length;
+}
+
+// Uploads the queue in batches; items the server has settled (applied, duplicate, rejected) are removed.
+async function flushOfflineQueue() {
+    if (offlineFlushing || !navigator.onLine) return;
+    offlineFlushing = true;
+    try {
+        let queue = loadOfflineQueue();
+        while (queue.length) {
+            const batch = queue.slice(0, OFFLINE_BATCH_SIZE);
+            const res = await fetch('/api/transaction/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: batch })
+            });
+            if (!res.ok) break;
+            const data = await res.json();
+            if (!data.success) break;
+
+            const settled = new Set(data.results.map(r => r.client_uuid));
+            data.results.filter(r => r.status !== 'applied' && r.status !== 'duplicate')
+                .forEach(r => console.warn('Offline award rejected', r));
+            // Re-read: awards may have been queued while the upload was in flight
+            queue = loadOfflineQueue().filter(item => !settled.has(item.client_uuid));
+            saveOfflineQueue(queue);
+            if (!batch.every(item => settled.has(item.client_uuid))) break;
+        }
+    } catch (err) {
+        // Still offline; the next trigger retries
+    } finally {
+        offlineFlushing = false;
+    }
+}
+
+window.addEventListener('online', flushOfflineQueue);
+document.addEventListener('DOMContentLoaded', flushOfflineQueue);
+setInterval(flushOfflineQueue, FLUSH_INTERVAL_MS);
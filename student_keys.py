@@ -0,0 +1,261 @@
+"""
+student_keys.py - Duplicate-detection keys for students
+Every student gets a handful of precomputed "blocking" keys in
+student_match_keys (indexed), so a duplicate check is one indexed lookup
+for candidates followed by similarity scoring of that short list.
+
+Keys:
+    pair   sorted phonetic codes of two name tokens ("JS PRS" for José Pérez)
+    name   phonetic code of a single-token name
+    phone  last 10 digits of the phone number
+    email  lowercased address without +tag
+
+Phonetic codes are Spanish-aware: accents are folded and letters that sound
+alike map to one code (z/c/s, v/b, ll/y, g/j before e/i, x/j, silent h),
+so "Jose Luis Perez" and "José L. Pérez" share keys.
+
+db_utils.init_db() backfills the keys when the table is empty
+(`python student_keys.py` rebuilds them by hand).
+"""
+import re
+import logging
+from functools import lru_cache
+from difflib import SequenceMatcher
+from psycopg2.extras import execute_values
+from db_utils import get_db_connection
+from roster_index import normalize
+
+logger = logging.getLogger(__name__)
+
+MATCH_THRESHOLD = 0.8      # Shown as a possible duplicate
+BLOCK_THRESHOLD = 0.97     # Same name once accents/spelling are folded: refuse to create
+CANDIDATE_LIMIT = 200
+
+_PHONETIC_RULES = (
+    (re.compile(r'ch'), '1'),            # 'ch' sound, emitted as X
+    (re.compile(r'll'), 'y'),
+    (re.compile(r'qu(?=[ei])'), 'k'),
+    (re.compile(r'g(?=[ei])'), 'j'),
+    (re.compile(r'gu(?=[ei])'), 'g'),
+    (re.compile(r'c(?=[ei])'), 's'),
+    (re.compile(r'x'), 'j'),             # Ximena / Jimena, Xavier / Javier
+    (re.compile(r'h'), ''),
+    (re.compile(r'y(?![aeiou])'), 'i'),  # 'y' is a vowel unless one follows
+)
+_LETTER_MAP = str.maketrans({'z': 's', 'c': 'k', 'q': 'k', 'v': 'b', 'w': 'u', '1': 'X'})
+_VOWELS = set('aeiou')
+
+
+def tokens(name):
+    """'José L. Pérez' -> ['jose', 'l', 'perez']"""
+    return re.findall(r'[a-z0-9]+', normalize(name))
+
+
+@lru_cache(maxsize=65536)
+def phonetic(word):
+    """Spanish phonetic code: leading vowel as 'A', then consonant sounds ('perez' -> 'PRS')."""
+    w = ''.join(c for c in normalize(word) if c.isalpha())
+    if not w:
+        return ''
+    for pattern, repl in _PHONETIC_RULES:
+        w = pattern.sub(repl, w)
+    if not w:
+        return ''
+    w = w.translate(_LETTER_MAP)
+    code = ['A' if w[0] in _VOWELS else w[0].upper()]
+    for c in w[1:]:
+        if c in _VOWELS:
+            continue
+        c = c.upper()
+        if c != code[-1]:
+            code.append(c)
+    return ''.join(code)
+
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    if '@' not in email:
+        return None
+    local, domain = email.rsplit('@', 1)
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def match_keys(full_name, phone=None, email=None):
+    """Set of (key_type, key_value) for a student."""
+    keys = set()
+    codes = [phonetic(t) for t in tokens(full_name) if len(t) >= 2]
+    codes = [c for c in codes if c]
+    if len(codes) == 1:
+        keys.add(('name', codes[0]))
+    for i in range(len(codes)):
+        for j in range(i + 1, len(codes)):
+            if codes[i] != codes[j]:
+                keys.add(('pair', ' '.join(sorted((codes[i], codes[j])))))
+    p = normalize_phone(phone)
+    if p:
+        keys.add(('phone', p))
+    e = normalize_email(email)
+    if e:
+        keys.add(('email', e))
+    return keys
+
+
+@lru_cache(maxsize=262144)
+def _token_score(a, b):
+    if a == b:
+        return 1.0
+    if (len(a) == 1 and b.startswith(a)) or (len(b) == 1 and a.startswith(b)):
+        return 0.85                       # Initial: 'l' vs 'luis'
+    if len(a) > 1 and len(b) > 1 and phonetic(a) == phonetic(b):
+        return 0.9                        # 'gonzalez' vs 'gonsales'
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def name_score(a, b):
+    """Similarity of two names in [0, 1], tolerant of accents, initials and spelling."""
+    return tokens_score(tokens(a), tokens(b))
+
+
+def tokens_score(ta, tb):
+    """name_score on already tokenized names (batch callers cache the tokens)."""
+    if not ta or not tb:
+        return 0.0
+    short, long_ = (ta, tb) if len(ta) <= len(tb) else (tb, ta)
+    best = [max(_token_score(s, l) for l in long_) for s in short]
+    score = sum(best) / len(best)
+    score *= 0.85 + 0.15 * len(short) / len(long_)
+    # Siblings share surnames: a different first name is never a duplicate
+    if _token_score(ta[0], tb[0]) < 0.8 and _token_score(ta[0], tb[-1]) < 0.8:
+        score = min(score, 0.6)
+    return round(score, 2)
+
+
+def save_keys(cur, student_id, full_name, phone=None, email=None):
+    """Replaces a student's keys (call inside the same transaction as the write)."""
+    cur.execute("DELETE FROM student_match_keys WHERE student_id = %s", (student_id,))
+    rows = [(student_id, k, v) for k, v in match_keys(full_name, phone, email)]
+    if rows:
+        execute_values(cur, """
+            INSERT INTO student_match_keys (student_id, key_type, key_value) VALUES %s
+            ON CONFLICT DO NOTHING
+        """, rows)
+
+
+def refresh_student(cur, student_id):
+    """Recomputes keys from the stored row (after an UPDATE of name/phone/email)."""
+    cur.execute("SELECT full_name, phone, email FROM students WHERE id = %s", (student_id,))
+    row = cur.fetchone()
+    if row:
+        is_dict = isinstance(row, dict)
+        save_keys(cur, student_id,
+                  row['full_name'] if is_dict else row[0],
+                  row['phone'] if is_dict else row[1],
+                  row['email'] if is_dict else row[2])
+
+
+def find_matches(cur, full_name, phone=None, email=None, exclude_id=None, threshold=MATCH_THRESHOLD):
+    """
+    Students that look like the given one, best first. Each match carries a
+    'score' (name similarity) and 'reasons' (name / phone / email).
+    Students that have no keys yet (not backfilled, or written by a bulk
+    import) are still caught by the exact name / phone / email check.
+    """
+    keys = match_keys(full_name, phone, email)
+    if not keys:
+        return []
+
+    cur.execute("""
+        SELECT s.id, s.full_name, s.nickname, s.classroom, s.grade, s.phone, s.email, s.active,
+               ARRAY_AGG(DISTINCT k.key_type) AS matched
+        FROM student_match_keys k
+        JOIN students s ON s.id = k.student_id
+        WHERE (k.key_type, k.key_value) IN %s
+          AND (%s::INTEGER IS NULL OR s.id <> %s)
+        GROUP BY s.id
+        LIMIT %s
+    """, (tuple(keys), exclude_id, exclude_id, CANDIDATE_LIMIT))
+    candidates = {row['id']: row for row in cur.fetchall()}
+
+    phone, email = (phone or '').strip(), (email or '').strip()
+    cur.execute("""
+        SELECT s.id, s.full_name, s.nickname, s.classroom, s.grade, s.phone, s.email, s.active,
+               ARRAY_REMOVE(ARRAY[
+                   CASE WHEN LENGTH(%s) > 0 AND s.phone = %s THEN 'phone' END,
+                   CASE WHEN LENGTH(%s) > 0 AND s.email = %s THEN 'email' END
+               ], NULL) AS matched
+        FROM students s
+        WHERE (LOWER(s.full_name) = LOWER(%s)
+               OR (LENGTH(%s) > 0 AND s.phone = %s)
+               OR (LENGTH(%s) > 0 AND s.email = %s))
+          AND NOT EXISTS (SELECT 1 FROM student_match_keys k WHERE k.student_id = s.id)
+          AND (%s::INTEGER IS NULL OR s.id <> %s)
+        LIMIT %s
+    """, (phone, phone, email, email, full_name.strip(), phone, phone, email, email,
+          exclude_id, exclude_id, CANDIDATE_LIMIT))
+    for row in cur.fetchall():
+        candidates.setdefault(row['id'], row)
+
+    matches = []
+    for row in candidates.values():
+        student = dict(row)
+        matched = student.pop('matched') or []
+        score = name_score(full_name, student['full_name'])
+        reasons = [r for r in ('phone', 'email') if r in matched]
+        if score >= threshold:
+            reasons.insert(0, 'name')
+        if reasons:
+            student['score'] = score
+            student['reasons'] = reasons
+            matches.append(student)
+
+    matches.sort(key=lambda m: (-m['score'], -len(m['reasons']), m['full_name']))
+    return matches
+
+
+def check_duplicates(full_name, phone=None, email=None, exclude_id=None):
+    """find_matches over its own connection (for the add-student form)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    try:
+        return find_matches(conn.cursor(), full_name, phone, email, exclude_id)
+    finally:
+        conn.close()
+
+
+def rebuild_all(page_size=5000):
+    """Recomputes every student's keys (backfill after the migration)."""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, full_name, phone, email FROM students WHERE merged_into IS NULL")
+        rows = []
+        for s in cur.fetchall():
+            is_dict = isinstance(s, dict)
+            sid = s['id'] if is_dict else s[0]
+            keys = match_keys(*((s['full_name'], s['phone'], s['email']) if is_dict else s[1:4]))
+            rows.extend((sid, k, v) for k, v in keys)
+
+        cur.execute("TRUNCATE student_match_keys")
+        execute_values(cur, "INSERT INTO student_match_keys (student_id, key_type, key_value) VALUES %s ON CONFLICT DO NOTHING",
+                       rows, page_size=page_size)
+        conn.commit()
+        logger.info(f"Rebuilt {len(rows)} student match keys")
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f"Rebuilt {rebuild_all()} keys")
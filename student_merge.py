@@ -0,0 +1,113 @@
+"""
+student_merge.py - Merge a duplicate student into the surviving record
+Everything happens in ONE transaction with set-based statements, so the
+cost does not grow with per-row round trips no matter how much history
+the duplicate has:
+  1. lock both students (lower id first, so concurrent merges cannot deadlock)
+  2. re-point all of the loser's activity_log rows in a single UPDATE
+  3. recompute the winner's balance from the ledger
+  4. deactivate the loser (merged_into / merged_at / merge_justification)
+     and close its other open duplicate pairs
+  5. write a single audit record
+Awards lock the student row too (transaction_manager.add_points), so none
+can land on the loser once the merge commits.
+"""
+import logging
+from db_utils import get_db_connection
+import roster_index
+import student_keys
+
+logger = logging.getLogger(__name__)
+
+
+class MergeError(Exception):
+    """Merge refused (bad ids, already merged, ...). The message is user-facing."""
+
+
+def merge_students(winner_id, loser_id, justification, recorded_by):
+    """Merges loser_id into winner_id. Returns {'moved': rows, 'total_points': new balance}."""
+    if winner_id == loser_id:
+        raise MergeError("Cannot merge a student into itself.")
+    if not (justification or '').strip():
+        raise MergeError("A justification is required.")
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection failed")
+    try:
+        cur = conn.cursor()
+
+        # 1. Lock both rows
+        cur.execute("""
+            SELECT id, full_name, active, merged_into FROM students
+            WHERE id IN (%s, %s) ORDER BY id FOR UPDATE
+        """, (winner_id, loser_id))
+        rows = {r['id']: r for r in cur.fetchall()}
+        if winner_id not in rows or loser_id not in rows:
+            raise MergeError("Student not found.")
+        if rows[loser_id]['merged_into']:
+            raise MergeError(f"{rows[loser_id]['full_name']} was already merged into #{rows[loser_id]['merged_into']}.")
+        if rows[winner_id]['merged_into']:
+            raise MergeError(f"{rows[winner_id]['full_name']} was merged into #{rows[winner_id]['merged_into']}; merge into that record instead.")
+        if not rows[winner_id]['active']:
+            raise MergeError(f"{rows[winner_id]['full_name']} is inactive; reactivate them before merging into that record.")
+
+        # 2. Move the history
+        cur.execute("UPDATE activity_log SET student_id = %s WHERE student_id = %s", (winner_id, loser_id))
+        moved = cur.rowcount
+
+        # 3. Balance = ledger; contact details the winner lacks come from the loser
+        cur.execute("""
+            UPDATE students w
+            SET total_points = (SELECT COALESCE(SUM(points), 0) FROM activity_log WHERE student_id = w.id),
+                nickname = COALESCE(NULLIF(w.nickname, ''), l.nickname),
+                parent_name = COALESCE(NULLIF(w.parent_name, ''), l.parent_name),
+                phone = COALESCE(NULLIF(w.phone, ''), l.phone),
+                email = COALESCE(NULLIF(w.email, ''), l.email)
+            FROM students l
+            WHERE w.id = %s AND l.id = %s
+            RETURNING w.total_points
+        """, (winner_id, loser_id))
+        total_points = cur.fetchone()['total_points']
+
+        # 4. Retire the loser
+        cur.execute("""
+            UPDATE students
+            SET active = FALSE, total_points = 0, merged_into = %s,
+                merged_at = CURRENT_TIMESTAMP, merge_justification = %s
+            WHERE id = %s
+        """, (winner_id, justification.strip(), loser_id))
+
+        cur.execute("DELETE FROM student_match_keys WHERE student_id = %s", (loser_id,))
+        student_keys.refresh_student(cur, winner_id)
+        cur.execute("""
+            UPDATE student_duplicates
+            SET status = 'merged', reviewed_by = %s, reviewed_at = CURRENT_TIMESTAMP
+            WHERE student_a = %s AND student_b = %s
+        """, (recorded_by, min(winner_id, loser_id), max(winner_id, loser_id)))
+        # Other open pairs with the loser are moot: it no longer exists as a student
+        cur.execute("""
+            UPDATE student_duplicates
+            SET status = 'dismissed', reviewed_by = %s, reviewed_at = CURRENT_TIMESTAMP
+            WHERE status = 'open' AND %s IN (student_a, student_b)
+        """, (recorded_by, loser_id))
+
+        # 5. One audit record for the whole merge
+        details = (f"Merged {rows[loser_id]['full_name']} (ID: {loser_id}) into "
+                   f"{rows[winner_id]['full_name']} (ID: {winner_id}). "
+                   f"Moved {moved} transactions, new balance {total_points}. Reason: {justification.strip()}")
+        cur.execute("""
+            INSERT INTO audit_log
+            (event_time, event_type, action_type, actor, recorded_by, target_table, target_id, details)
+            VALUES (CURRENT_TIMESTAMP, 'MERGE', 'STUDENT_MERGE', %s, %s, 'students', %s, %s)
+        """, (recorded_by, recorded_by, winner_id, details))
+
+        conn.commit()
+        roster_index.mark_stale()
+        logger.info(details)
+        return {"moved": moved, "total_points": total_points}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
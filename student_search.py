@@ -1,12 +1,18 @@
 import datetime
 import logging
 from typing import List, Dict, Any, Optional
-from db_utils import get_db_connection
+from db_utils import get_db_connection, estimate_rows
+import roster_index
+import student_keys
 
 logger = logging.getLogger(__name__)
 
 ISO_NOW = lambda: datetime.datetime.utcnow().isoformat() + 'Z'
 
+# Profile projection served by get_student_by_id
+PROFILE_FIELDS = ("id, full_name, nickname, grade, classroom, parent_name, phone, email, "
+                  "sms_consent, total_points, active, merged_into, change_version")
+
 
 
 def write_audit(event_type: str, actor: str, target_table: str, target_id: Optional[int], details: str) -> None:
@@ -38,12 +44,14 @@ def write_audit(event_type: str, actor: str, target_table: str, target_id: Optio
 
 
 
-def find_students(search_term: str = "", include_inactive: bool = False, show_all: bool = False) -> List[Dict[str, Any]]:
+def find_students(search_term: str = "", include_inactive: bool = False, show_all: bool = False,
+                  min_points: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Searches for students.
     - search_term: Name or ID to filter by.
     - include_inactive: If True, includes inactive students.
     - show_all: If True, returns ALL students (bypassing LIMIT 50).
+    - min_points: If set, only students with at least this balance.
     """
     conn = get_db_connection()
     if not conn:
@@ -72,6 +80,10 @@ def find_students(search_term: str = "", include_inactive: bool = False, show_al
         # 2. Handle Inactive
         if not include_inactive:
             query += " AND active = TRUE"
+
+        if min_points is not None:
+            query += " AND COALESCE(total_points, 0) >= %s"
+            params.append(min_points)
             
         # 3. Order
         query += " ORDER BY full_name"
@@ -93,20 +105,83 @@ def find_students(search_term: str = "", include_inactive: bool = False, show_al
         conn.close()
 
 
+DIRECTORY_PAGE_SIZE = 100
+
+
+def list_directory(after: Optional[tuple] = None, limit: int = DIRECTORY_PAGE_SIZE,
+                   grade: Optional[str] = None, classroom: Optional[str] = None,
+                   include_inactive: bool = False, min_points: Optional[int] = None,
+                   max_points: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    One page of the student directory, ordered by (full_name, id).
+    - after: (full_name, id) of the last row of the previous page (keyset, no OFFSET).
+    Returns {'students', 'next' (cursor tuple or None), 'total_estimate'}; the
+    estimate comes from the planner, so it is cheap even for a large roster.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        where = ["1=1"]
+        params = []
+
+        if not include_inactive:
+            where.append("active = TRUE")
+        if grade:
+            where.append("grade = %s")
+            params.append(grade)
+        if classroom:
+            where.append("classroom = %s")
+            params.append(classroom)
+        if min_points is not None:
+            where.append("COALESCE(total_points, 0) >= %s")
+            params.append(min_points)
+        if max_points is not None:
+            where.append("COALESCE(total_points, 0) <= %s")
+            params.append(max_points)
+
+        base = f"SELECT id FROM students WHERE {' AND '.join(where)}"
+        total_estimate = estimate_rows(cur, base, tuple(params))
+
+        if after:
+            where.append("(full_name, id) > (%s, %s)")
+            params.extend(after)
+
+        cur.execute(f"""
+            SELECT id, full_name, nickname, classroom, grade, total_points, active
+            FROM students
+            WHERE {' AND '.join(where)}
+            ORDER BY full_name, id
+            LIMIT %s
+        """, tuple(params) + (limit + 1,))
+        rows = cur.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_key = (rows[-1]['full_name'], rows[-1]['id']) if has_more else None
+        return {"students": rows, "next": next_key, "total_estimate": total_estimate}
+
+    except Exception as e:
+        logger.error(f"Database error listing student directory: {e}")
+        return None
+    finally:
+        conn.close()
+
 def get_student_by_id(student_id: int) -> Optional[Dict[str, Any]]:
-    """Fetches a single student by ID."""
+    """
+    Fetches a single student's profile (one primary-key lookup; always read
+    from the database so a profile page never shows a stale balance).
+    """
     conn = get_db_connection()
     if not conn: return None
 
     try:
         cur = conn.cursor()
-        # Note: Postgres boolean is TRUE/FALSE, not 1/0
-        query = """
-        SELECT * FROM students WHERE id = %s
-        """
-        cur.execute(query, (student_id,))
+        cur.execute(f"SELECT {PROFILE_FIELDS} FROM students WHERE id = %s", (student_id,))
         row = cur.fetchone()
-        return row
+        return dict(row) if row else None
     except Exception as e:
         logger.error(f"Database error fetching student {student_id}:  {e}")
         return None
@@ -146,7 +221,11 @@ def update_student(db_path_ignored, student_id: int, update_fields: Dict[str, An
             logger.warning(f"Update failed:  Student {student_id} not found.")
             return False
 
+        if {'full_name', 'phone', 'email'} & set(update_fields):
+            student_keys.refresh_student(cur, student_id)
+
         conn.commit()
+        roster_index.mark_stale()
         
         write_audit(
             event_type="update_student_success", 
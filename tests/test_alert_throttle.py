@@ -0,0 +1,108 @@
+import sys
+import logging
+
+import alert_throttle
+from alert_throttle import ErrorAlertQueue, TokenBucket, fingerprint_record
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _patch_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(alert_throttle.time, 'monotonic', clock)
+    return clock
+
+
+def _record(exc_info=None, pathname='/srv/app/student_search.py', lineno=42):
+    return logging.LogRecord('test', logging.ERROR, pathname, lineno, 'boom', None, exc_info)
+
+
+def _queue(sent, **kwargs):
+    return ErrorAlertQueue(send_fn=lambda subject, message: sent.append((subject, message)), **kwargs)
+
+
+def test_bucket_allows_burst_then_refills(monkeypatch):
+    clock = _patch_clock(monkeypatch)
+    bucket = TokenBucket(capacity=2, refill_seconds=60)
+
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+
+    clock.now += 59
+    assert not bucket.consume()
+    clock.now += 1
+    assert bucket.consume()
+
+
+def test_fingerprint_uses_innermost_frame():
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = _record(sys.exc_info())
+    fp = fingerprint_record(record)
+    assert fp.startswith('test_alert_throttle.py:')
+    assert fp.endswith(':ValueError')
+
+
+def test_fingerprint_uses_basename_without_frames(monkeypatch):
+    assert fingerprint_record(_record()) == 'student_search.py:42'
+
+    try:
+        raise KeyError('x')
+    except KeyError:
+        record = _record(sys.exc_info())
+    monkeypatch.setattr(alert_throttle.traceback, 'extract_tb', lambda tb: [])
+    assert fingerprint_record(record) == 'student_search.py:42:KeyError'
+
+
+def test_queue_suppresses_per_fingerprint(monkeypatch):
+    _patch_clock(monkeypatch)
+    sent = []
+    q = _queue(sent, capacity=2, refill_seconds=300)
+
+    for i in range(5):
+        q._handle('a.py:1', f'Error {i}', 'body')
+    q._handle('b.py:2', 'Other', 'body')
+
+    assert [s for s, _ in sent] == ['Error 0', 'Error 1', 'Other']
+    assert q._suppressed == {'a.py:1': {'count': 3, 'subject': 'Error 2'}}
+
+
+def test_digest_reports_suppressed_and_dropped(monkeypatch):
+    _patch_clock(monkeypatch)
+    sent = []
+    q = _queue(sent, capacity=1, refill_seconds=300)
+    q._handle('a.py:1', 'Error', 'body')
+    q._handle('a.py:1', 'Error', 'body')
+    q._dropped = 2
+
+    q._send_digest()
+
+    subject, message = sent[-1]
+    assert subject == 'System Error Digest: 3 suppressed'
+    assert 'a.py:1' in message and '2 additional records were dropped' in message
+    assert q._suppressed == {} and q._dropped == 0
+
+    # Nothing new: no digest
+    q._send_digest()
+    assert len(sent) == 2
+
+
+def test_digest_evicts_buckets_once_refilled(monkeypatch):
+    clock = _patch_clock(monkeypatch)
+    q = _queue([], capacity=3, refill_seconds=100)
+    q._handle('old.py:1', 'Old', 'body')
+    clock.now += 250
+    q._handle('recent.py:1', 'Recent', 'body')
+
+    clock.now += 60   # old.py idle 310s >= 3 * 100s; recent.py idle 60s
+    q._send_digest()
+
+    assert set(q._buckets) == {'recent.py:1'}
@@ -0,0 +1,59 @@
+import duplicate_audit
+from duplicate_audit import find_pairs
+
+
+def test_finds_spelling_variants():
+    pairs = find_pairs([
+        (1, 'José Luis Pérez', None, None),
+        (2, 'Jose L. Perez', None, None),
+        (3, 'Ana Gómez', None, None),
+    ])
+    assert set(pairs) == {(1, 2)}
+    score, reasons = pairs[(1, 2)]
+    assert score >= 0.8 and reasons == 'name'
+
+
+def test_pairs_are_ordered_low_id_first():
+    pairs = find_pairs([(9, 'Ximena Ruiz', None, None), (4, 'Jimena Ruiz', None, None)])
+    assert list(pairs) == [(4, 9)]
+
+
+def test_siblings_sharing_contacts_are_not_duplicates():
+    pairs = find_pairs([
+        (1, 'Maria Lopez', '5551234567', 'familia@mail.com'),
+        (2, 'Juan Lopez', '5551234567', 'familia@mail.com'),
+    ])
+    assert pairs == {}
+
+
+def test_shared_contact_links_names_without_common_keys():
+    # Different surnames share no name key; the phone brings them together
+    pairs = find_pairs([
+        (1, 'Carlos Ruiz', '555-123-4567', None),
+        (2, 'Carlos Ortiz', '5551234567', None),
+    ])
+    assert pairs[(1, 2)][1] == 'name,phone'
+
+
+def test_placeholder_contacts_are_skipped(monkeypatch):
+    monkeypatch.setattr(duplicate_audit, 'MAX_CONTACT_BLOCK', 2)
+    students = [
+        (1, 'Carlos Ruiz', '0000000000', None),
+        (2, 'Carlos Ortiz', '0000000000', None),
+        (3, 'Ana Torres', '0000000000', None),
+    ]
+    assert find_pairs(students) == {}
+
+
+def test_large_blocks_compare_a_sorted_window(monkeypatch):
+    monkeypatch.setattr(duplicate_audit, 'MAX_BLOCK', 3)
+    monkeypatch.setattr(duplicate_audit, 'WINDOW', 1)
+    students = [(i, 'José Pérez', None, None) for i in range(1, 6)]
+    # Identical names: only neighbours in the sorted block are compared
+    assert set(find_pairs(students)) == {(1, 2), (2, 3), (3, 4), (4, 5)}
+
+
+def test_reports_progress():
+    seen = []
+    find_pairs([(1, 'Ana Ruiz', None, None)], progress=lambda pct, msg: seen.append(pct))
+    assert seen == [30, 50]
@@ -0,0 +1,126 @@
+import pytest
+
+import idempotency
+
+
+class FakeKeys:
+    """idempotency_keys in memory: (scope, actor, key) -> row with an age in seconds."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+
+    def execute(self, sql, params):
+        rows = self.db.rows
+        self.result = None
+        if 'DO NOTHING' in sql:
+            scope, actor, key, body_hash = params
+            if (scope, actor, key) not in rows:
+                rows[(scope, actor, key)] = {'request_hash': body_hash, 'status_code': None,
+                                             'response_body': None, 'age': 0}
+                self.result = {'created_at': 0}
+        elif sql.lstrip().startswith('SELECT'):
+            timeout, ttl_hours, scope, actor, key = params
+            row = rows.get((scope, actor, key))
+            if row:
+                self.result = dict(row, stale=row['age'] > timeout, expired=row['age'] > ttl_hours * 3600)
+        elif 'DO UPDATE' in sql:
+            scope, actor, key, body_hash = params
+            rows[(scope, actor, key)] = {'request_hash': body_hash, 'status_code': None,
+                                         'response_body': None, 'age': 0}
+        elif sql.lstrip().startswith('DELETE'):
+            rows.pop(params, None)
+        elif sql.lstrip().startswith('UPDATE'):
+            status_code, body, scope, actor, key = params
+            rows[(scope, actor, key)].update(status_code=status_code, response_body=body)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    db = FakeKeys()
+    monkeypatch.setattr(idempotency, 'get_db_connection', db.connect)
+    return db
+
+
+BODY = idempotency.request_hash(b'{"student_id": 7, "points": 5}')
+
+
+def test_first_claim_runs_and_replays_stored_response(keys):
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('new', None)
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('in_progress', None)
+
+    idempotency.finish('record', 'maria', 'k1', 200, '{"success": true}')
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('replay', (200, '{"success": true}'))
+
+
+def test_client_errors_are_stored(keys):
+    idempotency.claim('record', 'maria', 'k1', BODY)
+    idempotency.finish('record', 'maria', 'k1', 400, '{"success": false}')
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('replay', (400, '{"success": false}'))
+
+
+def test_server_error_releases_key(keys):
+    idempotency.claim('record', 'maria', 'k1', BODY)
+    idempotency.finish('record', 'maria', 'k1', 500, '{"success": false}')
+    assert keys.rows == {}
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('new', None)
+
+
+def test_key_reused_for_different_request(keys):
+    idempotency.claim('record', 'maria', 'k1', BODY)
+    idempotency.finish('record', 'maria', 'k1', 200, '{}')
+    assert idempotency.claim('record', 'maria', 'k1', idempotency.request_hash(b'other')) == ('mismatch', None)
+
+
+def test_keys_are_scoped_by_endpoint_and_actor(keys):
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('new', None)
+    assert idempotency.claim('redeem', 'maria', 'k1', BODY) == ('new', None)
+    assert idempotency.claim('record', 'jose', 'k1', BODY) == ('new', None)
+
+
+def test_abandoned_claim_is_taken_over(keys):
+    idempotency.claim('record', 'maria', 'k1', BODY)
+    keys.rows[('record', 'maria', 'k1')]['age'] = idempotency.CLAIM_TIMEOUT_SECONDS + 1
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('new', None)
+
+
+def test_expired_response_is_not_replayed(keys):
+    idempotency.claim('record', 'maria', 'k1', BODY)
+    idempotency.finish('record', 'maria', 'k1', 200, '{}')
+    keys.rows[('record', 'maria', 'k1')]['age'] = idempotency.TTL_HOURS * 3600 + 1
+    assert idempotency.claim('record', 'maria', 'k1', BODY) == ('new', None)
+    assert keys.rows[('record', 'maria', 'k1')]['status_code'] is None
+
+
+def test_claim_without_database_raises(monkeypatch):
+    monkeypatch.setattr(idempotency, 'get_db_connection', lambda: None)
+    with pytest.raises(RuntimeError):
+        idempotency.claim('record', 'maria', 'k1', BODY)
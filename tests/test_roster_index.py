@@ -0,0 +1,98 @@
+import pytest
+
+import roster_index
+from roster_index import _matches, _search, normalize
+
+
+def _student(sid, full_name, nickname=None, active=True, total_points=0, version=1):
+    return {'id': sid, 'full_name': full_name, 'nickname': nickname, 'classroom': 'A', 'grade': '3',
+            'total_points': total_points, 'phone': None, 'email': None, 'active': active,
+            'change_version': version}
+
+
+@pytest.fixture
+def roster(monkeypatch):
+    """Loads a small roster straight into the index (no database)."""
+    for name in ('_students', '_haystacks', '_grams'):
+        monkeypatch.setattr(roster_index, name, {})
+    monkeypatch.setattr(roster_index, '_order', [])
+    monkeypatch.setattr(roster_index, '_order_dirty', True)
+    for row in (
+        _student(1, 'José Pérez', nickname='Pepe', total_points=40),
+        _student(2, 'Ana María López', total_points=120),
+        _student(3, 'Mariana Lopez', active=False, total_points=300),
+        _student(14, 'Luis Gómez', total_points=10),
+    ):
+        roster_index._index(row)
+
+
+def _ids(results):
+    return [r['id'] for r in results]
+
+
+def test_normalize_folds_accents_and_case():
+    assert normalize('José PÉREZ') == 'jose perez'
+    assert normalize(None) == ''
+
+
+def test_matches_tokens_in_order_within_one_field():
+    hay = ('ana maria lopez', 'anita', '2')
+    assert _matches(hay, ['ana', 'lop'])
+    assert not _matches(hay, ['lop', 'ana'])          # out of order
+    assert not _matches(hay, ['anita', 'lopez'])      # spread over two fields
+    assert _matches(hay, ['nit'])
+
+
+def test_search_uses_accent_insensitive_substrings(roster):
+    assert _ids(_search(['jose'], False, False, 50, None)) == [1]
+    assert _ids(_search(['pep'], False, False, 50, None)) == [1]   # nickname
+    assert _ids(_search(['lopez'], False, False, 50, None)) == [2]
+
+
+def test_search_short_tokens_and_ids(roster):
+    # Tokens under three letters skip the trigram index but still filter
+    assert _ids(_search(['lu'], False, False, 50, None)) == [14]
+    assert _ids(_search(['14'], False, False, 50, None)) == [14]
+
+
+def test_search_filters_and_orders_by_name(roster):
+    assert _ids(_search([], False, False, 50, None)) == [2, 1, 14]
+    assert _ids(_search(['lopez'], True, False, 50, None)) == [2, 3]
+    assert _ids(_search([], True, False, 50, 100)) == [2, 3]
+    assert _ids(_search([], False, False, 2, None)) == [2, 1]
+    assert _ids(_search([], False, True, 2, None)) == [2, 1, 14]
+
+
+def test_search_results_hide_change_version(roster):
+    assert 'change_version' not in _search(['jose'], False, False, 50, None)[0]
+
+
+def test_unindex_removes_student(roster):
+    roster_index._unindex(1)
+    assert _search(['jose'], False, False, 50, None) == []
+
+
+def test_incremental_skips_rows_already_seen(roster, monkeypatch):
+    monkeypatch.setattr(roster_index, '_generation', 5)
+    monkeypatch.setattr(roster_index, '_xmin', 100)
+    monkeypatch.setattr(roster_index, '_version', 1)
+    monkeypatch.setattr(roster_index, '_checked_at', 0.0)
+    fetched = []
+
+    def fake_fetch(since_xid=None):
+        fetched.append(since_xid)
+        return [dict(roster_index._students[1])], 120
+
+    monkeypatch.setattr(roster_index, '_fetch', fake_fetch)
+    roster_index._incremental()
+    assert fetched == [100]
+    assert roster_index._xmin == 120
+    assert roster_index._generation == 5     # same change_version: nothing changed
+
+    def fake_fetch_changed(since_xid=None):
+        return [_student(1, 'José Pérez Ruiz', version=9)], 130
+
+    monkeypatch.setattr(roster_index, '_fetch', fake_fetch_changed)
+    roster_index._incremental()
+    assert roster_index._generation == 6
+    assert _ids(_search(['ruiz'], False, False, 50, None)) == [1]
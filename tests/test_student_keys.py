@@ -0,0 +1,81 @@
+import pytest
+
+import student_keys
+from student_keys import match_keys, name_score, phonetic
+
+
+@pytest.mark.parametrize('a, b', [
+    ('perez', 'pérez'),
+    ('ximena', 'jimena'),
+    ('gonzalez', 'gonsales'),
+    ('llamas', 'yamas'),
+    ('hugo', 'ugo'),
+    ('valeria', 'baleria'),
+])
+def test_phonetic_folds_spanish_spellings(a, b):
+    assert phonetic(a) == phonetic(b)
+
+
+def test_phonetic_codes():
+    assert phonetic('perez') == 'PRS'
+    assert phonetic('jose') == 'JS'
+    assert phonetic('chavez') == 'XBS'
+    assert phonetic('') == ''
+
+
+def test_match_keys_pairs_phone_and_email():
+    keys = match_keys('José Luis Pérez', '(555) 123-4567', 'Ana+school@Mail.com')
+    assert keys == {
+        ('pair', 'JS LS'), ('pair', 'JS PRS'), ('pair', 'LS PRS'),
+        ('phone', '5551234567'), ('email', 'ana@mail.com'),
+    }
+
+
+def test_match_keys_single_name_and_bad_contacts():
+    # Initials are ignored, short phones and addresses without @ give no key
+    assert match_keys('Ximena L.', '123', 'not-an-email') == {('name', 'JMN')}
+    assert match_keys('Jimena') == match_keys('Ximena')
+
+
+def test_match_keys_shared_across_spellings():
+    assert match_keys('Jose Luis Perez') & match_keys('José L. Pérez') == {('pair', 'JS PRS')}
+
+
+def test_name_score_tolerates_accents_initials_and_spelling():
+    assert name_score('José Pérez', 'Jose Perez') == 1.0
+    assert name_score('José L. Pérez', 'Jose Luis Perez') >= student_keys.MATCH_THRESHOLD
+    assert name_score('Ana Gonzalez', 'Ana Gonsales') >= student_keys.MATCH_THRESHOLD
+
+
+def test_name_score_keeps_siblings_apart():
+    assert name_score('Maria Lopez', 'Juan Lopez') < student_keys.MATCH_THRESHOLD
+    assert name_score('Ana', '') == 0.0
+
+
+class FakeCursor:
+    """Answers find_matches' key lookup, then its exact-match fallback."""
+
+    def __init__(self, keyed, keyless):
+        self.results = [keyed, keyless]
+
+    def execute(self, sql, params=None):
+        self.rows = self.results.pop(0)
+
+    def fetchall(self):
+        return self.rows
+
+
+def _row(sid, full_name, matched, phone=None):
+    return {'id': sid, 'full_name': full_name, 'nickname': None, 'classroom': 'A', 'grade': '3',
+            'phone': phone, 'email': None, 'active': True, 'matched': matched}
+
+
+def test_find_matches_merges_keyless_students():
+    cur = FakeCursor(
+        keyed=[_row(1, 'Jose Perez', ['pair']), _row(2, 'Maria Perez', ['phone'], phone='5551234567')],
+        keyless=[_row(3, 'José Pérez', []), _row(1, 'Jose Perez', [])],
+    )
+    matches = student_keys.find_matches(cur, 'José Pérez', phone='5551234567')
+
+    assert [(m['id'], m['reasons']) for m in matches] == [(1, ['name']), (3, ['name']), (2, ['phone'])]
+    assert 'matched' not in matches[0]
@@ -0,0 +1,134 @@
+import uuid
+import datetime
+
+import pytest
+
+import transaction_manager
+from transaction_manager import _parse_batch_item
+
+UUID = '6f1c2a9e-3b4d-4e5f-8a7b-1c2d3e4f5a6b'
+
+
+def test_parse_valid_item():
+    parsed, error = _parse_batch_item({
+        'client_uuid': UUID.upper(), 'student_id': '7', 'points': 5, 'activity_id': '3',
+        'activity_name': 'Reading', 'recorded_at': '2026-03-01T10:15:00Z',
+    })
+    assert error is None
+    assert parsed == {
+        'client_uuid': UUID,
+        'student_id': 7,
+        'points': 5,
+        'activity_id': 3,
+        'activity_type': 'Reading',
+        'description': '',
+        'recorded_at': datetime.datetime(2026, 3, 1, 10, 15, tzinfo=datetime.timezone.utc),
+    }
+
+
+def test_parse_defaults():
+    parsed, error = _parse_batch_item({'client_uuid': UUID, 'student_id': 7, 'points': 5})
+    assert error is None
+    assert parsed['activity_id'] is None
+    assert parsed['activity_type'] == 'Manual Entry'
+    assert parsed['recorded_at'] is None
+
+
+@pytest.mark.parametrize('item, message', [
+    ('not a dict', "Item must be an object."),
+    ({'student_id': 7, 'points': 5}, "client_uuid must be a UUID."),
+    ({'client_uuid': 'abc', 'student_id': 7, 'points': 5}, "client_uuid must be a UUID."),
+    ({'client_uuid': UUID, 'points': 5}, "student_id and points are required integers."),
+    ({'client_uuid': UUID, 'student_id': 7, 'points': 'many'}, "student_id and points are required integers."),
+    ({'client_uuid': UUID, 'student_id': 7, 'points': 0}, "points must be a positive integer."),
+    ({'client_uuid': UUID, 'student_id': 7, 'points': -5}, "points must be a positive integer."),
+    ({'client_uuid': UUID, 'student_id': 7, 'points': 5, 'recorded_at': 'yesterday'},
+     "recorded_at must be an ISO timestamp."),
+])
+def test_parse_rejects(item, message):
+    assert _parse_batch_item(item) == (None, message)
+
+
+STUDENTS = {
+    1: {'id': 1, 'full_name': 'Ana', 'active': True, 'merged_into': None},
+    2: {'id': 2, 'full_name': 'Beto', 'active': False, 'merged_into': None},
+    3: {'id': 3, 'full_name': 'Carla', 'active': True, 'merged_into': 1},
+}
+
+
+class FakeCursor:
+    def __init__(self, recorded):
+        self.recorded = recorded
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if 'FROM activity_log' in sql:
+            self.rows = [{'client_uuid': u, 'id': self.recorded[u]} for u in params[0] if u in self.recorded]
+        elif 'FROM students' in sql:
+            self.rows = [STUDENTS[i] for i in params[0] if i in STUDENTS]
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, recorded):
+        self.recorded = recorded
+
+    def cursor(self):
+        return FakeCursor(self.recorded)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_execute_values(cur, sql, rows, template=None, page_size=100, fetch=False):
+    """The award INSERT: only active, unmerged students and uuids not recorded yet go in."""
+    if 'INSERT INTO activity_log' not in sql:
+        return None
+    inserted = []
+    for client_uuid, student_id, activity_type, points, *_ in rows:
+        student = STUDENTS.get(student_id)
+        if client_uuid in cur.recorded or not student or not student['active'] or student['merged_into']:
+            continue
+        cur.recorded[client_uuid] = 100 + len(cur.recorded)
+        inserted.append({'id': cur.recorded[client_uuid], 'client_uuid': client_uuid, 'student_id': student_id,
+                         'points': points, 'activity_type': activity_type})
+    return inserted
+
+
+def test_batch_statuses(monkeypatch):
+    earlier = str(uuid.uuid4())
+    recorded = {earlier: 42}
+    monkeypatch.setattr(transaction_manager, 'get_db_connection', lambda: FakeConnection(recorded))
+    monkeypatch.setattr(transaction_manager, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(transaction_manager, '_load_alert_config', lambda cur: (1000, None, {}))
+    monkeypatch.setattr(transaction_manager.roster_index, 'mark_stale', lambda: None)
+
+    fresh = str(uuid.uuid4())
+    items = [
+        {'client_uuid': fresh, 'student_id': 1, 'points': 5},
+        {'client_uuid': fresh, 'student_id': 1, 'points': 5},      # repeated inside the upload
+        {'client_uuid': earlier, 'student_id': 1, 'points': 5},    # uploaded before
+        {'client_uuid': str(uuid.uuid4()), 'student_id': 2, 'points': 5},
+        {'client_uuid': str(uuid.uuid4()), 'student_id': 3, 'points': 5},
+        {'client_uuid': str(uuid.uuid4()), 'student_id': 99, 'points': 5},
+        {'client_uuid': str(uuid.uuid4()), 'student_id': 1, 'points': 0},
+    ]
+    results, error = transaction_manager.add_points_batch(items, recorded_by='tablet')
+
+    assert error is None
+    assert [r['status'] for r in results] == [
+        'applied', 'duplicate', 'duplicate', 'rejected', 'rejected', 'unknown_student', 'invalid']
+    assert results[1]['transaction_id'] == results[0]['transaction_id']
+    assert results[2]['transaction_id'] == 42
+    assert results[3]['message'] == "Beto is inactive."
+    assert results[4]['message'] == "Carla was merged into student 1."
@@ -1,12 +1,125 @@
+import uuid
 import logging
+import datetime
+from psycopg2.extras import execute_values
 from db_utils import get_db_connection
 import alerts  
+import alert_coalescer
+import roster_index
 
 logger = logging.getLogger(__name__)
 
+# Every system_settings key the High Point alert path needs (read in one query)
+ALERT_SETTING_KEYS = (
+    'POINT_ALERT_THRESHOLD', 'POINT_ALERT_URGENT_THRESHOLD',
+    'ALERT_RECIPIENT_EMAILS', 'ALERT_RECIPIENT_NUMBERS',
+    'EMAIL_TO_SMS_RECIPIENTS', 'WHATSAPP_RECIPIENT_NUMBERS',
+) + tuple(alert_coalescer.WINDOW_SETTING_KEYS.values())
+
+BATCH_LIMIT = 500   # Awards accepted per /api/transaction/batch upload
+RECENT_AWARD_MESSAGE = "Already awarded for this activity moments ago."
+
+
+def _split_setting(val):
+    """Comma-separated setting -> list (None when blank)."""
+    if val and val.strip():
+        return [e.strip() for e in val.split(',') if e.strip()]
+    return None
+
+
+def _load_alert_config(cur):
+    """Threshold, urgent threshold and recipients/windows for the High Point alert, in ONE query."""
+    threshold = 100 # Default
+    urgent_threshold = None
+    settings = {}
+
+    try:
+        cur.execute("""
+            SELECT setting_key, setting_value FROM system_settings
+            WHERE setting_key IN %s
+        """, (ALERT_SETTING_KEYS,))
+        for row in cur.fetchall():
+            key = row['setting_key'] if isinstance(row, dict) else row[0]
+            settings[key] = row['setting_value'] if isinstance(row, dict) else row[1]
+
+        if settings.get('POINT_ALERT_THRESHOLD'):
+            threshold = int(settings['POINT_ALERT_THRESHOLD'])
+        if settings.get('POINT_ALERT_URGENT_THRESHOLD'):
+            urgent_threshold = int(settings['POINT_ALERT_URGENT_THRESHOLD'])
+
+    except Exception as e:
+        logger.error(f"Alert Config Error: {e}")
+
+    return threshold, urgent_threshold, settings
+
+
+def _high_point_alert(config, s_name, points, activity_type, recorded_by):
+    """Alert payload for an award at or above the threshold (None below it)."""
+    threshold, urgent_threshold, settings = config
+    if points < threshold:
+        return None
+
+    alert = {
+        "event": {"student": s_name, "points": points, "activity": activity_type, "staff": recorded_by},
+        "recipients": {
+            "email": _split_setting(settings.get('ALERT_RECIPIENT_EMAILS')),
+            "sms": _split_setting(settings.get('ALERT_RECIPIENT_NUMBERS')),           # Twilio
+            "gateway": _split_setting(settings.get('EMAIL_TO_SMS_RECIPIENTS')),       # Email-to-SMS
+            "whatsapp": _split_setting(settings.get('WHATSAPP_RECIPIENT_NUMBERS')),   # WhatsApp
+        },
+        "windows": alert_coalescer.parse_windows(settings),
+        "urgent": urgent_threshold is not None and points >= urgent_threshold
+    }
+    # Email always goes out (falls back to ADMIN_EMAIL), matching send_alert
+    if not alert["recipients"]["email"]:
+        alert["recipients"]["email"] = alerts.resolve_email_recipients(None)
+    return alert
+
+
+def _dispatch_alert(alert):
+    """Hands a committed award's alert to the coalescer and audits it."""
+    try:
+        queued = alert_coalescer.submit(
+            alert["event"],
+            alert["recipients"],
+            alert["windows"],
+            urgent=alert["urgent"]
+        )
+        log_audit_event(
+            action_type="ALERT_TRIGGERED",
+            details=f"High points ({alert['event']['points']}). Alerts sent to configured Email/SMS."
+                    + (f" Queued for digest: {', '.join(queued)}." if queued else ""),
+            recorded_by="system"
+        )
+    except Exception:
+        logger.exception("Failed to dispatch High Point alerts")
+
+
 # --- 1. The Main "New" Logic ---
 
-def add_points(student_id, points, activity_type, description="", recorded_by="system", activity_id=None, prize_id=None, audit_action="POINT_AWARD"):
+def _as_uuid(value):
+    """Canonical UUID string, or None if value is not a UUID."""
+    try:
+        return str(uuid.UUID(str(value))) if value else None
+    except ValueError:
+        return None
+
+
+def add_points(student_id, points, activity_type, description="", recorded_by="system", activity_id=None, prize_id=None, audit_action="POINT_AWARD", client_uuid=None, debounce_seconds=None):
+    """
+    client_uuid: the request's idempotency key when it is a UUID. It is stored on
+    the activity_log row, so the same award later uploaded from an offline queue
+    (add_points_batch) is recognised as a duplicate. If the uuid is already
+    recorded (queue uploaded first, key reused after its idempotency record
+    expired), nothing is applied and the call succeeds as a duplicate.
+
+    debounce_seconds: refuse (False, RECENT_AWARD_MESSAGE) when the student
+    already got this activity_id within that many seconds.
+
+    The student row is locked first, so an award cannot land on a student
+    being merged (or race another scan): inactive and merged students are
+    refused, as add_points_batch does.
+    """
     conn = get_db_connection()
     if not conn:
         return False, "Database connection failed."
@@ -14,25 +127,47 @@ def add_points(student_id, points, activity_type, description="", recorded_by="s
     try:
         cur = conn.cursor()
         
-        # 1. Fetch Student Name
-        s_name = "Unknown"
-        try:
-            cur.execute("SELECT full_name FROM students WHERE id = %s", (student_id,))
-            res = cur.fetchone()
-            if res:
-                s_name = res['full_name'] if isinstance(res, dict) else res[0]
-        except Exception:
-            pass 
+        # 1. Lock the student (waits for a merge in progress) and check it can receive points
+        cur.execute("SELECT full_name, active, merged_into FROM students WHERE id = %s FOR UPDATE", (student_id,))
+        student = cur.fetchone()
+        if not student:
+            conn.rollback()
+            return False, "Student not found."
+        s_name = student['full_name']
+        if student['merged_into'] is not None:
+            conn.rollback()
+            return False, f"{s_name} was merged into student {student['merged_into']}."
+        if not student['active']:
+            conn.rollback()
+            return False, f"{s_name} is inactive."
+
+        if debounce_seconds and activity_id:
+            cur.execute("""
+                SELECT 1 FROM activity_log
+                WHERE student_id = %s AND activity_id = %s
+                  AND timestamp > LOCALTIMESTAMP - make_interval(secs => %s)
+                LIMIT 1
+            """, (student_id, activity_id, debounce_seconds))
+            if cur.fetchone():
+                conn.rollback()
+                return False, RECENT_AWARD_MESSAGE
 
         # 2. Record Transaction
         cur.execute("""
             INSERT INTO activity_log 
-            (student_id, activity_type, points, description, recorded_by, activity_id, prize_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            (student_id, activity_type, points, description, recorded_by, activity_id, prize_id, client_uuid)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (client_uuid) WHERE client_uuid IS NOT NULL DO NOTHING
             RETURNING id
-        """, (student_id, activity_type, points, description, recorded_by, activity_id, prize_id))
-        
-        new_trans_id = cur.fetchone()['id']
+        """, (student_id, activity_type, points, description, recorded_by, activity_id, prize_id, _as_uuid(client_uuid)))
+
+        res = cur.fetchone()
+        if res is None:
+            # client_uuid already recorded: this award was applied before
+            conn.rollback()
+            logger.info(f"Duplicate award {client_uuid} for {s_name} (ID: {student_id}) ignored")
+            return True, "Points already recorded."
+        new_trans_id = res['id']
 
         # 3. Update Balance
         cur.execute("""
@@ -52,104 +187,18 @@ def add_points(student_id, points, activity_type, description="", recorded_by="s
 
 
         # 5. ALERTS (High Point Threshold)
+        high_point_alert = None
         if points > 0:
-            threshold = 100 # Default
-            alert_recipients_email = None
-            alert_recipients_sms = None       # Twilio
-            alert_recipients_gateway = None   # Email-to-SMS
-            alert_recipients_whatsapp = None  # WhatsApp
-            
-            try:
-                # Fetch Threshold
-                cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'POINT_ALERT_THRESHOLD'")
-                row = cur.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    threshold = int(val)
-                
-                # Fetch Email Recipients
-                cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'ALERT_RECIPIENT_EMAILS'")
-                row = cur.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    if val and val.strip():
-                        alert_recipients_email = [e.strip() for e in val.split(',')]
-
-                # --- NEW: Fetch SMS Recipients ---
-                cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'ALERT_RECIPIENT_NUMBERS'")
-                row = cur.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    if val and val.strip():
-                        alert_recipients_sms = [e.strip() for e in val.split(',')]
-                        
-                # --- NEW: Fetch Email-to-SMS Recipients ---
-                cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'EMAIL_TO_SMS_RECIPIENTS'")
-                row = cur.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    if val and val.strip():
-                        alert_recipients_gateway = [e.strip() for e in val.split(',')]
-
-                # --- NEW: Fetch WhatsApp Recipients ---
-                cur.execute("SELECT setting_value FROM system_settings WHERE setting_key = 'WHATSAPP_RECIPIENT_NUMBERS'")
-                row = cur.fetchone()
-                if row:
-                    val = row['setting_value'] if isinstance(row, dict) else row[0]
-                    if val and val.strip():
-                        alert_recipients_whatsapp = [e.strip() for e in val.split(',')]
-                else:
-                    alert_recipients_whatsapp = None
-
-            except Exception as e:
-                logger.error(f"Alert Config Error: {e}")
-
-            # --- CHECK THRESHOLD & LOG ---
-            if points >= threshold:
-                
-                # 1. EMAIL ALERT
-                try:
-                    alerts.send_alert(
-                        subject=f"High Point Alert: {points} pts",
-                        message=f"Student <b>{s_name}</b> was awarded <b>{points} points</b>.<br>Reason: {activity_type}<br>Staff: {recorded_by}",
-                        to_emails=alert_recipients_email
-                    )
-                except Exception:
-                    logger.exception("Failed to trigger Email Alert")
-                
-                # 2. TWILIO SMS ALERT
-                if alert_recipients_sms:
-                    try:
-                        sms_body = f"High Point Alert: {points} pts awarded to {s_name}. Check email for details."
-                        alerts.send_sms(sms_body, alert_recipients_sms)
-                    except Exception:
-                        logger.exception("Failed to trigger Twilio SMS")
-
-                # 3. EMAIL-TO-SMS GATEWAY (NEW)
-                if alert_recipients_gateway:
-                    try:
-                        gateway_body = f"High Point: {points} pts for {s_name}."
-                        alerts.send_email_sms(gateway_body, alert_recipients_gateway)
-                    except Exception:
-                        logger.exception("Failed to trigger Gateway SMS")
-
-                # 4. WHATSAPP ALERT (NEW)
-                if alert_recipients_whatsapp:
-                    try:
-                        whatsapp_body = f"🏆 High Point Alert: {s_name} was awarded {points} points for {activity_type}. Staff: {recorded_by}"
-                        alerts.send_whatsapp(whatsapp_body, alert_recipients_whatsapp)
-                    except Exception:
-                        logger.exception("Failed to trigger WhatsApp Alert")
-
-                # 5. Log Audit
-                log_audit_event(
-                    action_type="ALERT_TRIGGERED",
-                    details=f"High points ({points}). Alerts sent to configured Email/SMS.",
-                    recorded_by="system"
-                )
+            high_point_alert = _high_point_alert(_load_alert_config(cur), s_name, points, activity_type, recorded_by)
         
         conn.commit()
+        roster_index.mark_stale()
         logger.info(f"Transaction Success: {points} pts for {s_name} (ID: {student_id})")
+
+        # 6. Dispatch alerts only once the award is committed
+        if high_point_alert:
+            _dispatch_alert(high_point_alert)
+
         return True, "Points saved successfully."
 
     except Exception as e:
@@ -160,6 +209,186 @@ def add_points(student_id, points, activity_type, description="", recorded_by="s
         conn.close()
 
 
+def _parse_batch_item(item):
+    """Validates one queued award -> (clean dict, None) or (None, error message)."""
+    if not isinstance(item, dict):
+        return None, "Item must be an object."
+    client_uuid = _as_uuid(item.get('client_uuid'))
+    if not client_uuid:
+        return None, "client_uuid must be a UUID."
+    try:
+        student_id = int(item['student_id'])
+        points = int(item['points'])
+        activity_id = int(item['activity_id']) if item.get('activity_id') else None
+    except (KeyError, TypeError, ValueError):
+        return None, "student_id and points are required integers."
+    if points <= 0:
+        return None, "points must be a positive integer."
+
+    recorded_at = None
+    if item.get('recorded_at'):
+        try:
+            recorded_at = datetime.datetime.fromisoformat(str(item['recorded_at']).replace('Z', '+00:00'))
+        except ValueError:
+            return None, "recorded_at must be an ISO timestamp."
+
+    return {
+        'client_uuid': client_uuid,
+        'student_id': student_id,
+        'points': points,
+        'activity_id': activity_id,
+        'activity_type': str(item.get('activity_name') or 'Manual Entry'),
+        'description': str(item.get('description') or ''),
+        'recorded_at': recorded_at,
+    }, None
+
+
+def add_points_batch(items, recorded_by="system"):
+    """
+    Applies a queue of awards recorded offline, in ONE transaction with
+    set-based writes. Each item carries a client-generated client_uuid; the
+    unique index on activity_log.client_uuid makes re-uploads harmless, so a
+    tablet can resend its whole queue after a dropped connection.
+
+    Returns (results, error). results has one entry per item, in order:
+        {'client_uuid', 'status', 'transaction_id', 'message'}
+    with status 'applied', 'duplicate' (already recorded earlier), 'invalid',
+    'unknown_student' or 'rejected' (student inactive or merged). error is set
+    (results None) only if nothing could be applied.
+    """
+    results = []
+    keys = []      # normalized client_uuid per item (None if invalid)
+    pending = {}   # client_uuid -> parsed item (the first occurrence wins)
+    for item in items:
+        parsed, error = _parse_batch_item(item)
+        results.append({
+            'client_uuid': item.get('client_uuid') if isinstance(item, dict) else None,  # echoed as sent
+            'status': 'invalid' if error else None,
+            'transaction_id': None,
+            'message': error,
+        })
+        keys.append(parsed['client_uuid'] if parsed else None)
+        if parsed:
+            pending.setdefault(parsed['client_uuid'], parsed)
+
+    if not pending:
+        return results, None
+
+    conn = get_db_connection()
+    if not conn:
+        return None, "Database connection failed."
+
+    try:
+        cur = conn.cursor()
+
+        # 1. Insert every new award (active, unmerged students only; an unknown activity_id becomes NULL).
+        #    Client timestamps are kept, but never later than now.
+        inserted = execute_values(cur, """
+            INSERT INTO activity_log
+                (client_uuid, student_id, activity_type, points, description, recorded_by, activity_id, timestamp)
+            SELECT v.client_uuid, s.id, v.activity_type, v.points, v.description, v.recorded_by, a.id,
+                   LEAST(COALESCE(v.recorded_at::timestamp, LOCALTIMESTAMP), LOCALTIMESTAMP)
+            FROM (VALUES %s) AS v(client_uuid, student_id, activity_type, points, description, recorded_by, activity_id, recorded_at)
+            JOIN students s ON s.id = v.student_id AND s.active AND s.merged_into IS NULL
+            LEFT JOIN activities a ON a.id = v.activity_id
+            ON CONFLICT (client_uuid) WHERE client_uuid IS NOT NULL DO NOTHING
+            RETURNING id, client_uuid::text AS client_uuid, student_id, points, activity_type
+        """, [
+            (p['client_uuid'], p['student_id'], p['activity_type'], p['points'],
+             p['description'], recorded_by, p['activity_id'], p['recorded_at'])
+            for p in pending.values()
+        ], template="(%s::uuid, %s::int, %s, %s::int, %s, %s, %s::int, %s::timestamptz)",
+            page_size=BATCH_LIMIT, fetch=True)
+
+        applied = {row['client_uuid']: row for row in inserted}
+
+        # 2. Anything not inserted was either uploaded before or names a student who can't receive points
+        missing = [u for u in pending if u not in applied]
+        existing = {}
+        refused = {}   # student_id -> reason for inactive/merged students
+        if missing:
+            cur.execute("""
+                SELECT client_uuid::text AS client_uuid, id FROM activity_log
+                WHERE client_uuid = ANY(%s::uuid[])
+            """, (missing,))
+            existing = {row['client_uuid']: row['id'] for row in cur.fetchall()}
+
+            cur.execute("""
+                SELECT id, full_name, active, merged_into FROM students WHERE id = ANY(%s)
+            """, (list({pending[u]['student_id'] for u in missing if u not in existing}),))
+            for row in cur.fetchall():
+                if row['merged_into'] is not None:
+                    refused[row['id']] = f"{row['full_name']} was merged into student {row['merged_into']}."
+                elif not row['active']:
+                    refused[row['id']] = f"{row['full_name']} is inactive."
+
+        if applied:
+            # 3. One balance update per student
+            totals = {}
+            for row in applied.values():
+                totals[row['student_id']] = totals.get(row['student_id'], 0) + row['points']
+            execute_values(cur, """
+                UPDATE students s SET total_points = COALESCE(s.total_points, 0) + v.delta
+                FROM (VALUES %s) AS v(id, delta)
+                WHERE s.id = v.id
+            """, list(totals.items()))
+
+            cur.execute("SELECT id, full_name FROM students WHERE id = ANY(%s)", (list(totals),))
+            names = {row['id']: row['full_name'] for row in cur.fetchall()}
+
+            # 4. AUDIT LOG (one row per award, as add_points writes)
+            execute_values(cur, """
+                INSERT INTO audit_log
+                (event_time, event_type, action_type, actor, recorded_by, target_table, target_id, details)
+                VALUES %s
+            """, [
+                (recorded_by, recorded_by, row['id'],
+                 f"Points: {row['points']}, Student: {names.get(row['student_id'], 'Unknown')} "
+                 f"(ID: {row['student_id']}), Type: {row['activity_type']}, Offline: {row['client_uuid']}")
+                for row in applied.values()
+            ], template="(CURRENT_TIMESTAMP, 'TRANSACTION', 'POINT_AWARD', %s, %s, 'activity_log', %s, %s)")
+
+            # 5. ALERTS (High Point Threshold), same rules as add_points
+            config = _load_alert_config(cur)
+            high_point_alerts = [
+                _high_point_alert(config, names.get(row['student_id'], 'Unknown'), row['points'], row['activity_type'], recorded_by)
+                for row in applied.values() if row['points'] > 0
+            ]
+
+        conn.commit()
+
+        reported = set()
+        for result, key in zip(results, keys):
+            if result['status']:
+                continue
+            if key in applied and key not in reported:
+                reported.add(key)
+                result.update(status='applied', transaction_id=applied[key]['id'])
+            elif key in applied or key in existing:
+                result.update(status='duplicate', transaction_id=existing.get(key) or applied[key]['id'])
+            elif pending[key]['student_id'] in refused:
+                result.update(status='rejected', message=refused[pending[key]['student_id']])
+            else:
+                result.update(status='unknown_student', message="Student not found.")
+
+        if applied:
+            roster_index.mark_stale()
+            logger.info(f"Offline batch from {recorded_by}: {len(applied)} applied, "
+                        f"{len(existing)} duplicates, {len(items)} items")
+            for alert in high_point_alerts:
+                if alert:
+                    _dispatch_alert(alert)
+
+        return results, None
+
+    except Exception as e:
+        conn.rollback()
+        logger.exception(f"Error applying offline batch: {e}")
+        return None, f"Error: {e}"
+    finally:
+        conn.close()
+
+
 
 
 # --- 2. The Legacy Adapter (Crucial for compatibility) ---
@@ -313,6 +542,7 @@ def redeem_prize_logic(student_id, prize_id, recorded_by):
             """, (recorded_by, recorded_by, prize_id, audit_details))
 
             conn.commit()
+            roster_index.mark_stale()
             logger.info(f"Redemption Success: {s_name} redeemed '{p_name}'")
             return True, f"Successfully redeemed {p_name}!"
 
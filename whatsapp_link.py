@@ -0,0 +1,181 @@
+"""
+whatsapp_link.py - Background WhatsApp QR linking jobs
+`generate_qr.js` waits up to 2 minutes for a phone to scan the QR code.
+Running it inside a request pinned a gunicorn worker for that long, so the
+script now runs in a background thread and streams its progress into the
+whatsapp_link_jobs table. The setup page polls the job by ID, so any
+worker can answer.
+
+Job status flow: starting -> qr_ready -> connected | failed | timeout
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+import subprocess
+from collections import deque
+from db_utils import get_db_connection
+import whatsapp_status
+
+logger = logging.getLogger(__name__)
+
+WHATSAPP_SERVICE_DIR = os.path.join(os.path.dirname(__file__), 'whatsapp_service')
+LINK_TIMEOUT_SECONDS = 130   # generate_qr.js gives up after 120s
+ACTIVE_STATUSES = ('starting', 'qr_ready')
+
+JOB_COLUMNS = "job_id, status, qr_data, phone, error, started_by, created_at, updated_at"
+
+
+def _row_to_job(row):
+    if not row:
+        return None
+    is_dict = isinstance(row, dict)
+    keys = [c.strip() for c in JOB_COLUMNS.split(',')]
+    job = {k: (row[k] if is_dict else row[i]) for i, k in enumerate(keys)}
+    for ts in ('created_at', 'updated_at'):
+        if job[ts] is not None:
+            job[ts] = job[ts].isoformat()
+    return job
+
+
+def _update_job(job_id, **fields):
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        set_clauses = ", ".join(f"{k} = %s" for k in fields)
+        cur.execute(
+            f"UPDATE whatsapp_link_jobs SET {set_clauses}, updated_at = CURRENT_TIMESTAMP WHERE job_id = %s",
+            tuple(fields.values()) + (job_id,)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not update WhatsApp link job {job_id}: {e}")
+    finally:
+        conn.close()
+
+
+def get_job(job_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM whatsapp_link_jobs WHERE job_id = %s", (job_id,))
+        return _row_to_job(cur.fetchone())
+    finally:
+        conn.close()
+
+
+def start_job(started_by):
+    """
+    Starts a linking job, or returns the one already running (only one
+    phone can be linked at a time). Returns (job_dict, error_message).
+    """
+    generate_script = os.path.join(WHATSAPP_SERVICE_DIR, 'generate_qr.js')
+    if not os.path.exists(generate_script):
+        return None, 'WhatsApp service not installed'
+
+    conn = get_db_connection()
+    if not conn:
+        return None, 'Database connection failed'
+
+    try:
+        cur = conn.cursor()
+        # Serialize concurrent clicks across workers
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('whatsapp_link_jobs'))")
+
+        cur.execute(f"""
+            SELECT {JOB_COLUMNS} FROM whatsapp_link_jobs
+            WHERE status IN %s AND updated_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+            ORDER BY created_at DESC LIMIT 1
+        """, (ACTIVE_STATUSES, LINK_TIMEOUT_SECONDS))
+        existing = cur.fetchone()
+        if existing:
+            conn.commit()
+            return _row_to_job(existing), None
+
+        job_id = uuid.uuid4().hex
+        cur.execute(f"""
+            INSERT INTO whatsapp_link_jobs (job_id, status, started_by)
+            VALUES (%s, 'starting', %s)
+            RETURNING {JOB_COLUMNS}
+        """, (job_id, started_by))
+        job = _row_to_job(cur.fetchone())
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Could not create WhatsApp link job: {e}")
+        return None, str(e)
+    finally:
+        conn.close()
+
+    threading.Thread(target=_run_job, args=(job_id, generate_script), name=f"whatsapp-link-{job_id[:8]}", daemon=True).start()
+    return job, None
+
+
+def _run_job(job_id, generate_script):
+    """Runs generate_qr.js and mirrors each JSON line it prints into the job row."""
+    stderr_tail = deque(maxlen=20)
+    final_status = None
+
+    try:
+        proc = subprocess.Popen(
+            ['node', generate_script, 'base64'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            cwd=WHATSAPP_SERVICE_DIR,
+            env={**os.environ, 'DATABASE_URL': os.getenv('DATABASE_URL', '')}
+        )
+    except Exception as e:
+        _update_job(job_id, status='failed', error=str(e))
+        return
+
+    # Drain stderr in the background so the pipe can never fill up and stall node
+    def _drain_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line.rstrip())
+    threading.Thread(target=_drain_stderr, daemon=True).start()
+
+    watchdog = threading.Timer(LINK_TIMEOUT_SECONDS, proc.kill)
+    watchdog.daemon = True
+    watchdog.start()
+
+    try:
+        for line in proc.stdout:
+            line = line.strip()
+            if not line.startswith('{'):
+                continue  # whatsapp_client.js also prints plain progress text
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+
+            if data.get('status') == 'qr_ready' and data.get('qr_data'):
+                _update_job(job_id, status='qr_ready', qr_data=data['qr_data'])
+            elif data.get('status') == 'connected':
+                final_status = 'connected'
+                _update_job(job_id, status='connected', qr_data=None, phone=data.get('phone'))
+                whatsapp_status.record_status({
+                    'status': 'valid',
+                    'message': 'WhatsApp session is valid and connected.',
+                    'needsSetup': False,
+                    'phone': data.get('phone', 'unknown'),
+                    'platform': data.get('platform', 'unknown')
+                })
+
+        proc.wait()
+    finally:
+        timed_out = not watchdog.is_alive() and final_status is None
+        watchdog.cancel()
+
+    if final_status is None:
+        if timed_out:
+            _update_job(job_id, status='timeout', qr_data=None, error='QR generation timed out. Please try again.')
+        else:
+            _update_job(job_id, status='failed', qr_data=None,
+                        error="\n".join(stderr_tail) or f'generate_qr.js exited with code {proc.returncode}')
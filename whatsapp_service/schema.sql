@@ -5,7 +5,9 @@
 CREATE TABLE IF NOT EXISTS whatsapp_session (
     id SERIAL PRIMARY KEY,
     session_id VARCHAR(50) DEFAULT 'default',
-    session_data TEXT,  -- JSON blob containing auth credentials
+    session_data TEXT,  -- Legacy uncompressed JSON (migrated to session_blob on first read)
+    session_blob BYTEA,  -- gzip-compressed JSON blob containing auth credentials
+    session_hash VARCHAR(64),  -- sha256 of the uncompressed JSON; writes are skipped when unchanged
     is_connected BOOLEAN DEFAULT FALSE,
     last_connected_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -15,6 +17,10 @@ CREATE TABLE IF NOT EXISTS whatsapp_session (
 -- Ensure only one session per session_id
 CREATE UNIQUE INDEX IF NOT EXISTS idx_whatsapp_session_id ON whatsapp_session(session_id);
 
+-- Upgrade existing installs (whatsapp_client.js also does this on first use)
+ALTER TABLE whatsapp_session ADD COLUMN IF NOT EXISTS session_blob BYTEA;
+ALTER TABLE whatsapp_session ADD COLUMN IF NOT EXISTS session_hash VARCHAR(64);
+
 -- Add system_settings entries for WhatsApp configuration
 -- (Run these INSERT statements, they'll be ignored if keys already exist)
 
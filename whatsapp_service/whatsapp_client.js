@@ -7,6 +7,8 @@ const { Client, LocalAuth } = require('whatsapp-web.js');
 const { Pool } = require('pg');
 const fs = require('fs');
 const path = require('path');
+const zlib = require('zlib');
+const crypto = require('crypto');
 
 // Database connection using same env vars as Flask app
 const pool = new Pool({
@@ -17,17 +19,92 @@ const pool = new Pool({
 const SESSION_ID = 'default';
 const LOCAL_SESSION_PATH = path.join(__dirname, '.wwebjs_auth');
 
+/**
+ * Session storage format
+ * The session is stored gzip-compressed in whatsapp_session.session_blob, with a
+ * sha256 of the uncompressed JSON in session_hash. The hash lets us:
+ *   - skip the DB write when a backup has not changed anything
+ *   - skip the DB download when the local copy already matches (LOCAL_VERSION_FILE)
+ * Rows written by older versions (session_data TEXT) are migrated on first read.
+ */
+const LOCAL_VERSION_FILE = path.join(LOCAL_SESSION_PATH, `session-${SESSION_ID}.version`);
+
+let schemaReady = null;
+
+/**
+ * Add the compressed-storage columns if this database predates them (once per process)
+ */
+function ensureSessionSchema() {
+    if (!schemaReady) {
+        schemaReady = pool.query(`
+            ALTER TABLE whatsapp_session ADD COLUMN IF NOT EXISTS session_blob BYTEA;
+            ALTER TABLE whatsapp_session ADD COLUMN IF NOT EXISTS session_hash VARCHAR(64);
+        `).catch(err => {
+            schemaReady = null;
+            throw err;
+        });
+    }
+    return schemaReady;
+}
+
+/**
+ * Serialize session data deterministically so identical sessions hash identically
+ */
+function serializeSession(sessionData) {
+    const ordered = {};
+    for (const key of Object.keys(sessionData).sort()) {
+        ordered[key] = sessionData[key];
+    }
+    return JSON.stringify(ordered);
+}
+
+function hashSession(json) {
+    return crypto.createHash('sha256').update(json).digest('hex');
+}
+
+function readLocalVersion() {
+    try {
+        return fs.readFileSync(LOCAL_VERSION_FILE, 'utf8').trim() || null;
+    } catch {
+        return null;
+    }
+}
+
+function writeLocalVersion(hash) {
+    try {
+        fs.mkdirSync(LOCAL_SESSION_PATH, { recursive: true });
+        fs.writeFileSync(LOCAL_VERSION_FILE, hash || '');
+    } catch (err) {
+        console.error('Error writing local session version:', err.message);
+    }
+}
+
 /**
  * Load session data from Supabase
+ * Returns { data, hash } or null
  */
 async function loadSessionFromDB() {
     try {
+        await ensureSessionSchema();
         const result = await pool.query(
-            'SELECT session_data FROM whatsapp_session WHERE session_id = $1',
+            'SELECT session_blob, session_hash, session_data FROM whatsapp_session WHERE session_id = $1',
             [SESSION_ID]
         );
-        if (result.rows.length > 0 && result.rows[0].session_data) {
-            return JSON.parse(result.rows[0].session_data);
+        if (result.rows.length === 0) {
+            return null;
+        }
+
+        const row = result.rows[0];
+        if (row.session_blob) {
+            const json = zlib.gunzipSync(row.session_blob).toString('utf8');
+            return { data: JSON.parse(json), hash: row.session_hash || hashSession(json) };
+        }
+
+        if (row.session_data) {
+            // Legacy uncompressed row: convert it so later reads are cheap
+            const data = JSON.parse(row.session_data);
+            const hash = await saveSessionToDB(data);
+            return { data, hash };
         }
     } catch (err) {
         console.error('Error loading session from DB:', err.message);
@@ -36,20 +113,34 @@ async function loadSessionFromDB() {
 }
 
 /**
- * Save session data to Supabase
+ * Save session data to Supabase (only if it differs from what is stored)
+ * Returns the session hash, or null on error
  */
 async function saveSessionToDB(sessionData) {
     try {
-        const jsonData = JSON.stringify(sessionData);
-        await pool.query(`
-            INSERT INTO whatsapp_session (session_id, session_data, is_connected, updated_at)
-            VALUES ($1, $2, true, CURRENT_TIMESTAMP)
+        await ensureSessionSchema();
+        const json = serializeSession(sessionData);
+        const hash = hashSession(json);
+        const blob = zlib.gzipSync(json);
+
+        const result = await pool.query(`
+            INSERT INTO whatsapp_session (session_id, session_blob, session_hash, session_data, is_connected, updated_at)
+            VALUES ($1, $2, $3, NULL, true, CURRENT_TIMESTAMP)
             ON CONFLICT (session_id)
-            DO UPDATE SET session_data = $2, is_connected = true, updated_at = CURRENT_TIMESTAMP
-        `, [SESSION_ID, jsonData]);
-        console.log('Session saved to database');
+            DO UPDATE SET session_blob = $2, session_hash = $3, session_data = NULL,
+                          is_connected = true, updated_at = CURRENT_TIMESTAMP
+            WHERE whatsapp_session.session_hash IS DISTINCT FROM $3
+        `, [SESSION_ID, blob, hash]);
+
+        if (result.rowCount > 0) {
+            console.log(`Session saved to database (${json.length} -> ${blob.length} bytes)`);
+        } else {
+            console.log('Session unchanged, skipped database write');
+        }
+        return hash;
     } catch (err) {
         console.error('Error saving session to DB:', err.message);
+        return null;
     }
 }
 
@@ -75,11 +166,14 @@ async function updateConnectionStatus(isConnected) {
  */
 async function clearSessionFromDB() {
     try {
+        await ensureSessionSchema();
         await pool.query(`
             UPDATE whatsapp_session
-            SET session_data = NULL, is_connected = false, updated_at = CURRENT_TIMESTAMP
+            SET session_data = NULL, session_blob = NULL, session_hash = NULL,
+                is_connected = false, updated_at = CURRENT_TIMESTAMP
             WHERE session_id = $1
         `, [SESSION_ID]);
+        writeLocalVersion(null);
         console.log('Session cleared from database');
     } catch (err) {
         console.error('Error clearing session from DB:', err.message);
@@ -87,17 +181,20 @@ async function clearSessionFromDB() {
 }
 
 /**
- * Check if we have a valid session in the database
+ * Check if we have a valid session in the database (does not download it)
  */
 async function checkSessionExists() {
     try {
-        const result = await pool.query(
-            'SELECT session_data, is_connected, last_connected_at FROM whatsapp_session WHERE session_id = $1',
-            [SESSION_ID]
-        );
-        if (result.rows.length > 0 && result.rows[0].session_data) {
+        await ensureSessionSchema();
+        const result = await pool.query(`
+            SELECT session_hash, is_connected, last_connected_at,
+                   (session_blob IS NOT NULL OR session_data IS NOT NULL) AS has_data
+            FROM whatsapp_session WHERE session_id = $1
+        `, [SESSION_ID]);
+        if (result.rows.length > 0 && result.rows[0].has_data) {
             return {
                 exists: true,
+                hash: result.rows[0].session_hash,
                 isConnected: result.rows[0].is_connected,
                 lastConnected: result.rows[0].last_connected_at
             };
@@ -105,7 +202,7 @@ async function checkSessionExists() {
     } catch (err) {
         console.error('Error checking session:', err.message);
     }
-    return { exists: false, isConnected: false, lastConnected: null };
+    return { exists: false, hash: null, isConnected: false, lastConnected: null };
 }
 
 /**
@@ -198,23 +295,30 @@ function createClient() {
 
 /**
  * Restore session from database to local storage
+ * If the local copy already matches the stored hash, nothing is downloaded.
  */
 async function restoreSessionFromDB() {
-    const sessionData = await loadSessionFromDB();
-    if (sessionData) {
-        // Ensure directory exists
-        if (!fs.existsSync(LOCAL_SESSION_PATH)) {
-            fs.mkdirSync(LOCAL_SESSION_PATH, { recursive: true });
-        }
+    const sessionDir = path.join(LOCAL_SESSION_PATH, `session-${SESSION_ID}`);
+
+    const sessionInfo = await checkSessionExists();
+    if (!sessionInfo.exists) {
+        return false;
+    }
+
+    if (sessionInfo.hash && sessionInfo.hash === readLocalVersion() && fs.existsSync(sessionDir)) {
+        console.log('Session restored from local cache');
+        return true;
+    }
 
-        // Write session files
-        const sessionDir = path.join(LOCAL_SESSION_PATH, `session-${SESSION_ID}`);
+    const session = await loadSessionFromDB();
+    if (session) {
+        // Ensure directory exists
         if (!fs.existsSync(sessionDir)) {
             fs.mkdirSync(sessionDir, { recursive: true });
         }
 
         // Write the session data files
-        for (const [filename, content] of Object.entries(sessionData)) {
+        for (const [filename, content] of Object.entries(session.data)) {
             const filePath = path.join(sessionDir, filename);
             if (typeof content === 'object') {
                 fs.writeFileSync(filePath, JSON.stringify(content));
@@ -223,6 +327,7 @@ async function restoreSessionFromDB() {
             }
         }
 
+        writeLocalVersion(session.hash);
         console.log('Session restored from database');
         return true;
     }
@@ -231,6 +336,7 @@ async function restoreSessionFromDB() {
 
 /**
  * Backup local session to database
+ * Skips the write when the session has not changed since it was last stored.
  */
 async function backupSessionToDB() {
     const sessionDir = path.join(LOCAL_SESSION_PATH, `session-${SESSION_ID}`);
@@ -258,7 +364,17 @@ async function backupSessionToDB() {
             }
         }
 
-        await saveSessionToDB(sessionData);
+        const hash = hashSession(serializeSession(sessionData));
+        if (hash === readLocalVersion()) {
+            console.log('Session unchanged since last backup');
+            return true;
+        }
+
+        const savedHash = await saveSessionToDB(sessionData);
+        if (!savedHash) {
+            return false;
+        }
+        writeLocalVersion(savedHash);
         return true;
     } catch (err) {
         console.error('Error backing up session:', err.message);
@@ -277,5 +393,6 @@ module.exports = {
     restoreSessionFromDB,
     backupSessionToDB,
     SESSION_ID,
-    LOCAL_SESSION_PATH
+    LOCAL_SESSION_PATH,
+    LOCAL_VERSION_FILE
 };
@@ -0,0 +1,187 @@
+"""
+whatsapp_status.py - Cached WhatsApp session health
+Probing the session boots Chromium via `node check_session.js` (up to 45s),
+so it must never happen inside a page request. Instead:
+  - The last probe result is stored in system_settings (WHATSAPP_SESSION_STATUS)
+    with a timestamp, plus a short in-memory copy per worker.
+  - Probes run in a background thread, either on a schedule
+    (scheduler.py -> probe_if_stale) or when an admin asks (refresh_async).
+  - A DB claim (WHATSAPP_STATUS_REFRESH_AT) stops several workers from
+    probing at the same time.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+STATUS_KEY = 'WHATSAPP_SESSION_STATUS'
+REFRESH_KEY = 'WHATSAPP_STATUS_REFRESH_AT'
+
+MEMORY_TTL_SECONDS = 30        # In-memory copy; avoids a DB read on every poll
+REFRESH_CLAIM_SECONDS = 90     # A probe takes <= 45s; claims older than this are stale
+MONITOR_INTERVAL_SECONDS = int(os.getenv('WHATSAPP_STATUS_INTERVAL', '1800'))
+
+_memory = {'status': None, 'loaded_at': 0.0}
+_memory_lock = threading.Lock()
+
+
+def _parse_ts(val):
+    try:
+        return datetime.fromisoformat(val) if val else None
+    except ValueError:
+        return None
+
+
+def record_status(status):
+    """Stores a probe (or send) outcome as the current session status."""
+    status = dict(status or {})
+    status['checked_at'] = datetime.now().isoformat(timespec='seconds')
+
+    conn = get_db_connection()
+    if conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO system_settings (setting_key, setting_value, description)
+                VALUES (%s, %s, 'Cached WhatsApp session probe result (JSON)')
+                ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value
+            """, (STATUS_KEY, json.dumps(status)))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Could not cache WhatsApp status: {e}")
+        finally:
+            conn.close()
+
+    with _memory_lock:
+        _memory['status'] = status
+        _memory['loaded_at'] = time.monotonic()
+    return status
+
+
+def get_cached_status(max_age=MEMORY_TTL_SECONDS):
+    """
+    Returns the last known status dict (never probes).
+    Adds 'refreshing': True while a probe is in flight.
+    Returns {'status': 'unknown'} if nothing has been recorded yet.
+    """
+    with _memory_lock:
+        if _memory['status'] is not None and time.monotonic() - _memory['loaded_at'] < max_age:
+            return dict(_memory['status'])
+
+    status = {'status': 'unknown', 'message': 'Session has not been checked yet.'}
+    refresh_at = None
+
+    conn = get_db_connection()
+    if conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT setting_key, setting_value FROM system_settings
+                WHERE setting_key IN (%s, %s)
+            """, (STATUS_KEY, REFRESH_KEY))
+            for row in cur.fetchall():
+                key = row['setting_key'] if isinstance(row, dict) else row[0]
+                val = row['setting_value'] if isinstance(row, dict) else row[1]
+                if key == STATUS_KEY and val:
+                    try:
+                        status = json.loads(val)
+                    except ValueError:
+                        pass
+                elif key == REFRESH_KEY:
+                    refresh_at = _parse_ts(val)
+        except Exception as e:
+            logger.warning(f"Could not read cached WhatsApp status: {e}")
+        finally:
+            conn.close()
+
+    checked_at = _parse_ts(status.get('checked_at'))
+    status['refreshing'] = bool(
+        refresh_at
+        and datetime.now() - refresh_at < timedelta(seconds=REFRESH_CLAIM_SECONDS)
+        and (checked_at is None or refresh_at > checked_at)
+    )
+
+    # Only memoize settled states so pollers see a probe finish promptly
+    if not status['refreshing']:
+        with _memory_lock:
+            _memory['status'] = dict(status)
+            _memory['loaded_at'] = time.monotonic()
+    return status
+
+
+def _claim_refresh():
+    """Atomically claims the probe slot. Returns False if another worker is probing."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cur = conn.cursor()
+        now = datetime.now()
+        cur.execute("""
+            INSERT INTO system_settings (setting_key, setting_value, description)
+            VALUES (%s, %s, 'Start time of the in-flight WhatsApp session probe')
+            ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value
+            WHERE system_settings.setting_value IS NULL
+               OR system_settings.setting_value = ''
+               OR system_settings.setting_value::TIMESTAMP < %s
+            RETURNING setting_key
+        """, (REFRESH_KEY, now.isoformat(timespec='seconds'), now - timedelta(seconds=REFRESH_CLAIM_SECONDS)))
+        claimed = cur.fetchone() is not None
+        conn.commit()
+        return claimed
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not claim WhatsApp status refresh: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def refresh_now():
+    """Runs a probe synchronously (call from a background thread only)."""
+    if not _claim_refresh():
+        return None
+    import alerts
+    with _memory_lock:
+        _memory['status'] = None
+    return record_status(alerts.check_whatsapp_session())
+
+
+def refresh_async():
+    """Starts a probe in the background. Returns False if one is already running."""
+    if not _claim_refresh():
+        return False
+
+    def _run():
+        import alerts
+        try:
+            record_status(alerts.check_whatsapp_session())
+        except Exception as e:
+            logger.warning(f"WhatsApp status probe failed: {e}")
+            record_status({'status': 'error', 'message': str(e)})
+
+    with _memory_lock:
+        _memory['status'] = None
+    threading.Thread(target=_run, name="whatsapp-status-probe", daemon=True).start()
+    return True
+
+
+def probe_if_stale(interval=MONITOR_INTERVAL_SECONDS):
+    """
+    Re-probes the session if automation is enabled and the last result is
+    older than `interval` seconds. Run periodically by scheduler.py.
+    """
+    import alerts
+    if interval <= 0 or not alerts._check_whatsapp_enabled():
+        return None
+    status = get_cached_status(max_age=0)
+    checked_at = _parse_ts(status.get('checked_at'))
+    if checked_at is None or datetime.now() - checked_at >= timedelta(seconds=interval):
+        return refresh_now()
+    return None
@@ -0,0 +1,27 @@
+"""
+worker.py - Background job worker
+Runs job_queue jobs outside the web processes. Start as many as needed:
+
+    python worker.py            # run forever
+    python worker.py --once     # drain the queue, then exit
+
+Set JOB_WORKER_MODE=external on the web service so it stops running jobs inline.
+
+Only run this on the same host as the web processes: job results
+(JOB_ARTIFACT_DIR) and logs/app.log are local files, so a worker on another
+dyno/container would write exports the web service cannot serve and rotate
+its own log. The supported deployment is the default inline mode.
+"""
+import sys
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+import job_queue
+
+if __name__ == '__main__':
+    logging.getLogger(__name__).info("Job worker started")
+    job_queue.run_worker(once='--once' in sys.argv)